@@ -0,0 +1,235 @@
+"""Offline batch rendering of a model along a camera path into a file.
+
+Frames are rendered without a terminal at any size and streamed to disk one
+by one, so memory does not grow with the frame count. A writer thread does
+the file I/O while the next frame renders; the queue between them holds a
+few frames at most. Two formats:
+
+- ``ansi``: the escape sequences ``draw()`` would send to a terminal (the
+  first frame in full, then only the cells that changed), ready for
+  ``cat``.
+- ``binary``: fixed-size frames of cell arrays, see ``encodeCells()``;
+  ``readFrames()`` reads them back.
+
+Usage:
+    python batch.py Car.obj --frames 120 --size 160x48 -o car.ansi
+    python batch.py Man.obj --path dolly --mode braille --format binary -o man.mgf
+"""
+import argparse
+import io
+import os
+import struct
+import sys
+import threading
+from array import array
+from queue import Queue
+from time import perf_counter
+
+import moteur_graphique as mg
+from benchmark import PATHS, cameraPath, loadMesh, meshBounds, parseSize, sceneLights
+
+FORMATS = ["ansi", "binary"]
+# Binary file header: magic, columns, rows
+MAGIC = b"MGF1"
+HEADER = struct.Struct("<4sHH")
+# Cell flags of the binary format
+HAS_FOREGROUND, HAS_BACKGROUND = 1, 2
+# Frames rendered ahead of the writer before rendering waits
+QUEUE_FRAMES = 4
+
+# Memoized binary records by cell string
+_cellRecords = {}
+
+
+def _cellRecord(cell):
+    """Return ``(flags, foreground RGB, background RGB, code point)`` of a cell string."""
+    record = _cellRecords.get(cell)
+    if record is None:
+        flags, fg, bg = 0, (0, 0, 0), (0, 0, 0)
+        for escape in cell[:-1].split('m')[:-1]:
+            if escape.startswith('\033[38;2;'):
+                flags |= HAS_FOREGROUND
+                fg = tuple(int(c) for c in escape[7:].split(';'))
+            elif escape.startswith('\033[48;2;'):
+                flags |= HAS_BACKGROUND
+                bg = tuple(int(c) for c in escape[7:].split(';'))
+        record = _cellRecords[cell] = (flags, fg, bg, ord(cell[-1]))
+    return record
+
+
+def encodeCells(cells) -> bytes:
+    """Pack the cells of one frame (``mg.cells()``) into the binary frame format.
+
+    A frame of ``n`` cells is ``n`` flag bytes (``HAS_FOREGROUND``,
+    ``HAS_BACKGROUND``), ``3n`` foreground RGB bytes, ``3n`` background RGB
+    bytes and ``n`` little-endian uint16 glyph code points, 9 bytes per cell.
+    A colour without its flag is the terminal default.
+    """
+    flags = bytearray()
+    foreground = bytearray()
+    background = bytearray()
+    glyphs = array('H')
+    for cell in cells:
+        flag, fg, bg, glyph = _cellRecord(cell)
+        flags.append(flag)
+        foreground += bytes(fg)
+        background += bytes(bg)
+        glyphs.append(glyph)
+    if sys.byteorder == 'big':
+        glyphs.byteswap()
+    return bytes(flags + foreground + background) + glyphs.tobytes()
+
+
+def readFrames(path):
+    """Yield ``(flags, foreground, background, glyphs)`` for each frame of a binary file.
+
+    ``flags`` is a bytes object of one byte per cell, the colours are bytes
+    of three per cell and ``glyphs`` an ``array('H')`` of code points, all
+    in row order; the size is given by the header as ``columns`` x ``rows``.
+    """
+    with open(path, 'rb') as file:
+        magic, columns, rows = HEADER.unpack(file.read(HEADER.size))
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a frame file")
+        n = columns * rows
+        while True:
+            frame = file.read(9 * n)
+            if len(frame) < 9 * n:
+                return
+            glyphs = array('H', frame[7 * n:])
+            if sys.byteorder == 'big':
+                glyphs.byteswap()
+            yield frame[:n], frame[n:4 * n], frame[4 * n:7 * n], glyphs
+
+
+class FrameWriter:
+    """Write byte strings to a file from a background thread.
+
+    ``write()`` only queues the data, so the caller keeps rendering while the
+    previous frames are written; it blocks when ``depth`` frames are waiting.
+    An I/O error in the thread is raised by the next ``write()`` or ``close()``.
+    """
+
+    def __init__(self, file, depth=QUEUE_FRAMES) -> None:
+        self.file = file
+        self.bytes = 0
+        self.writeTime = 0.0
+        self._queue = Queue(depth)
+        self._error = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            data = self._queue.get()
+            if data is None:
+                return
+            if self._error is not None:
+                continue
+            start = perf_counter()
+            try:
+                self.file.write(data)
+            except OSError as error:
+                self._error = error
+            self.writeTime += perf_counter() - start
+            self.bytes += len(data)
+
+    def write(self, data):
+        if self._error is not None:
+            raise self._error
+        self._queue.put(data)
+
+    def close(self):
+        """Write what is still queued, stop the thread and flush the file."""
+        self._queue.put(None)
+        self._thread.join()
+        if self._error is not None:
+            raise self._error
+        self.file.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def renderBatch(mesh, cameras, file, format="ansi"):
+    """Render ``mesh`` from each camera of ``cameras`` and stream the frames to ``file``.
+
+    ``file`` is a binary file open for writing; the frame size is the current
+    ``mg.columns`` x ``mg.rows``. Returns ``(frames, seconds, renderSeconds,
+    writer)``, ``renderSeconds`` being the time spent rendering and encoding.
+    """
+    if format not in FORMATS:
+        raise ValueError(f"unknown format {format!r}, expected one of {', '.join(FORMATS)}")
+    lights = sceneLights()
+    # Start from an empty screen: the first ANSI frame repaints every cell
+    mg.resize(mg.columns, mg.rows)
+    frames = 0
+    renderTime = 0.0
+    start = perf_counter()
+    with FrameWriter(file) as writer:
+        if format == "binary":
+            writer.write(HEADER.pack(MAGIC, mg.columns, mg.rows))
+        else:
+            writer.write(b'\033[2J')
+        text = io.StringIO()
+        for cam in cameras:
+            frameStart = perf_counter()
+            mg.clear(' ')
+            mg.putMesh(mesh, cam, lights)
+            if format == "binary":
+                data = encodeCells(mg.cells())
+            else:
+                text.seek(0)
+                text.truncate()
+                mg.draw(text)
+                data = text.getvalue().encode('utf-8')
+            renderTime += perf_counter() - frameStart
+            writer.write(data)
+            frames += 1
+    return frames, perf_counter() - start, renderTime, writer
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Render a model along a camera path into a file")
+    parser.add_argument("model", help="model file in object/")
+    parser.add_argument("--path", choices=PATHS, default="orbit", help="camera path (default orbit)")
+    parser.add_argument("--frames", type=int, default=60)
+    parser.add_argument("--size", type=parseSize, default=(80, 24), metavar="WxH",
+                        help="frame size in terminal cells (default 80x24)")
+    parser.add_argument("--mode", choices=list(mg.OUTPUT_MODES), default="block")
+    parser.add_argument("--format", choices=FORMATS, default="ansi")
+    parser.add_argument("--mesh", choices=["indexed", "array"], default="indexed",
+                        help="mesh representation given to putMesh")
+    parser.add_argument("--zbuffer", action="store_true", help="render with the depth buffer")
+    parser.add_argument("-o", "--output", help="output file (default <model>.ansi or <model>.mgf)")
+    args = parser.parse_args(argv)
+
+    if args.frames <= 0:
+        parser.error("--frames must be positive")
+    if args.mesh == "array" and mg.np is None:
+        parser.error("--mesh array requires NumPy")
+    output = args.output or os.path.splitext(os.path.basename(args.model))[0] + (".ansi" if args.format == "ansi" else ".mgf")
+    output = os.path.abspath(output)
+    # The models are looked up relative to the repository root
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+    mg.DEPTH_BUFFER_ENABLED = args.zbuffer
+    mg.setOutputMode(args.mode)
+    mg.resize(*args.size)
+    mesh = loadMesh(args.model, args.mesh)
+    centre, radius = meshBounds(mesh)
+    with open(output, "wb") as file:
+        frames, seconds, renderTime, writer = renderBatch(mesh, cameraPath(args.path, centre, radius, args.frames),
+                                                          file, args.format)
+    print(f"{frames} frames {args.size[0]}x{args.size[1]} {args.mode} -> {output}")
+    print(f"{frames / seconds:.1f} fps ({seconds:.2f} s: render {renderTime * 1000 / frames:.1f} ms/frame, "
+          f"write {writer.writeTime * 1000 / frames:.1f} ms/frame overlapped), "
+          f"{writer.bytes} bytes ({writer.bytes / frames:.0f} per frame)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
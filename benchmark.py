@@ -0,0 +1,332 @@
+"""Headless rendering benchmark over the models in ``object/``.
+
+Each model is rendered along a few fixed camera paths at several screen
+sizes. Frames are drawn into an in-memory buffer, so no terminal or keyboard
+is needed. The report gives frames per second, the mean time of each stage
+(from ``profiler.FrameProfiler``), the bytes ``draw()`` would have written and
+the peak Python memory of one frame. Models are drawn with their levels of
+detail unless ``--nolod`` is given; the report shows the highest level used
+and the triangles it saved per frame, and the lighting evaluations per frame
+(smooth shading unless ``--flat``). ``--shadows`` lights the models through
+shadow maps (``shadows.py``), built once per case since the lights are still.
+A baseline records the rendering options with the results; ``--compare``
+refuses a baseline saved with other options.
+
+Usage:
+    python benchmark.py                          # all models, default sizes
+    python benchmark.py --models Car.obj --sizes 120x40 --frames 20
+    python benchmark.py --save baseline.json     # record a baseline
+    python benchmark.py --compare baseline.json  # exit 1 on regressions
+    python benchmark.py --transform              # vertex transform microbenchmark
+    python benchmark.py --clip                   # near-plane clipping microbenchmark
+"""
+import argparse
+import io
+import json
+import os
+import sys
+import tracemalloc
+from math import asin, atan2, cos, pi, sin
+from time import perf_counter
+
+import moteur_graphique as mg
+from lib_math import ViewTransform, vec3
+from profiler import FrameProfiler
+from shadows import ShadowMaps
+
+MODELS = ["cube.obj", "octahedron.obj", "Car.obj", "Man.obj", "ele.obj", "moto_simple_1.obj"]
+SIZES = [(80, 24), (160, 48)]
+STAGES = ["putMesh", "shadows", "transform", "sort", "clip", "lighting", "raster", "draw"]
+# Stages checked by --compare
+WATCHED = ["frame", "putMesh", "lighting", "raster"]
+# Options stored with a baseline; --compare refuses a baseline saved with other values
+COMPARED_OPTIONS = ["mesh", "zbuffer", "nolod", "flat", "shadows", "mode"]
+
+
+def sceneLights():
+    """Same light setup as main.py, without animation."""
+    return [mg.LightSource(vec3(4, 20, 20), (255, 255, 170), 0.8),
+            mg.LightSource(vec3(0, 5, 0), (0, 0, 255), 0.4),
+            mg.LightSource(vec3(0, 5, 0), (255, 0, 0), 0.4),
+            mg.LightSource(vec3(-4, -20, -20), (255, 255, 170), 0.8)]
+
+
+def meshBounds(mesh):
+    """Return the centre and radius of the box around the mesh vertices."""
+    if isinstance(mesh, mg.IndexedMesh):
+        points = [(v.x, v.y, v.z) for v in mesh.vertices]
+    elif isinstance(mesh, mg.ArrayMesh):
+        points = mesh.vertices.tolist()
+    else:
+        points = [(v.x, v.y, v.z) for t in mesh for v in (t.v1, t.v2, t.v3)]
+    low = [min(p[i] for p in points) for i in range(3)]
+    high = [max(p[i] for p in points) for i in range(3)]
+    centre = vec3(*[(a + b) / 2 for a, b in zip(low, high)])
+    radius = max(b - a for a, b in zip(low, high)) / 2 or 1.0
+    return centre, radius
+
+
+def lookAtCamera(position, target):
+    """Return a Camera at ``position`` looking at ``target``."""
+    direction = (target - position).normalize()
+    pitch = asin(max(-1.0, min(1.0, direction.y)))
+    yaw = atan2(-direction.x, direction.z)
+    return mg.Camera(position, pitch, yaw)
+
+
+def cameraPath(name, centre, radius, frames):
+    """Yield the cameras of a named path around a model."""
+    for i in range(frames):
+        t = i / max(frames - 1, 1)
+        if name == "orbit":
+            # Full turn at a distance that keeps the whole model on screen
+            angle = 2 * pi * t
+            offset = vec3(sin(angle) * 3 * radius, radius, cos(angle) * 3 * radius)
+        elif name == "dolly":
+            # Straight approach from far away to close range
+            offset = vec3(0.3 * radius, 0.5 * radius, (4 - 3.2 * t) * radius)
+        elif name == "close":
+            # Sweep near the surface: large triangles and near-plane clipping
+            angle = pi * t
+            offset = vec3(sin(angle) * 0.9 * radius, 0.2 * radius, cos(angle) * 0.9 * radius)
+        else:
+            raise ValueError(f"unknown camera path {name!r}")
+        yield lookAtCamera(centre + offset, centre)
+
+
+PATHS = ["orbit", "dolly", "close"]
+
+
+def loadMesh(name, kind):
+    if kind == "array":
+        return mg.loadArrayMesh(name)
+    mesh = mg.loadObj(name)
+    return mesh.triangles() if kind == "list" else mesh
+
+
+def renderFrame(mesh, cam, lights, out):
+    mg.clear(' ')
+    if mg.shadowMaps is not None:
+        mg.shadowMaps.update(lights, [mesh])
+    mg.putMesh(mesh, cam, lights)
+    out.seek(0)
+    out.truncate()
+    mg.draw(out)
+
+
+def runCase(mesh, pathName, size, frames):
+    """Render one model along one path at one size and return its statistics."""
+    mg.resize(*size)
+    lights = sceneLights()
+    centre, radius = meshBounds(mesh)
+    out = io.StringIO()
+
+    # Peak memory of a single frame, measured outside the timed run
+    tracemalloc.start()
+    renderFrame(mesh, next(cameraPath(pathName, centre, radius, 1)), lights, out)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    prof = FrameProfiler(window=frames)
+    mg.setProfiler(prof)
+    try:
+        for cam in cameraPath(pathName, centre, radius, frames):
+            prof.beginFrame()
+            with prof.stage('clear'):
+                mg.clear(' ')
+            with prof.stage('putMesh'):
+                if mg.shadowMaps is not None:
+                    mg.shadowMaps.update(lights, [mesh])
+                mg.putMesh(mesh, cam, lights)
+            out.seek(0)
+            out.truncate()
+            with prof.stage('draw'):
+                mg.draw(out)
+            prof.add('bytes', mg.bytesPerFrame)
+            prof.endFrame()
+    finally:
+        mg.setProfiler(None)
+
+    records = list(prof.recent)
+    result = {name: sum(r.get(name, 0) for r in records) / len(records)
+              for name in STAGES + ["frame", "bytes", "trianglesSaved", "lightEvals"]}
+    result["lod"] = max(r.get("lodLevel", 0) for r in records)
+    result["fps"] = prof.fps()
+    result["p99"] = prof.percentile(99)
+    result["peakKiB"] = peak / 1024
+    return result
+
+
+def transformBenchmark(models, repeat=5):
+    """Time the per-vertex camera transform and projection of each model, both ways.
+
+    ``chained`` is the vector-method chain (translate, rotationY, rotationX,
+    projection, toScreen: five temporaries and four cos/sin per vertex),
+    ``fused`` is ``lib_math.ViewTransform`` with the rotation precomputed.
+    """
+    print(f"{'model':20} {'vertices':>8} {'chained ms':>10} {'fused ms':>9} {'speedup':>7}")
+    for model in models:
+        mesh = mg.loadObj(model, levels=False)
+        vertices = mesh.vertices
+        centre, radius = meshBounds(mesh)
+        cam = next(cameraPath("orbit", centre, radius, 1))
+        offset = -1 * cam.position
+
+        def chained():
+            for v in vertices:
+                (v + offset).rotationY(cam.yaw).rotationX(cam.pitch).projection(cam.focalLenth).toScreen()
+
+        def fused():
+            transform = ViewTransform(cam)
+            view, screen = transform.view, transform.screen
+            for v in vertices:
+                screen(view(v))
+
+        times = []
+        for function in (chained, fused):
+            best = float("inf")
+            for _ in range(repeat):
+                start = perf_counter()
+                function()
+                best = min(best, perf_counter() - start)
+            times.append(best)
+        print(f"{model:20} {len(vertices):8d} {times[0] * 1000:10.2f} {times[1] * 1000:9.2f} {times[0] / times[1]:6.1f}x")
+
+
+def clipBenchmark(models, repeat=5):
+    """Time near-plane clipping of every triangle of each model, both ways.
+
+    ``clip()`` is called once per Triangle3D, as the list path does, and
+    ``clipTriangles()`` clips the whole ``(n, 3, 3)`` array at once, as the
+    array path does. The camera is the first one of the ``close`` path, so
+    the near plane cuts through the model.
+    """
+    print(f"{'model':20} {'triangles':>9} {'crossing':>8} {'clip() ms':>9} {'batch ms':>8} {'Mtri/s':>7} {'speedup':>7}")
+    for model in models:
+        mesh = mg.loadObj(model, levels=False)
+        triangles = mesh.triangles()
+        tris = mg.np.array([[v.printco() for v in (t.v1, t.v2, t.v3)] for t in triangles], dtype=mg.np.float64)
+        centre, radius = meshBounds(mesh)
+        cam = next(cameraPath("close", centre, radius, 1))
+        lookAt = cam.getLookAtDirection()
+        camPos, planeNormal = mg.np.array(cam.position.printco()), mg.np.array(lookAt.printco())
+        crossing = len(mg.np.unique(mg.clipTriangles(tris, camPos, planeNormal)[2]))
+
+        def scalar():
+            for triangle in triangles:
+                mg.clip(triangle, cam.position, lookAt)
+
+        def batch():
+            mg.clipTriangles(tris, camPos, planeNormal)
+
+        times = []
+        for function in (scalar, batch):
+            best = float("inf")
+            for _ in range(repeat):
+                start = perf_counter()
+                function()
+                best = min(best, perf_counter() - start)
+            times.append(best)
+        print(f"{model:20} {len(triangles):9d} {crossing:8d} {times[0] * 1000:9.2f} {times[1] * 1000:8.2f} "
+              f"{len(triangles) / times[1] / 1e6:7.1f} {times[0] / times[1]:6.1f}x")
+
+
+def parseSize(text):
+    w, h = text.lower().split("x")
+    return int(w), int(h)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Headless rendering benchmark")
+    parser.add_argument("--models", nargs="+", default=MODELS)
+    parser.add_argument("--paths", nargs="+", default=PATHS, choices=PATHS)
+    parser.add_argument("--sizes", nargs="+", type=parseSize, default=SIZES, metavar="WxH")
+    parser.add_argument("--frames", type=int, default=20)
+    parser.add_argument("--mesh", choices=["indexed", "list", "array"], default="indexed",
+                        help="mesh representation given to putMesh")
+    parser.add_argument("--zbuffer", action="store_true", help="render with the depth buffer")
+    parser.add_argument("--nolod", action="store_true", help="always render the full meshes")
+    parser.add_argument("--flat", action="store_true", help="flat shading per face instead of smooth shading")
+    parser.add_argument("--shadows", action="store_true", help="light the models with shadow maps")
+    parser.add_argument("--mode", choices=list(mg.OUTPUT_MODES), default="block",
+                        help="output mode; sizes are in terminal cells")
+    parser.add_argument("--transform", action="store_true",
+                        help="only time the per-vertex camera transform (vector chain against ViewTransform)")
+    parser.add_argument("--clip", action="store_true",
+                        help="only time near-plane clipping (clip() per triangle against clipTriangles())")
+    parser.add_argument("--save", metavar="FILE", help="write the results as a JSON baseline")
+    parser.add_argument("--compare", metavar="FILE", help="compare against a JSON baseline")
+    parser.add_argument("--tolerance", type=float, default=0.15,
+                        help="allowed slowdown before a stage counts as a regression (default 15%%)")
+    args = parser.parse_args(argv)
+
+    if args.transform:
+        transformBenchmark(args.models)
+        return 0
+    if args.clip:
+        if mg.np is None:
+            parser.error("--clip requires NumPy")
+        clipBenchmark(args.models)
+        return 0
+    if args.mesh == "array" and mg.np is None:
+        parser.error("--mesh array requires NumPy")
+    baseline = None
+    if args.compare:
+        # Check the baseline before the run: its timings only mean something with the same options
+        with open(args.compare) as file:
+            saved = json.load(file)
+        if "options" not in saved:
+            parser.error(f"{args.compare} has no recorded options; save the baseline again")
+        different = [f"{name} {saved['options'].get(name)!r} (now {getattr(args, name)!r})"
+                     for name in COMPARED_OPTIONS if saved["options"].get(name) != getattr(args, name)]
+        if different:
+            parser.error(f"{args.compare} was saved with other options: " + ", ".join(different))
+        baseline = saved["cases"]
+    mg.DEPTH_BUFFER_ENABLED = args.zbuffer
+    mg.LOD_ENABLED = not args.nolod
+    mg.SMOOTH_SHADING_ENABLED = not args.flat
+    mg.shadowMaps = ShadowMaps() if args.shadows else None
+    mg.setOutputMode(args.mode)
+
+    results = {}
+    print(f"{'case':40} {'fps':>7} {'p99 ms':>7} " + " ".join(f"{s:>9}" for s in STAGES)
+          + f" {'bytes':>7} {'peak KiB':>9} {'lod':>3} {'saved':>6} {'lit':>5}")
+    for model in args.models:
+        mesh = loadMesh(model, args.mesh)
+        for pathName in args.paths:
+            for size in args.sizes:
+                case = f"{model}/{pathName}/{size[0]}x{size[1]}"
+                result = results[case] = runCase(mesh, pathName, size, args.frames)
+                print(f"{case:40} {result['fps']:7.1f} {result['p99'] * 1000:7.1f} "
+                      + " ".join(f"{result[s] * 1000:9.2f}" for s in STAGES)
+                      + f" {result['bytes']:7.0f} {result['peakKiB']:9.0f} {result['lod']:3d} {result['trianglesSaved']:6.0f}"
+                      + f" {result['lightEvals']:5.0f}")
+    print("(stage columns are mean milliseconds per frame; lit is lighting evaluations per frame)")
+
+    options = {name: getattr(args, name) for name in COMPARED_OPTIONS}
+    if args.save:
+        with open(args.save, "w") as file:
+            json.dump({"options": options, "cases": results}, file, indent=1)
+
+    if args.compare:
+        regressions = []
+        for case, result in results.items():
+            if case not in baseline:
+                continue
+            for stage in WATCHED:
+                old, new = baseline[case].get(stage, 0), result.get(stage, 0)
+                if old > 0 and new > old * (1 + args.tolerance):
+                    regressions.append(f"{case} {stage}: {old * 1000:.2f} ms -> {new * 1000:.2f} ms (+{(new / old - 1) * 100:.0f}%)")
+        if regressions:
+            print(f"{len(regressions)} regression(s) against {args.compare}:")
+            for line in regressions:
+                print("  " + line)
+            return 1
+        print(f"No regression against {args.compare}")
+    return 0
+
+
+if __name__ == "__main__":
+    # The models are looked up relative to the repository root
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    sys.exit(main())
@@ -0,0 +1,252 @@
+"""View-frustum culling with a bounding-volume hierarchy.
+
+``buildBVH`` groups the faces of a mesh into a binary tree of bounding
+spheres at load time. Each frame, ``visibleLeaves`` walks the tree and
+rejects whole groups that lie behind the near plane or outside one of the
+four side planes of the view frustum. The side planes follow the projection
+of ``lib_math`` (``Camera.focalLenth`` and the terminal aspect) and are
+widened by half a pixel, so culling never removes a pixel that would have
+been drawn.
+
+Back faces are culled with temporal coherence: a face keeps facing the same
+way until the camera crosses its plane, so ``FacingCache`` keeps the
+distance of a reference camera position to the plane of every face and only
+tests again the faces whose plane may have been crossed since.
+"""
+from math import inf, sqrt
+
+from lib_math import ViewTransform, dot, vec3
+
+LEAF_SIZE = 32
+
+# Share of the faces tested again in a frame above which the next frame
+# measures the plane distances from the camera anew
+REBASE_FRACTION = 0.05
+# Relative safety margin of the reused answers over the rounding error of
+# the facing test
+FACING_MARGIN = 1e-9
+
+# Outcode bits of a view-space point outside a side plane
+LEFT, RIGHT, TOP, BOTTOM = 1, 2, 4, 8
+
+
+class BVHNode:
+    """Node of the face hierarchy, bounded by a sphere.
+
+    Attributes:
+        center (vec3): Sphere centre in world space.
+        radius (float): Sphere radius.
+        children (tuple[BVHNode, BVHNode] | None): Sub-trees of an inner node.
+        faces (list[int]): Face indices of a leaf (empty for inner nodes).
+        vertices (list[int]): Vertex indices used by the faces of a leaf.
+    """
+    __slots__ = ('center', 'radius', 'children', 'faces', 'vertices')
+
+    def __init__(self, center, radius, children=None, faces=(), vertices=()) -> None:
+        self.center = center
+        self.radius = radius
+        self.children = children
+        self.faces = list(faces)
+        self.vertices = list(vertices)
+
+
+def buildBVH(vertices, faces, leafSize=LEAF_SIZE) -> BVHNode:
+    """Build a sphere hierarchy over ``faces`` (vertex index triples) by median splits."""
+    centroids = []
+    for a, b, c in faces:
+        va, vb, vc = vertices[a], vertices[b], vertices[c]
+        centroids.append(((va.x+vb.x+vc.x)/3, (va.y+vb.y+vc.y)/3, (va.z+vb.z+vc.z)/3))
+
+    def build(faceIds):
+        used = sorted({i for f in faceIds for i in faces[f]})
+        xs = [vertices[i].x for i in used]
+        ys = [vertices[i].y for i in used]
+        zs = [vertices[i].z for i in used]
+        low = (min(xs), min(ys), min(zs))
+        high = (max(xs), max(ys), max(zs))
+        center = vec3((low[0]+high[0])/2, (low[1]+high[1])/2, (low[2]+high[2])/2)
+        radius = max((vertices[i]-center).length() for i in used)
+        if len(faceIds) <= leafSize:
+            return BVHNode(center, radius, faces=faceIds, vertices=used)
+        axis = max(range(3), key=lambda k: high[k]-low[k])
+        faceIds = sorted(faceIds, key=lambda f: centroids[f][axis])
+        half = len(faceIds)//2
+        return BVHNode(center, radius, children=(build(faceIds[:half]), build(faceIds[half:])))
+
+    if not faces:
+        return BVHNode(vec3(0, 0, 0), 0.0)
+    return build(list(range(len(faces))))
+
+
+def transformBVH(root, transform, scale) -> BVHNode:
+    """Return a copy of a hierarchy moved by ``transform`` (vec3 -> vec3).
+
+    ``scale`` is the uniform scale factor of the transform. The face and
+    vertex index lists of the leaves are shared with ``root``, not copied.
+    """
+    def copy(node):
+        children = None
+        if node.children is not None:
+            children = (copy(node.children[0]), copy(node.children[1]))
+        moved = BVHNode(transform(node.center), node.radius*abs(scale), children)
+        moved.faces = node.faces
+        moved.vertices = node.vertices
+        return moved
+    return copy(root)
+
+
+def sidePlanes(cam, width, height, aspect=29/13):
+    """Return the view-space side planes ``(a, b, c, norm, bit)``.
+
+    A point is outside a plane when ``a*x + b*y + c*z > 0``, which means its
+    screen position is more than half a pixel beyond that edge of the screen.
+    ``aspect`` is the pixel shape correction of ``vec2.toScreen``.
+    """
+    kx = aspect*height/width*cam.focalLenth
+    ky = cam.focalLenth
+    planes = [(-kx, 0.0, -(1+1/width), LEFT),
+              (kx, 0.0, -(1-1/width), RIGHT),
+              (0.0, ky, -(1+1/height), TOP),
+              (0.0, -ky, -(1-1/height), BOTTOM)]
+    return [(a, b, c, sqrt(a*a+b*b+c*c), bit) for a, b, c, bit in planes]
+
+
+def outcode(view, planes) -> int:
+    """Bitmask of the side planes a view-space point is outside of."""
+    code = 0
+    for a, b, c, _, bit in planes:
+        if a*view.x+b*view.y+c*view.z > 0:
+            code |= bit
+    return code
+
+
+def visibleLeaves(root, cam, planes):
+    """Return ``(leaf, inside)`` pairs for the leaves that may be visible.
+
+    ``inside`` is True when the leaf sphere is entirely within the side
+    planes, so its faces need no further frustum test.
+    """
+    lookAt = cam.getLookAtDirection()
+    zNear = cam.position+0.1*lookAt
+    toView = ViewTransform(cam).view
+    result = []
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        center, radius = node.center, node.radius
+        # Entirely behind the near plane
+        if dot(zNear-center, lookAt) > radius:
+            continue
+        view = toView(center)
+        inside = True
+        for a, b, c, norm, _ in planes:
+            distance = a*view.x+b*view.y+c*view.z
+            if distance > radius*norm:
+                break
+            if distance > -radius*norm:
+                inside = False
+        else:
+            if node.children is None:
+                result.append((node, inside))
+            elif inside:
+                collectLeaves(node, result)
+            else:
+                stack.extend(node.children)
+    return result
+
+
+def collectLeaves(node, result):
+    """Append every leaf under ``node`` as fully inside."""
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        if node.children is None:
+            result.append((node, True))
+        else:
+            stack.extend(node.children)
+
+
+class FacingCache:
+    """Back-face culling of a mesh reused between frames.
+
+    The signed distance of the reference camera position to the plane of
+    each face is measured once. While the camera has travelled less than
+    that distance (plus a margin that covers the rounding of the test), it
+    is still on the same side of the plane and the face keeps its answer;
+    only the faces closer to their plane are tested again, exactly as the
+    renderer does (``dot(normal, a-camPos) < 0``). The distances are measured
+    again from the camera once more than ``REBASE_FRACTION`` of the faces
+    needed a test.
+
+    Attributes:
+        reference (vec3 | None): Camera position the distances are measured from.
+        distances (list[float]): Distance of ``reference`` to each face plane,
+            positive on the front side.
+        tested (int): Faces tested again in the last frame.
+    """
+    __slots__ = ('reference', 'distances', 'tested', 'rebase')
+
+    def __init__(self) -> None:
+        self.reference = None
+        self.distances = []
+        self.tested = 0
+        self.rebase = False
+
+    def measure(self, vertices, faces, normals, camPos):
+        """Measure the plane distances of every face from ``camPos``."""
+        cx, cy, cz = camPos.x, camPos.y, camPos.z
+        distances = []
+        for (a, _, _), n in zip(faces, normals):
+            v = vertices[a]
+            length = n.length()
+            # A degenerate face (null normal) never passes the test
+            distances.append(((cx-v.x)*n.x+(cy-v.y)*n.y+(cz-v.z)*n.z)/length if length > 0 else -inf)
+        self.distances = distances
+        self.reference = vec3(cx, cy, cz)
+        self.rebase = False
+
+    def frontFaces(self, mesh, faceIds, camPos, outside) -> list[int]:
+        """Return the faces of ``faceIds`` facing ``camPos``, in the same order.
+
+        Args:
+            mesh (IndexedMesh): Mesh the faces belong to.
+            faceIds (list[int]): Candidate faces.
+            camPos (vec3): Camera position.
+            outside (list[bool | None]): Vertices behind the near plane; the
+                faces using one are kept, as they are culled piece by piece
+                once clipped.
+        """
+        vertices, faces, normals = mesh.vertices, mesh.faces, mesh.normals
+        if self.rebase:
+            self.measure(vertices, faces, normals, camPos)
+        elif self.reference is None:
+            # First frame of the mesh (a moving scene node gets a new copy
+            # every frame): test the faces, measure from the next frame on
+            self.rebase = True
+            self.tested = len(faceIds)
+            return [f for f in faceIds
+                    if outside[faces[f][0]] or outside[faces[f][1]] or outside[faces[f][2]]
+                    or dot(normals[f], vertices[faces[f][0]]-camPos) < 0]
+        reference = self.reference
+        dx, dy, dz = camPos.x-reference.x, camPos.y-reference.y, camPos.z-reference.z
+        travel = sqrt(dx*dx+dy*dy+dz*dz)
+        bounds = mesh.bvh
+        margin = travel+FACING_MARGIN*((reference-bounds.center).length()+bounds.radius+travel)
+        distances = self.distances
+        front = []
+        tested = 0
+        for f in faceIds:
+            distance = distances[f]
+            if distance > margin:
+                front.append(f)
+                continue
+            a, b, c = faces[f]
+            if outside[a] or outside[b] or outside[c]:
+                front.append(f)
+            elif distance >= -margin:
+                tested += 1
+                if dot(normals[f], vertices[a]-camPos) < 0:
+                    front.append(f)
+        self.tested = tested
+        self.rebase = tested > REBASE_FRACTION*len(faceIds)
+        return front
@@ -1,108 +1,217 @@
-import sys
-import threading
-import time
-import platform
-
-# Importer les modules spécifiques au système d'exploitation
-if platform.system() == 'Windows':
-    import msvcrt  # Module pour la gestion des entrées clavier sous Windows
-else:
-    import select   # Module pour surveiller les entrées sous Unix
-    import tty      # Module pour configurer le terminal
-    import termios  # Module pour les attributs du terminal
-
-class KeyboardController:
-    """
-    Classe pour contrôler et lire les entrées du clavier en arrière-plan.
-    Fonctionne à la fois sous Windows et les systèmes Unix-like.
-    """
-
-    def __init__(self):
-        """
-        Initialisation du contrôleur clavier.
-        Démarre un thread pour lire les touches en continu.
-        """
-        self.key = None           # Variable pour stocker la dernière touche pressée
-        self.running = True       # Indicateur pour contrôler l'exécution du thread
-        self.thread = threading.Thread(target=self.read_key)  # Création du thread
-        self.thread.daemon = True  # Permet au thread de se fermer avec le programme principal
-        self.thread.start()         # Démarrage du thread
-
-    def read_key(self):
-        """
-        Méthode exécutée dans un thread séparé pour lire les touches du clavier.
-        Gère les différences entre Windows et les systèmes Unix-like.
-        """
-        if platform.system() == 'Windows':
-            self._read_key_windows()
-        else:
-            self._read_key_unix()
-
-    def _read_key_windows(self):
-        """
-        Lecture des touches sous Windows en utilisant le module msvcrt.
-        """
-        while self.running:
-            if msvcrt.kbhit():  # Vérifie si une touche a été pressée
-                first_char = msvcrt.getch()  # Lit le premier caractère
-                if first_char in (b'\x00', b'\xe0'):
-                    # Une touche spéciale a été pressée (comme les flèches)
-                    second_char = msvcrt.getch()  # Lit le deuxième caractère
-                    self.key = ('special', first_char + second_char)  # Stocke la touche spéciale
-                else:
-                    # Une touche normale a été pressée
-                    try:
-                        decoded_char = first_char.decode('utf-8', errors='ignore')
-                    except UnicodeDecodeError:
-                        decoded_char = ''  # En cas d'erreur de décodage
-                    self.key = ('normal', decoded_char)  # Stocke la touche normale
-            time.sleep(0.01)  # Petite pause pour éviter une utilisation CPU excessive
-
-    
-    def _read_key_unix(self):
-        """
-        Lecture des touches sous Unix-like en utilisant les modules select, tty et termios.
-        """
-        fd = sys.stdin.fileno()  # Obtenir le descripteur de fichier standard d'entrée
-        old_settings = termios.tcgetattr(fd)  # Sauvegarder les paramètres actuels du terminal
-        try:
-            tty.setcbreak(fd)  # Configurer le terminal en mode cbreak (lecture caractère par caractère)
-            while self.running:
-                # Utiliser select pour vérifier si une touche a été pressée
-                rlist, _, _ = select.select([sys.stdin], [], [], 0.1)
-                if rlist:
-                    ch1 = sys.stdin.read(1)  # Lire le premier caractère
-                    if ch1 == '\x1b':
-                        # Détecter une séquence d'échappement (comme les flèches)
-                        ch2 = sys.stdin.read(1)
-                        if ch2 == '[':
-                            ch3 = sys.stdin.read(1)
-                            if ch3 in 'ABCD':
-                                self.key = ('special', ch3)
-                            else:
-                                self.key = ('special', ch1 + ch2 + ch3)  # Autres séquences spéciales
-                        else:
-                            self.key = ('normal', ch1 + ch2)  # Séquence d'échappement simple
-                    else:
-                        self.key = ('normal', ch1)  # Touche normale
-        finally:
-            termios.tcsetattr(fd, termios.TCSADRAIN, old_settings)  # Restaurer les paramètres du terminal
-
-    def get_key(self):
-        """
-        Récupère la dernière touche pressée et réinitialise la variable key.
-        
-        Returns:
-            tuple or None: Un tuple contenant le type de touche ('normal', 'special', 'escape')
-                           et la valeur de la touche, ou None si aucune touche n'a été pressée.
-        """
-        key = self.key
-        self.key = None  # Réinitialiser la touche après la lecture
-        return key
-
-    def stop(self):
-        """
-        Arrête le thread de lecture des touches et attend sa terminaison.
-        """
-        self.running = False  # Indiquer au thread de s'arrêter
-        self.thread.join()    # Attendre que le thread se termine
+import os
+import sys
+import threading
+import time
+import platform
+from collections import namedtuple
+from queue import Queue, Empty
+
+# Importer les modules spécifiques au système d'exploitation
+if platform.system() == 'Windows':
+    import msvcrt  # Module pour la gestion des entrées clavier sous Windows
+else:
+    import select   # Module pour surveiller les entrées sous Unix
+    import tty      # Module pour configurer le terminal
+    import termios  # Module pour les attributs du terminal
+
+# Un terminal n'envoie pas de relâchement de touche : une touche est considérée tenue
+# tant que la répétition automatique la renvoie à moins de REPEAT_GAP secondes d'intervalle
+REPEAT_GAP = 0.1
+# Durée comptée pour un appui isolé (ou pour le premier événement d'un appui)
+TAP_DURATION = 1 / 30
+# Délai après ESC au-delà duquel ESC est une touche seule et pas le début d'une séquence
+ESCAPE_TIMEOUT = 0.05
+
+# Événement clavier :
+#   type     : 'normal' ou 'special'
+#   key      : la touche (caractère, lettre de flèche sous Unix, bytes sous Windows)
+#   time     : instant de la lecture (time.perf_counter())
+#   duration : temps de maintien de la touche représenté par cet événement, en secondes
+KeyEvent = namedtuple('KeyEvent', 'type key time duration')
+
+
+class KeyboardController:
+    """
+    Classe pour contrôler et lire les entrées du clavier en arrière-plan.
+    Fonctionne à la fois sous Windows et les systèmes Unix-like.
+
+    Le thread de lecture place chaque touche dans une file d'événements : aucune
+    touche n'est perdue entre deux frames, et get_events() les récupère toutes.
+    """
+
+    def __init__(self):
+        """
+        Initialisation du contrôleur clavier.
+        Démarre un thread pour lire les touches en continu.
+        """
+        self.events = Queue()     # File des événements clavier, partagée avec le thread
+        self.pressed = {}         # (type, touche) -> [premier, dernier] instant de l'appui en cours
+        self.lock = threading.Lock()  # Protège self.pressed
+        self.running = True       # Indicateur pour contrôler l'exécution du thread
+        if platform.system() != 'Windows':
+            # Tube pour réveiller le select bloquant lors de stop()
+            self._wake_read, self._wake_write = os.pipe()
+        self.thread = threading.Thread(target=self.read_key)  # Création du thread
+        self.thread.daemon = True  # Permet au thread de se fermer avec le programme principal
+        self.thread.start()         # Démarrage du thread
+
+    def read_key(self):
+        """
+        Méthode exécutée dans un thread séparé pour lire les touches du clavier.
+        Gère les différences entre Windows et les systèmes Unix-like.
+        """
+        if platform.system() == 'Windows':
+            self._read_key_windows()
+        else:
+            self._read_key_unix()
+
+    def _push(self, key_type, key):
+        """
+        Ajoute une touche lue à la file, avec son horodatage et sa durée de maintien.
+        """
+        now = time.perf_counter()
+        with self.lock:
+            times = self.pressed.get((key_type, key))
+            if times is not None and now - times[1] <= REPEAT_GAP:
+                # Répétition automatique : la touche est restée enfoncée depuis l'événement précédent.
+                # Des répétitions lues d'un seul coup (thread en retard) comptent une période chacune.
+                duration = now - times[1] if now - times[1] > 0.002 else TAP_DURATION
+                times[1] = now
+            else:
+                duration = TAP_DURATION
+                self.pressed[(key_type, key)] = [now, now]
+        self.events.put(KeyEvent(key_type, key, now, duration))
+
+    def _read_key_windows(self):
+        """
+        Lecture des touches sous Windows en utilisant le module msvcrt.
+        """
+        while self.running:
+            while msvcrt.kbhit():  # Lire toutes les touches en attente
+                first_char = msvcrt.getch()  # Lit le premier caractère
+                if first_char in (b'\x00', b'\xe0'):
+                    # Une touche spéciale a été pressée (comme les flèches)
+                    second_char = msvcrt.getch()  # Lit le deuxième caractère
+                    self._push('special', first_char + second_char)  # Stocke la touche spéciale
+                else:
+                    # Une touche normale a été pressée
+                    try:
+                        decoded_char = first_char.decode('utf-8', errors='ignore')
+                    except UnicodeDecodeError:
+                        decoded_char = ''  # En cas d'erreur de décodage
+                    self._push('normal', decoded_char)  # Stocke la touche normale
+            time.sleep(0.01)  # msvcrt ne permet pas d'attendre une touche sans bloquer stop()
+
+    def _read_key_unix(self):
+        """
+        Lecture des touches sous Unix-like en utilisant les modules select, tty et termios.
+        Le thread dort dans select jusqu'à l'arrivée d'une touche (ou jusqu'à stop()).
+        """
+        fd = sys.stdin.fileno()  # Obtenir le descripteur de fichier standard d'entrée
+        old_settings = termios.tcgetattr(fd)  # Sauvegarder les paramètres actuels du terminal
+        pending = ''  # Début de séquence d'échappement pas encore complet
+        try:
+            tty.setcbreak(fd)  # Configurer le terminal en mode cbreak (lecture caractère par caractère)
+            while self.running:
+                # Attendre sans limite une touche, sauf pour compléter une séquence commencée
+                timeout = ESCAPE_TIMEOUT if pending else None
+                rlist, _, _ = select.select([fd, self._wake_read], [], [], timeout)
+                if self._wake_read in rlist:
+                    break
+                if not rlist:
+                    # Rien n'a suivi : ESC (ou ESC [) était une touche seule
+                    for ch in pending:
+                        self._push('normal', ch)
+                    pending = ''
+                    continue
+                # Lire directement le descripteur : tout ce qui est disponible, sans tampon caché
+                data = os.read(fd, 1024)
+                if not data:
+                    break  # Fin de l'entrée standard
+                pending = self._parse_unix(pending + data.decode('utf-8', errors='ignore'))
+        finally:
+            termios.tcsetattr(fd, termios.TCSADRAIN, old_settings)  # Restaurer les paramètres du terminal
+
+    def _parse_unix(self, text):
+        """
+        Découpe les caractères lus en touches et renvoie le début de séquence incomplet restant.
+        """
+        i = 0
+        while i < len(text):
+            ch1 = text[i]
+            if ch1 != '\x1b':
+                self._push('normal', ch1)  # Touche normale
+                i += 1
+                continue
+            if i + 1 == len(text):
+                return text[i:]
+            ch2 = text[i + 1]
+            if ch2 != '[':
+                self._push('normal', ch1 + ch2)  # Séquence d'échappement simple (Alt+touche, ESC ESC)
+                i += 2
+                continue
+            # Séquence CSI : paramètres puis un caractère final entre '@' et '~'
+            end = i + 2
+            while end < len(text) and not '@' <= text[end] <= '~':
+                end += 1
+            if end == len(text):
+                return text[i:]
+            sequence = text[i:end + 1]
+            if len(sequence) == 3 and sequence[2] in 'ABCD':
+                self._push('special', sequence[2])  # Flèches
+            else:
+                self._push('special', sequence)  # Autres séquences spéciales
+            i = end + 1
+        return ''
+
+    def get_events(self):
+        """
+        Récupère tous les événements clavier arrivés depuis le dernier appel.
+
+        Returns:
+            list[KeyEvent]: Les événements dans l'ordre de lecture (vide si aucune touche).
+        """
+        events = []
+        while True:
+            try:
+                events.append(self.events.get_nowait())
+            except Empty:
+                return events
+
+    def get_key(self):
+        """
+        Récupère la plus ancienne touche non lue.
+
+        Returns:
+            tuple or None: Un tuple contenant le type de touche ('normal', 'special', 'escape')
+                           et la valeur de la touche, ou None si aucune touche n'a été pressée.
+        """
+        try:
+            event = self.events.get_nowait()
+        except Empty:
+            return None
+        return event.type, event.key
+
+    def held_keys(self):
+        """
+        Touches actuellement tenues, c'est-à-dire répétées il y a moins de REPEAT_GAP secondes.
+
+        Returns:
+            dict: (type, touche) -> durée de maintien en secondes.
+        """
+        now = time.perf_counter()
+        with self.lock:
+            return {key: last - first for key, (first, last) in self.pressed.items()
+                    if now - last <= REPEAT_GAP}
+
+    def stop(self):
+        """
+        Arrête le thread de lecture des touches et attend sa terminaison.
+        """
+        self.running = False  # Indiquer au thread de s'arrêter
+        if platform.system() != 'Windows':
+            os.write(self._wake_write, b'x')  # Réveiller le select bloquant
+        self.thread.join()    # Attendre que le thread se termine
+        if platform.system() != 'Windows':
+            os.close(self._wake_read)
+            os.close(self._wake_write)
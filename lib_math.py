@@ -2,6 +2,8 @@ from math import cos, sin, sqrt
 import moteur_graphique as mg
 
 class vec2:
+    __slots__ = ('x', 'y')
+
     def __init__(self,x,y) -> None:
         self.x = x
         self.y = y
@@ -22,11 +24,13 @@ class vec2:
     __rmul__ = __mul__
 
     def toScreen(self):
-        v = vec2(((29/13)*mg.height/mg.width*self.x+1)*mg.width  /2,
-                 (-self.y+1)*mg.height /2)
-        return v
+        # Constants of the active framebuffer, computed once per resize
+        scaleX, offsetX, scaleY, offsetY = mg.viewport
+        return vec2(scaleX*self.x+offsetX, offsetY-scaleY*self.y)
     
 class vec3:
+    __slots__ = ('x', 'y', 'z')
+
     def __init__(self,x,y,z) -> None:
         self.x = x
         self.y = y
@@ -71,6 +75,8 @@ class vec3:
         return self.x , self.y , self.z
     
 class Triangle2D:    
+    __slots__ = ('v1', 'v2', 'v3')
+
     def __init__(self,v1,v2,v3) -> None:
         self.v1 = v1
         self.v2 = v2
@@ -80,6 +86,8 @@ class Triangle2D:
         return Triangle2D(self.v1.toScreen(),self.v2.toScreen(),self.v3.toScreen())
 
 class Triangle3D:    
+    __slots__ = ('v1', 'v2', 'v3')
+
     def __init__(self,v1,v2,v3) -> None:
         self.v1 = v1
         self.v2 = v2
@@ -97,11 +105,51 @@ class Triangle3D:
     def rotationY(self,yaw):
         return Triangle3D(self.v1.rotationY(yaw),self.v2.rotationY(yaw),self.v3.rotationY(yaw))
 
+class ViewTransform:
+    """Camera transform and projection of one frame, with the rotation precomputed.
+
+    ``view(v)`` gives the same vec3 as
+    ``(v-cam.position).rotationY(cam.yaw).rotationX(cam.pitch)`` and
+    ``screen(view)`` the same vec2 as
+    ``view.projection(cam.focalLenth).toScreen()``, in one step each:
+    no intermediate vectors and no cos/sin per vertex.
+
+    Args:
+        cam (Camera): Camera of the frame.
+        viewport (tuple, optional): Screen mapping constants, those of the
+            active framebuffer (``mg.viewport``) by default.
+    """
+    __slots__ = ('tx', 'ty', 'tz', 'cy', 'sy', 'cp', 'sp', 'focalLenth', 'viewport')
+
+    def __init__(self, cam, viewport=None) -> None:
+        position = cam.position
+        self.tx, self.ty, self.tz = -1*position.x, -1*position.y, -1*position.z
+        self.cy, self.sy = cos(cam.yaw), sin(cam.yaw)
+        self.cp, self.sp = cos(cam.pitch), sin(cam.pitch)
+        self.focalLenth = cam.focalLenth
+        self.viewport = viewport if viewport is not None else mg.viewport
+
+    def view(self, v) -> vec3:
+        """Camera-space position of the world point ``v``."""
+        x, y, z = v.x+self.tx, v.y+self.ty, v.z+self.tz
+        cy, sy = self.cy, self.sy
+        x, z = cy*x+sy*z, -sy*x+cy*z
+        cp, sp = self.cp, self.sp
+        return vec3(x, cp*y-sp*z, sp*y+cp*z)
+
+    def screen(self, view) -> vec2:
+        """Screen position in pixels of the camera-space point ``view``."""
+        f, z = self.focalLenth, view.z
+        scaleX, offsetX, scaleY, offsetY = self.viewport
+        return vec2(scaleX*(view.x*f/z)+offsetX, offsetY-scaleY*(view.y*f/z))
+
 def LinePlaneCollision(planeNormal, planePoint, v1, v2):
     u=v2-v1
     dotp = dot(planeNormal,u)
     if abs(dotp) < 1e-5:
-        return (0,0,0) # pas de collision
+        # Segment (presque) parallèle au plan, pas de collision précise : v2 (le sommet
+        # que clip() garde devant le plan) sert de point de collision
+        return vec3(v2.x, v2.y, v2.z)
     w = (v1-planePoint)
     si = -dot(planeNormal,w)/dotp
     u = si*u
@@ -0,0 +1,141 @@
+"""Level-of-detail meshes built at load time.
+
+``buildLevels`` simplifies a mesh by vertex clustering: vertices are grouped
+in the cells of a regular grid, each group is replaced by its mean, and
+triangles that collapse (two corners in one cell) or repeat another one are
+dropped. Per-vertex values (the baked ambient occlusion) are averaged over
+each cell the same way. Coarser grids give the coarser levels. Each level records its
+geometric error, the largest distance a vertex may have moved.
+
+``selectLevel`` picks the coarsest level whose error, projected at the
+distance of the object, stays under ``LOD_ERROR`` pixels.
+"""
+from math import floor, sqrt
+
+# Largest projected vertex displacement allowed, in pixels
+LOD_ERROR = 0.5
+# Grid resolutions (cells along the longest side of the mesh) tried, finest first
+GRID_SIZES = (256, 128, 64, 32, 16, 8)
+# A level is kept only if it has at most this fraction of the previous level's faces
+MIN_REDUCTION = 0.75
+
+
+def decimate(coords, indices, cellSize, origin, values=None):
+    """Cluster vertices in cubes of side ``cellSize`` and return the simplified mesh.
+
+    Args:
+        coords (list[float]): Flat x, y, z vertex coordinates.
+        indices (list[int]): Flat triangle vertex indices.
+        cellSize (float): Side of the grid cells.
+        origin (tuple[float, float, float]): Corner of the grid.
+        values (list[float], optional): One value per vertex, averaged per cell.
+
+    Returns:
+        tuple[list[float], list[int], list[float] | None]: Flat coordinates,
+        indices and vertex values of the result.
+    """
+    ox, oy, oz = origin
+    cellOf = {}
+    sums = []
+    remap = []
+    for i in range(0, len(coords), 3):
+        x, y, z = coords[i], coords[i+1], coords[i+2]
+        key = (floor((x-ox)/cellSize), floor((y-oy)/cellSize), floor((z-oz)/cellSize))
+        cell = cellOf.get(key)
+        if cell is None:
+            cell = cellOf[key] = len(sums)
+            sums.append([0.0, 0.0, 0.0, 0, 0.0])
+        total = sums[cell]
+        total[0] += x
+        total[1] += y
+        total[2] += z
+        total[3] += 1
+        if values is not None:
+            total[4] += values[i//3]
+        remap.append(cell)
+
+    newIndices = []
+    seen = set()
+    for i in range(0, len(indices), 3):
+        a, b, c = remap[indices[i]], remap[indices[i+1]], remap[indices[i+2]]
+        if a == b or b == c or c == a:
+            continue
+        # Same triangle with the same winding, whatever its first corner
+        key = min((a, b, c), (b, c, a), (c, a, b))
+        if key in seen:
+            continue
+        seen.add(key)
+        newIndices += (a, b, c)
+
+    # Keep only the clusters still used by a triangle
+    used = {}
+    newCoords = []
+    newValues = None if values is None else []
+    for i, cell in enumerate(newIndices):
+        index = used.get(cell)
+        if index is None:
+            index = used[cell] = len(newCoords)//3
+            x, y, z, n, value = sums[cell]
+            newCoords += (x/n, y/n, z/n)
+            if newValues is not None:
+                newValues.append(value/n)
+        newIndices[i] = index
+    return newCoords, newIndices, newValues
+
+
+def buildLevels(coords, indices, values=None):
+    """Return the simplified levels of a mesh, finest first.
+
+    Returns:
+        list[tuple[float, list[float], list[int], list[float] | None]]:
+        ``(error, coords, indices, values)`` of each level, ``error`` being
+        the largest vertex displacement and ``values`` the per-vertex
+        ``values`` averaged over the merged vertices.
+    """
+    if not indices:
+        return []
+    xs, ys, zs = coords[0::3], coords[1::3], coords[2::3]
+    origin = (min(xs), min(ys), min(zs))
+    extent = max(max(xs)-origin[0], max(ys)-origin[1], max(zs)-origin[2])
+    if extent <= 0:
+        return []
+    levels = []
+    faceCount = len(indices)//3
+    for gridSize in GRID_SIZES:
+        cellSize = extent/gridSize
+        levelCoords, levelIndices, levelValues = decimate(coords, indices, cellSize, origin, values)
+        if not levelIndices or len(levelIndices)//3 > faceCount*MIN_REDUCTION:
+            continue
+        faceCount = len(levelIndices)//3
+        # A vertex moves to the mean of its cell: at most one cell diagonal
+        levels.append((cellSize*sqrt(3), levelCoords, levelIndices, levelValues))
+    return levels
+
+
+def selectLevel(errors, center, radius, cam, height, aspect=29/13, maxError=None) -> int:
+    """Return the index of the level to draw (0 for the full mesh).
+
+    Args:
+        errors (list[float]): Geometric error of each simplified level, finest first.
+        center (vec3): Centre of the bounding sphere of the mesh.
+        radius (float): Radius of the bounding sphere.
+        cam (Camera): Active camera.
+        height (int): Screen height in pixels (the pixel size of a projected
+            length does not depend on the screen width, see ``vec2.toScreen``).
+        aspect (float): Pixel shape correction of ``vec2.toScreen``.
+        maxError (float, optional): Largest projected error allowed, in
+            pixels; ``LOD_ERROR`` by default.
+    """
+    if maxError is None:
+        maxError = LOD_ERROR
+    distance = (center-cam.position).length()-radius
+    if distance <= 0.1:
+        return 0
+    # Pixels per world unit at that distance, along x where toScreen() stretches most
+    pixelsPerUnit = aspect/2*height*cam.focalLenth/distance
+    level = 0
+    for i, error in enumerate(errors, 1):
+        if error*pixelsPerUnit > maxError:
+            break
+        level = i
+    return level
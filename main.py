@@ -2,8 +2,17 @@ import time
 import platform
 import sys
 import os
+import argparse
+import signal
+from contextlib import nullcontext
 from keyboard_library import KeyboardController  # Importer notre bibliothèque personnalisée
 import moteur_graphique as mg
+from profiler import FrameProfiler
+from parallel import ParallelRenderer
+from scene import Scene, SceneNode, localBounds
+from pacing import FrameScheduler
+from shadows import ShadowMaps
+from present import Presenter
 from lib_math import *
 import math
 
@@ -18,6 +27,12 @@ sunlight2 = mg.LightSource(vec3(-4, -20, -20), (255, 255, 170),0.8)  # Soleil ja
 
 
 lights = [sunlight, lamp, lamp2, sunlight2]
+lights_animated = True  # Les lampes tournent tant que l'animation n'est pas en pause (touche T)
+
+# Vitesses en unités (ou radians) par seconde : le déplacement ne dépend pas du nombre d'images par seconde
+MOVE_SPEED = 5.0
+TURN_SPEED = 5.0
+LIGHT_SPEED = 3.0
 
 
 def select_obj_file() -> str:
@@ -46,49 +61,73 @@ def select_obj_file() -> str:
         print("Invalid selection. Try again.")
 
 
-# Chargement du mesh du cube
-cube = mg.loadObj(select_obj_file())
-
 
-def process_input(controller, dt):
+def process_input(controller):
     """
-    Traite les événements de touches et met à jour la caméra en conséquence.
+    Traite tous les événements de touches arrivés depuis la dernière frame et met à jour la caméra.
+    Chaque événement déplace la caméra du temps pendant lequel sa touche a été tenue, si bien que
+    le déplacement ne dépend ni du nombre d'images par seconde ni des frames lentes.
 
     Args:
         controller (KeyboardController): Instance du contrôleur clavier.
-        dt (float): Delta temps depuis la dernière mise à jour.
     
     Returns:
         bool: False si la touche ESC est pressée pour quitter, True sinon.
     """
-    key_info = controller.get_key()
-    if key_info:
-        key_type, key = key_info
+    global lights_animated
+    for key_type, key, _, held in controller.get_events():
         if key_type == 'normal':
             if key.lower() == 'z':
-                cam.position += cam.getForwardDirection() * 0.01 * dt
+                cam.position += cam.getForwardDirection() * MOVE_SPEED * held
             elif key.lower() == 's':
-                cam.position -= cam.getForwardDirection() * 0.01 * dt
+                cam.position -= cam.getForwardDirection() * MOVE_SPEED * held
             elif key.lower() == 'd':
-                cam.position += cam.getRightDirection() * 0.01 * dt
+                cam.position += cam.getRightDirection() * MOVE_SPEED * held
             elif key.lower() == 'q':
-                cam.position -= cam.getRightDirection() * 0.01 * dt
+                cam.position -= cam.getRightDirection() * MOVE_SPEED * held
             elif key == ' ':
-                cam.position.y += 0.01 * dt
+                cam.position.y += MOVE_SPEED * held
             elif key.lower() == 'c':
-                cam.position.y -= 0.01 * dt
+                cam.position.y -= MOVE_SPEED * held
             elif key == "j":
                 cam.focalLenth += 0.1
             elif key == 'k':
                 cam.focalLenth-= 0.1
             elif key.lower() == 'o':
                 state = mg.toggle_ambient_occlusion()
-                print("Ambient occlusion:", "on" if state else "off")
+                notify("Ambient occlusion:", "on" if state else "off")
+                invalidate_screen()
             elif key.lower() == 'p':
                 state = mg.toggle_specular()
-                print("Specular lighting:", "on" if state else "off")
+                notify("Specular lighting:", "on" if state else "off")
+                invalidate_screen()
+            elif key.lower() == 'g':
+                state = mg.toggle_smooth_shading()
+                notify("Smooth shading:", "on" if state else "off")
+                invalidate_screen()
+            elif key.lower() == 'h':
+                state = mg.toggle_shadows()
+                notify("Ombres:", "on" if state else "off")
+                invalidate_screen()
+            elif key.lower() == 't':
+                # Mettre en pause l'animation : une scène immobile n'est plus redessinée
+                lights_animated = not lights_animated
+            elif key.lower() == 'm':
+                # Passer au mode de sortie suivant : plein, demi-blocs, braille
+                modes = list(mg.OUTPUT_MODES)
+                mg.setOutputMode(modes[(modes.index(mg.outputMode) + 1) % len(modes)])
+                notify("Mode de sortie:", mg.outputMode)
+                invalidate_screen()
+            elif key.lower() == 'l':
+                state = mg.toggle_lod()
+                notify("Niveaux de détail:", "on" if state else "off")
+                invalidate_screen()
+            elif key.lower() == 'b':
+                state = mg.toggle_depth_buffer()
+                notify("Depth buffer:", "on" if state else "off")
+                invalidate_screen()
             elif key == '\x1b' or key == '\x1b\x1b':  # Touche ESC
-                print("Touche ESC détectée. Fermeture du programme.")
+                notify("Touche ESC détectée. Fermeture du programme.")
                 return False
         elif key_type == 'special':
             # Gérer les touches spéciales comme les flèches
@@ -96,30 +135,30 @@ def process_input(controller, dt):
                 # Sous Windows, les touches spéciales sont renvoyées sous forme de bytes
                 if key == b'\xe0H':  # Flèche Haut
                     if cam.pitch < 1.57:
-                        cam.pitch += 0.01 * dt
+                        cam.pitch += TURN_SPEED * held
                 elif key == b'\xe0P':  # Flèche Bas
                     if cam.pitch > -1.57:
-                        cam.pitch -= 0.01 * dt
+                        cam.pitch -= TURN_SPEED * held
                 elif key == b'\xe0K':  # Flèche Gauche
-                    cam.yaw += 0.01 * dt
+                    cam.yaw += TURN_SPEED * held
                 elif key == b'\xe0M':  # Flèche Droite
-                    cam.yaw -= 0.01 * dt
+                    cam.yaw -= TURN_SPEED * held
             else:
                 # Sous Unix-like, les touches spéciales sont des séquences d'échappement
                 if key == 'A':  # Flèche Haut
                     if cam.pitch < 1.57:
-                        cam.pitch += 0.01 * dt
+                        cam.pitch += TURN_SPEED * held
                 elif key == 'B':  # Flèche Bas
                     if cam.pitch > -1.57:
-                        cam.pitch -= 0.01 * dt
+                        cam.pitch -= TURN_SPEED * held
                 elif key == 'D':  # Flèche Gauche
-                    cam.yaw += 0.01 * dt
+                    cam.yaw += TURN_SPEED * held
                 elif key == 'C':  # Flèche Droite
-                    cam.yaw -= 0.01 * dt
+                    cam.yaw -= TURN_SPEED * held
     return True
 
-def animate_lights(t, lights):
-    t += 0.1
+def animate_lights(t, lights, dt):
+    t += LIGHT_SPEED * dt
     t %= 6  # Réinitialiser t pour éviter qu'il ne devienne trop grand
 
     # Calculer une seule fois les fonctions trigonométriques
@@ -136,51 +175,206 @@ def animate_lights(t, lights):
 
     return t
 
+# Le terminal a changé de taille (SIGWINCH) : les buffers sont réalloués au début de la frame suivante
+resized = False
+# Thread d'affichage (present.Presenter), None si chaque image est écrite avant de rendre la suivante
+presenter = None
+
+def invalidate_screen():
+    """Effacer le terminal et tout redessiner à la prochaine image."""
+    if presenter:
+        # Seul le thread d'affichage écrit pendant le rendu : il efface avec la prochaine image
+        presenter.invalidate()
+    else:
+        mg.invalidate()
+
+# Dernier message des touches, affiché en tête de la ligne d'état quand le thread d'affichage écrit
+message = ""
+
+def notify(*parts):
+    """Afficher un message sans écrire dans le terminal pendant que le thread d'affichage l'utilise."""
+    global message
+    if presenter:
+        # Le texte part avec la ligne d'état de la prochaine image
+        message = " ".join(map(str, parts))
+    else:
+        print(*parts)
+
+def on_resize(signum, frame):
+    global resized
+    resized = True
+
+def scene_state():
+    """Tout ce qui change l'image : caméra, lumières, options de rendu et taille de l'écran."""
+    return (cam.position.printco(), cam.pitch, cam.yaw, cam.focalLenth,
+            [(l.position.printco(), l.color, l.intensity) for l in lights],
+            mg.AMBIENT_OCCLUSION_ENABLED, mg.SPECULAR_ENABLED, mg.DEPTH_BUFFER_ENABLED,
+            mg.LOD_ENABLED, mg.SMOOTH_SHADING_ENABLED, mg.SHADOWS_ENABLED, mg.outputMode, mg.columns, mg.rows)
+
 def main():
     """
     Fonction principale qui initialise le contrôleur clavier et gère la boucle principale.
     """
+    global resized, presenter
+    parser = argparse.ArgumentParser(description="Moteur graphique 3D dans le terminal")
+    parser.add_argument("--profile", action="store_true",
+                        help="mesurer chaque étape du rendu et afficher FPS, p50 et p99")
+    parser.add_argument("--trace", metavar="FICHIER",
+                        help="écrire la trace par frame en CSV ou JSON (.json) à la sortie (active --profile)")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="nombre de processus de rendu (rendu en bandes d'écran si > 1)")
+    parser.add_argument("--mode", choices=list(mg.OUTPUT_MODES), default="block",
+                        help="rendu en caractères pleins, demi-blocs (2 pixels par case) ou braille (2x4 pixels)")
+    parser.add_argument("--fps", type=float, default=30,
+                        help="images par seconde visées ; au-delà du budget la qualité baisse (LOD, spéculaire)")
+    parser.add_argument("--instances", type=int, default=1,
+                        help="nombre de copies du modèle, alignées dans la scène (elles partagent le même mesh)")
+    parser.add_argument("--buffers", type=int, choices=[1, 2, 3], default=2,
+                        help="framebuffers : 1 écrit chaque image avant de rendre la suivante, 2 ou 3 l'écrivent "
+                             "dans un thread pendant le rendu de la suivante (les images en retard sont sautées)")
+    args = parser.parse_args()
+    if args.workers > 1 and args.instances > 1:
+        parser.error("--workers ne rend qu'une seule instance du modèle")
+    if args.fps <= 0:
+        parser.error("--fps doit être positif")
+
+    mg.setOutputMode(args.mode)
+    prof = None
+    if args.profile or args.trace:
+        prof = FrameProfiler(keepTrace=bool(args.trace))
+        mg.setProfiler(prof)
+    stage = prof.stage if prof else lambda name: nullcontext()
+
     print("Appuyez sur les touches pour voir lesquelles sont pressées (Appuyez sur ESC pour quitter).")
     obj_file = select_obj_file()
-    mesh = mg.loadObj(obj_file)
+    # Utiliser le pipeline NumPy vectorisé si NumPy est disponible
+    mesh = mg.loadArrayMesh(obj_file) if mg.np is not None else mg.loadObj(obj_file)
+
+    # Graphe de scène : chaque instance a sa position et sa rotation, le mesh n'est chargé qu'une fois
+    # Les ombres des lumières sont calculées par des shadow maps, gardées tant que rien ne bouge
+    shadow_maps = ShadowMaps()
+    scene = Scene(shadow_maps)
+    spacing = 2.5 * localBounds(mesh).radius
+    for i in range(args.instances):
+        scene.add(SceneNode(mesh, position=vec3(spacing * (i - (args.instances - 1) / 2), 0, 0),
+                            rotation=(0, 0.4 * i, 0)))
+
+    # Rendu multi-processus : le mesh est partagé une fois avec les processus
+    renderer = ParallelRenderer(mesh, args.workers, castShadows=True) if args.workers > 1 else None
 
     controller = KeyboardController()  # Initialiser le contrôleur clavier
+    # Cadence des images : ne dort que le reste du budget, et ne redessine que si la scène a changé
+    scheduler = FrameScheduler(args.fps, state=scene_state)
     t = 0
+    if hasattr(signal, 'SIGWINCH'):  # Pas de SIGWINCH sous Windows
+        signal.signal(signal.SIGWINCH, on_resize)
+    # Écriture des images dans un thread pendant le rendu de la suivante
+    presenter = Presenter(args.buffers) if args.buffers > 1 else None
+    mg.invalidate()  # Effacer le terminal avant le premier frame
+    dropped_before = 0
+    running = True
     try:
-        last = time.time()
-        running = True
         while running:
-            current = time.time()
-            dt = (current - last) * 500  # Calculer le delta temps (ajusté comme dans le script original)
-            last = current
+            if prof:
+                prof.beginFrame()
+            dt = scheduler.tick()  # Temps écoulé depuis la dernière itération, en secondes
+
+            # Réallouer les buffers à la nouvelle taille du terminal, sans redémarrer
+            if resized:
+                resized = False
+                mg.resize(*mg.terminalSize())
+                invalidate_screen()
 
             # Traiter les entrées clavier
-            running = process_input(controller, dt)
+            with stage('input'):
+                running = process_input(controller)
 
-            # Effacer l'écran
-            mg.clear(' ')
+            #animer la position de la lumière en cercle
+            if lights_animated:
+                t = animate_lights(t, lights, dt)
 
-            # Afficher le mesh sélectionné avec la caméra et la lumière
-            mg.putMesh(mesh, cam, lights)
+            if not scheduler.needsFrame():
+                # Rien n'a bougé : l'image affichée est toujours bonne
+                if prof:
+                    prof.discardFrame()
+                scheduler.wait()
+                continue
 
-            # Dessiner le frame
-            mg.draw()
+            # Rendre dans un framebuffer libre si l'affichage se fait dans un thread
+            with presenter.frame() if presenter else nullcontext() as back:
+                # Effacer l'écran
+                with stage('clear'):
+                    mg.clear(' ')
 
-            #animer la position de la lumière en cercle
-            t = animate_lights(t, lights)
+                # Afficher le mesh sélectionné avec la caméra et la lumière
+                render_start = time.perf_counter()
+                with stage('putMesh'):
+                    if renderer:
+                        renderer.putMesh(cam, lights)
+                    else:
+                        scene.putMesh(cam, lights)
+                render_ms = (time.perf_counter() - render_start) * 1000
 
+            if presenter:
+                # Temps d'écriture et taille de la dernière image écrite par le thread
+                present_ms, frame_bytes = presenter.presentTime * 1000, presenter.bytes
+                dropped = presenter.dropped
+            else:
+                # Dessiner le frame
+                with stage('draw'):
+                    draw_start = time.perf_counter()
+                    mg.draw()
+                    present_ms = (time.perf_counter() - draw_start) * 1000
+                frame_bytes, dropped = mg.bytesPerFrame, 0
 
-            if True: #print info
-                print(mg.color(255,255,255) + "time", t,  "light", light.position.printco(),"cam", cam.position.printco(), "camdir", (cam.pitch, cam.yaw),"FOV", (cam.focalLenth))
+            # La ligne d'état est réécrite sans retour à la ligne pour ne pas faire défiler l'écran
+            if prof: # statistiques des frames précédentes
+                status = " ".join((prof.statusLine(), "zbuf" if mg.DEPTH_BUFFER_ENABLED else "sort", mg.outputMode, "present %.1f ms dropped %d degrade %d skipped %d" % (present_ms, dropped, scheduler.level, scheduler.skipped)))
+            elif True: #print info
+                status = " ".join(map(str, ("time", t,  "light", light.position.printco(),"cam", cam.position.printco(), "camdir", (cam.pitch, cam.yaw),"FOV", (cam.focalLenth), "zbuf" if mg.DEPTH_BUFFER_ENABLED else "sort", "render %.1f ms" % render_ms, "present %.1f ms" % present_ms, "%d B" % frame_bytes, "dropped %d" % dropped, "degrade %d skipped %d" % (scheduler.level, scheduler.skipped))))
+            else:
+                status = ""
+            if message:
+                status = message + " | " + status
+            status = mg.color(255,255,255) + "\033[K" + status
+            if presenter:
+                # Le thread écrit l'image et la ligne d'état pendant le rendu de la suivante
+                with stage('draw'):
+                    presenter.submit(back, status)
             else:
-                print()
+                print(status, end='', flush=True)
+            if prof:
+                prof.add('bytes', frame_bytes)
+                if presenter:
+                    prof.add('present', presenter.presentTime)
+                    prof.add('dropped', dropped - dropped_before)
+                prof.add('degrade', scheduler.level)
+            dropped_before = dropped
+            scheduler.frameDone()
+            if mg.SHADOWS_ENABLED and (renderer.shadowMaps if renderer else shadow_maps).moving:
+                # Une lumière vient de bouger : une image de plus une fois immobile
+                # recalcule ses ombres en pleine résolution
+                scheduler.invalidate()
 
-            # Petite pause pour limiter l'utilisation CPU
-            time.sleep(0.033)
+            # Attendre seulement le reste du budget de l'image
+            with stage('sleep'):
+                scheduler.wait()
+            if prof:
+                prof.endFrame()
     except KeyboardInterrupt:
-        print("\nInterruption clavier détectée. Fermeture du programme.")
+        running = False
+        notify("\nInterruption clavier détectée. Fermeture du programme.")
     finally:
+        if presenter:
+            presenter.close()  # Écrire la dernière image et arrêter le thread d'affichage
+            if not running:
+                print(message)  # Message de fermeture, une fois le thread arrêté
         controller.stop()  # Arrêter le thread du contrôleur clavier
+        if renderer:
+            renderer.close()
+        if args.trace:
+            prof.dump(args.trace)
+            print("Trace écrite dans", args.trace)
 
 if __name__ == "__main__":
     main()
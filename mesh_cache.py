@@ -0,0 +1,118 @@
+"""Binary cache for parsed .obj meshes.
+
+The cache is written next to the source file (``object/Car.obj`` ->
+``object/Car.obj.mgc``) and holds the vertex positions, the triangle indices
+and the baked ambient occlusion of each vertex (``occlusion.py``) as packed
+native arrays. Reloading memory-maps the file instead of parsing the text
+and baking again. A cache is stale as soon as the source mtime or size differs
+from the one recorded in its header.
+
+Running this module reports cold (parse and bake) and warm (cached) load times for
+every model in ``object/``.
+"""
+import mmap
+import os
+import struct
+from array import array
+
+CACHE_SUFFIX = '.mgc'
+
+# magic, version, source mtime_ns, source size, vertex count, triangle count
+_HEADER = struct.Struct('=4sIqqqq')
+_MAGIC = b'MGC1'
+_VERSION = 3
+
+
+def cachePath(objPath) -> str:
+    """Return the cache file path used for an .obj file."""
+    return objPath + CACHE_SUFFIX
+
+
+def _sourceStamp(objPath):
+    stat = os.stat(objPath)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def writeCache(objPath, vertices, indices, occlusion):
+    """Write the cache for an .obj file.
+
+    Args:
+        objPath (str): Path of the source .obj file.
+        vertices (Iterable[float]): Flat x, y, z vertex coordinates.
+        indices (Iterable[int]): Flat triangle vertex indices.
+        occlusion (Iterable[float]): Accessibility of each vertex.
+    """
+    vertexData = array('d', vertices)
+    indexData = array('q', indices)
+    occlusionData = array('d', occlusion)
+    mtime, size = _sourceStamp(objPath)
+    path = cachePath(objPath)
+    tmpPath = path + '.tmp'
+    try:
+        with open(tmpPath, 'wb') as file:
+            file.write(_HEADER.pack(_MAGIC, _VERSION, mtime, size, len(vertexData) // 3, len(indexData) // 3))
+            vertexData.tofile(file)
+            indexData.tofile(file)
+            occlusionData.tofile(file)
+        os.replace(tmpPath, path)
+    except OSError:
+        # The cache is only an accelerator (e.g. read-only asset directory)
+        pass
+
+
+def readCache(objPath):
+    """Memory-map the cache of an .obj file.
+
+    Returns:
+        tuple[memoryview, memoryview, memoryview] | None: Flat vertex
+        coordinates (``'d'``), triangle indices (``'q'``) and vertex
+        accessibility (``'d'``) viewing the mapped file, or None when the
+        cache is missing, stale or malformed.
+    """
+    try:
+        stamp = _sourceStamp(objPath)
+        with open(cachePath(objPath), 'rb') as file:
+            mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+    if len(mapped) < _HEADER.size:
+        return None
+    magic, version, mtime, size, vertexCount, triangleCount = _HEADER.unpack_from(mapped)
+    vertexEnd = _HEADER.size + vertexCount * 3 * 8
+    indexEnd = vertexEnd + triangleCount * 3 * 8
+    occlusionEnd = indexEnd + vertexCount * 8
+    if magic != _MAGIC or version != _VERSION or (mtime, size) != stamp or len(mapped) != occlusionEnd:
+        mapped.close()
+        return None
+    view = memoryview(mapped)
+    return (view[_HEADER.size:vertexEnd].cast('d'), view[vertexEnd:indexEnd].cast('q'),
+            view[indexEnd:occlusionEnd].cast('d'))
+
+
+if __name__ == "__main__":
+    import time
+    import moteur_graphique as mg
+
+    for name in sorted(os.listdir("object")):
+        if not name.endswith(".obj"):
+            continue
+        try:
+            os.remove(cachePath(os.path.join("object", name)))
+        except FileNotFoundError:
+            pass
+        try:
+            start = time.perf_counter()
+            mg.loadObj(name)
+            cold = time.perf_counter() - start
+            start = time.perf_counter()
+            mg.loadObj(name)
+            warm = time.perf_counter() - start
+        except (IndexError, ValueError) as error:
+            print(f"{name:22} failed: {error!r}")
+            continue
+        report = f"{name:22} cold {cold * 1000:8.2f} ms   warm {warm * 1000:8.2f} ms"
+        if mg.np is not None:
+            start = time.perf_counter()
+            mg.loadArrayMesh(name)
+            report += f"   warm ArrayMesh {(time.perf_counter() - start) * 1000:8.2f} ms"
+        print(report)
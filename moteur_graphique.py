@@ -1,14 +1,119 @@
-from math import floor
+from contextlib import contextmanager
+from math import ceil, cos, floor, pi
 import os
+import sys
+from time import perf_counter
 from lib_math import *
+import mesh_cache
+import culling
+import lod
+import occlusion as ao
 
 try:
-    width, height = os.get_terminal_size()
-    height -= 1
-except OSError:
-    # Fallback when there's no associated terminal (e.g. during tests)
-    width, height = 80, 24
-pixelBuffer = [' '] * (width * height)
+    import numpy as np
+except ImportError:
+    # NumPy is optional: meshes given as list[Triangle3D] render without it
+    np = None
+
+def terminalSize():
+    """Return the ``(columns, rows)`` available for frames, keeping a line for the status."""
+    try:
+        columns, rows = os.get_terminal_size()
+        return columns, rows - 1
+    except OSError:
+        # Fallback when there's no associated terminal (e.g. during tests)
+        return 80, 24
+
+# Output modes: pixels per terminal cell across and down (see setOutputMode)
+OUTPUT_MODES = {'block': (1, 1), 'half': (1, 2), 'braille': (2, 4)}
+
+
+class Framebuffer:
+    """Colour and depth buffers of one viewport and the cells it shows.
+
+    Every buffer is allocated once per ``resize()``; ``clear()`` refills them
+    from preallocated blank lists with slice assignments instead of a
+    Python loop.
+
+    Attributes:
+        columns, rows (int): Size in terminal cells.
+        mode (str): Output mode, a key of ``OUTPUT_MODES``.
+        subX, subY (int): Pixels per cell across and down.
+        width, height (int): Raster size in pixels.
+        aspect (float): Width/height correction of the projection for the
+            shape of a pixel.
+        viewport (tuple[float, float, float, float]): ``(scaleX, offsetX,
+            scaleY, offsetY)``: a projected point ``(x, y)`` lands on pixel
+            ``(scaleX*x + offsetX, offsetY - scaleY*y)``.
+        pixels (list[str]): Cell string of each pixel.
+        depth (list[float]): Per-pixel 1/z of the closest surface drawn so far
+            (0 means empty).
+        cells (list[str]): Terminal cells packed from ``pixels`` by draw() in
+            the sub-cell modes (``pixels`` itself in block mode).
+        front (list[str | None]): Cells currently shown by the terminal (None
+            forces a repaint of the cell).
+        left, top (int): Position of the viewport in the terminal, in cells.
+    """
+
+    def __init__(self, columns, rows, mode='block', left=0, top=0) -> None:
+        self.left, self.top = left, top
+        self.resize(columns, rows, mode)
+
+    def resize(self, columns, rows, mode=None):
+        """Reallocate the buffers for ``columns`` x ``rows`` cells (and a new output mode)."""
+        mode = mode or getattr(self, 'mode', 'block')
+        if mode not in OUTPUT_MODES:
+            raise ValueError(f"unknown output mode {mode!r}, expected one of {', '.join(OUTPUT_MODES)}")
+        self.columns, self.rows, self.mode = columns, rows, mode
+        self.subX, self.subY = OUTPUT_MODES[mode]
+        self.width, self.height = columns * self.subX, rows * self.subY
+        self.aspect = (29/13) * self.subX / self.subY
+        self.viewport = (self.aspect*self.height/2, self.width/2, self.height/2, self.height/2)
+        size = self.width * self.height
+        self._blank = [' '] * size
+        self._zeros = [0.0] * size
+        self.pixels = list(self._blank)
+        self.depth = list(self._zeros)
+        self.cells = self.pixels if mode == 'block' else [' '] * (columns * rows)
+        self.front = [None] * (columns * rows)
+
+    def clear(self, char=' '):
+        """Fill the pixels with ``char`` and empty the depth buffer."""
+        self.pixels[:] = self._blank if char == ' ' else [char] * len(self.pixels)
+        self.depth[:] = self._zeros
+
+    def invalidate(self):
+        """Make the next draw() repaint every cell."""
+        self.front[:] = [None] * len(self.front)
+
+
+def useFramebuffer(newFramebuffer):
+    """Render into ``newFramebuffer`` from now on and return the previous one.
+
+    The module-level names below (``width``, ``pixelBuffer``, ...) always
+    refer to the active framebuffer; the rasterizer reads them directly.
+    """
+    global framebuffer, columns, rows, outputMode, subX, subY, width, height, aspect, viewport
+    global pixelBuffer, depthBuffer, cellBuffer, frontBuffer
+    previous = globals().get('framebuffer')
+    framebuffer = newFramebuffer
+    columns, rows, outputMode = framebuffer.columns, framebuffer.rows, framebuffer.mode
+    subX, subY = framebuffer.subX, framebuffer.subY
+    width, height = framebuffer.width, framebuffer.height
+    aspect, viewport = framebuffer.aspect, framebuffer.viewport
+    pixelBuffer, depthBuffer = framebuffer.pixels, framebuffer.depth
+    cellBuffer, frontBuffer = framebuffer.cells, framebuffer.front
+    return previous
+
+
+# Active framebuffer, sized to the terminal
+useFramebuffer(Framebuffer(*terminalSize()))
+# Size in bytes of the output written by the last draw()
+bytesPerFrame = 0
+# profiler.FrameProfiler receiving stage timings and counters, None when off
+profiler = None
+# Rows (first, end) putTriangle may write, None for the whole screen (see parallel.py)
+rasterRows = None
 
 class Camera:
     def __init__(self,position,pitch,yaw,focalLenth=1.5) -> None:
@@ -33,12 +138,270 @@ class LightSource:
         self.intensity = intensity
 
 
-def draw():
-    print(''.join(pixelBuffer),end='')
+def resize(newColumns, newRows):
+    """Reallocate the active framebuffer for a ``newColumns`` x ``newRows`` terminal."""
+    framebuffer.resize(newColumns, newRows)
+    useFramebuffer(framebuffer)
+
+def setOutputMode(mode):
+    """Select how pixels map to terminal cells and reallocate the buffers.
+
+    ``'block'`` draws one pixel per cell with ``lightGradient``. ``'half'``
+    draws two pixels per cell, one above the other, with ``▀`` in the top
+    colour over the bottom colour as background. ``'braille'`` draws 2x4
+    pixels per cell as braille dots in their most common colour.
+
+    The sub-cell modes cost more bytes per frame than block mode at the same
+    terminal size: a half-block cell carries two colours and braille cells
+    change colour more often, so runs of one colour are shorter. Frames are
+    about 1.3x (braille) to 1.9x (half) the size of block frames.
+    """
+    framebuffer.resize(columns, rows, mode)
+    useFramebuffer(framebuffer)
+
+
+class Renderer:
+    """A viewport with its own Framebuffer.
+
+    Each call makes the framebuffer active for the time of the call, so
+    several renderers (at different sizes, or side by side in one terminal
+    with ``left``/``top``) can be used in turn.
+
+    Usage:
+        view = Renderer(40, 20, left=40)
+        view.clear()
+        view.putMesh(mesh, cam, lights)
+        view.draw()
+    """
+
+    def __init__(self, columns, rows, mode='block', left=0, top=0) -> None:
+        self.framebuffer = Framebuffer(columns, rows, mode, left, top)
+
+    @contextmanager
+    def active(self):
+        """Context in which the module-level functions render into this viewport."""
+        previous = useFramebuffer(self.framebuffer)
+        try:
+            yield self.framebuffer
+        finally:
+            useFramebuffer(previous)
+
+    def resize(self, columns, rows, mode=None):
+        self.framebuffer.resize(columns, rows, mode)
+
+    def clear(self, char=' '):
+        self.framebuffer.clear(char)
+
+    def putMesh(self, mesh, cam, lights):
+        with self.active():
+            putMesh(mesh, cam, lights)
+
+    def draw(self, stream=None):
+        with self.active():
+            draw(stream)
+
+# Background reset: cells that show background keep it at the default
+_DEFAULT_BG = '\033[49m'
+# Memoized packed cells by the pixels they cover
+_packedCells = {}
+# Memoized _cellEncodings() by cell
+_cellParts = {}
+PACKED_CELLS_SIZE = 1 << 16
+
+def _background(foreground):
+    """Background escape of the colour of a foreground escape."""
+    return '\033[48' + foreground[4:]
+
+def _foreground(background):
+    return '\033[38' + background[4:]
+
+def _cellEncodings(cell):
+    """Equivalent ways to show a cell as ``(foreground, background, glyph, glyph bytes)``.
+
+    A foreground or background of None means the cell looks the same
+    whatever it is. A full block in one colour is also a space on that
+    background, and ``▀`` over a background is also ``▄`` with the colours
+    swapped, so draw() can pick the one needing the fewest escapes.
+    """
+    glyph = cell[-1]
+    fg = bg = None
+    for escape in cell[:-1].split('m')[:-1]:
+        if escape.startswith('\033[38'):
+            fg = escape + 'm'
+        else:
+            bg = escape + 'm'
+    size = len(glyph.encode('utf-8'))
+    if glyph == ' ':
+        return ((None, bg or _DEFAULT_BG, ' ', 1),)
+    if glyph == lightGradient and fg is not None and bg is None:
+        return ((fg, None, glyph, size), (None, _background(fg), ' ', 1))
+    if glyph == '▀' and fg is not None and bg not in (None, _DEFAULT_BG):
+        return ((fg, bg, '▀', size), (_foreground(bg), _background(fg), '▄', size))
+    return ((fg, bg or _DEFAULT_BG, glyph, size),)
+
+def _pixelColor(pixel):
+    """RGB of a pixel written by shadeString(), None for any other character."""
+    if len(pixel) > 1 and pixel.startswith('\033[38;2;'):
+        r, g, b = pixel[7:-2].split(';')
+        return int(r), int(g), int(b)
+    return None
+
+def _halfCell(pixels):
+    top, bottom = pixels
+    if top == bottom:
+        return top
+    topColor, bottomColor = _pixelColor(top), _pixelColor(bottom)
+    if topColor is None or bottomColor is None:
+        if topColor is not None and bottom == ' ':
+            return top[:-1] + _DEFAULT_BG + '▀'
+        if bottomColor is not None and top == ' ':
+            return bottom[:-1] + _DEFAULT_BG + '▄'
+        return top if top != ' ' else bottom
+    return top[:-1] + color(*bottomColor, background=True) + '▀'
+
+# Braille dot bit of each pixel of a cell, in the order _packCells() reads them
+_BRAILLE_BITS = (0x01, 0x08, 0x02, 0x10, 0x04, 0x20, 0x40, 0x80)
+
+def _brailleCell(pixels):
+    bits = 0
+    counts = {}
+    for pixel, bit in zip(pixels, _BRAILLE_BITS):
+        if pixel != ' ':
+            bits |= bit
+            counts[pixel] = counts.get(pixel, 0) + 1
+    if not bits:
+        return ' '
+    # One colour per cell: the most common one, which neighbouring cells
+    # on the same face share, so draw() rarely has to change it
+    pixel = max(counts, key=counts.get)
+    fg = pixel[:-1] if _pixelColor(pixel) is not None else ''
+    return fg + _DEFAULT_BG + chr(0x2800 + bits)
+
+def _packCells(fb):
+    """Pack the pixels of Framebuffer ``fb`` into its cells for the half-block or braille mode."""
+    if len(_packedCells) >= PACKED_CELLS_SIZE:
+        _packedCells.clear()
+    get = _packedCells.get
+    pack = _halfCell if fb.mode == 'half' else _brailleCell
+    pixels, width, columns, subX, subY = fb.pixels, fb.width, fb.columns, fb.subX, fb.subY
+    for row in range(fb.rows):
+        first = row * subY * width
+        lines = [pixels[first + k * width:first + (k + 1) * width] for k in range(subY)]
+        if subX == 2:
+            # Pixels of a cell in reading order: left and right of each line
+            lines = [half for line in lines for half in (line[0::2], line[1::2])]
+        packed = []
+        for cellPixels in zip(*lines):
+            cell = get(cellPixels)
+            if cell is None:
+                cell = _packedCells[cellPixels] = pack(cellPixels)
+            packed.append(cell)
+        fb.cells[row * columns:(row + 1) * columns] = packed
+
+def cells() -> list[str]:
+    """Return the terminal cells of the frame in pixelBuffer, row by row.
+
+    In block mode this is pixelBuffer itself; in the half-block and braille
+    modes the pixels are packed into cellBuffer first.
+    """
+    if outputMode != 'block':
+        _packCells(framebuffer)
+    return cellBuffer
+
+def draw(stream=None):
+    """Present the frame, writing only the cells that changed since the last frame.
+
+    The frame is encoded by ``encodeFrame()`` and sent with a single write.
+
+    Args:
+        stream (TextIO, optional): Output stream, ``sys.stdout`` by default.
+    """
+    global bytesPerFrame
+    frame = encodeFrame(framebuffer)
+    stream = stream or sys.stdout
+    stream.write(frame)
+    stream.flush()
+    bytesPerFrame = len(frame.encode('utf-8'))
+
+def encodeFrame(fb, front=None) -> str:
+    """Return the output turning the cells shown by the terminal into the frame of ``fb``.
+
+    In the half-block and braille modes the pixels are first packed into
+    terminal cells. Only the cells that differ from ``front`` (the cells
+    shown, ``fb.front`` by default, updated in place) are written: they are
+    reached with cursor-move sequences and each one is written in the
+    encoding (see ``_cellEncodings()``) needing the fewest escapes given the
+    colours already set. A cell on a new row is reached with an absolute
+    move, except right after the last cell of the previous row when the
+    viewport spans the whole terminal from column 1, where the terminal
+    wraps by itself. The cursor is left on the line below the frame.
+    Only ``fb`` is read, so another thread can encode a finished frame while
+    the next one renders (see ``present.py``).
+    """
+    if fb.mode != 'block':
+        _packCells(fb)
+    screen = fb.cells
+    frontBuffer = fb.front if front is None else front
+    columns = fb.columns
+    left, top = fb.left, fb.top
+    # Writing past the last column only lands on the next row of the viewport
+    # when the viewport is the full width of the terminal
+    wraps = left == 0 and columns == terminalSize()[0]
+    if len(_cellParts) >= PACKED_CELLS_SIZE:
+        _cellParts.clear()
+    out = []
+    cursor = -1
+    lastColor = None
+    lastBackground = _DEFAULT_BG
+    for i, cell in enumerate(screen):
+        if cell == frontBuffer[i]:
+            continue
+        frontBuffer[i] = cell
+        if cursor < 0 or i // columns != (cursor - 1) // columns:
+            # Row other than the one of the last cell written
+            if not (wraps and i == cursor):
+                out.append('\033[{};{}H'.format(top + i // columns + 1, left + i % columns + 1))
+        elif i != cursor:
+            # Same row: a relative move is shorter
+            out.append('\033[{}C'.format(i - cursor))
+        encodings = _cellParts.get(cell)
+        if encodings is None:
+            encodings = _cellParts[cell] = _cellEncodings(cell)
+        best = None
+        for encoding in encodings:
+            fg, bg, glyph, size = encoding
+            if fg is not None and fg != lastColor:
+                size += len(fg)
+            if bg is not None and bg != lastBackground:
+                size += len(bg)
+            if best is None or size < bestSize:
+                best, bestSize = encoding, size
+        fg, bg, glyph, _ = best
+        if fg is not None and fg != lastColor:
+            if bg is not None and bg != lastBackground:
+                # Both colours in one escape sequence
+                out.append(fg[:-1] + ';' + bg[2:])
+                lastBackground = bg
+            else:
+                out.append(fg)
+            lastColor = fg
+        elif bg is not None and bg != lastBackground:
+            out.append(bg)
+            lastBackground = bg
+        out.append(glyph)
+        cursor = i + 1
+    if lastBackground != _DEFAULT_BG:
+        out.append(_DEFAULT_BG)
+    out.append('\033[{};1H'.format(top + fb.rows + 1))
+    return ''.join(out)
+
+def invalidate():
+    """Clear the terminal and make the next draw() repaint every cell."""
+    framebuffer.invalidate()
+    sys.stdout.write('\033[2J')
 
 def clear(char):
-    for i in range(width*height):
-        pixelBuffer[i] = char
+    framebuffer.clear(char)
 
 def putPixel(v, char):
     px = round(v.x)
@@ -46,49 +409,174 @@ def putPixel(v, char):
     if 0 <=px<width and 0<=py<height:
         pixelBuffer[py * width + px] = char
 
-def putTriangle(tri,char):
-    def eq(p, a, b):
-        return (a.x-p.x)*(b.y-p.y)-(a.y-p.y)*(b.x-p.x)
+def putTriangle(tri,char,depth=None,colors=None):
+    """Fill a screen-space triangle.
+
+    Pixels are sampled at integer coordinates with a top-left fill rule, so an
+    edge shared by two triangles is drawn by exactly one of them. Edge values
+    are stepped by constants from row to row and each row is written as one
+    span straight into ``pixelBuffer``.
 
-    xmin = round(min(tri.v1.x, tri.v2.x, tri.v3.x))
-    xmax = round(max(tri.v1.x, tri.v2.x, tri.v3.x))+1
-    ymin = round(min(tri.v1.y, tri.v2.y, tri.v3.y))
-    ymax = round(max(tri.v1.y, tri.v2.y, tri.v3.y))+1
-    for y in range(ymin,ymax):
-        if 0<=y<height:
-            for x in range(xmin,xmax):
-                if 0<=x<width:
-                    pos = vec2(x,y)
-                    w1 = eq(pos, tri.v3, tri.v1)
-                    w2 = eq(pos, tri.v1, tri.v2)
-                    w3 = eq(pos, tri.v2, tri.v3)
-                    if (w1 >= 0 and w2 >= 0 and w3 >= 0) or (-w1 >= 0 and -w2 >= 0 and -w3 >= 0):
-                        putPixel(pos,char)
+    Args:
+        tri (Triangle2D): Triangle in screen coordinates.
+        char (str): Cell content to write.
+        depth (tuple[float, float, float], optional): View-space z of the three
+            vertices. When given, 1/z is interpolated across the triangle and
+            each pixel is written only if it is closer than ``depthBuffer``.
+        colors (tuple, optional): RGB (floats) of the three vertices. When
+            given, ``char`` is unused and each pixel gets the colour
+            interpolated linearly across the triangle (Gouraud shading).
 
+    Returns:
+        int: Number of pixels written.
+    """
+    x1, y1 = tri.v1.x, tri.v1.y
+    x2, y2 = tri.v2.x, tri.v2.y
+    x3, y3 = tri.v3.x, tri.v3.y
+    area = (x2-x1)*(y3-y1)-(y2-y1)*(x3-x1)
+    if area == 0:
+        return 0
+    if colors is not None:
+        (r1, g1, b1), (r2, g2, b2), (r3, g3, b3) = colors
+        flat = (round(r1), round(g1), round(b1))
+        if flat == (round(r2), round(g2), round(b2)) == (round(r3), round(g3), round(b3)):
+            # Same colour at every corner: fill spans like a flat triangle
+            char, colors = shadeString(*flat), None
+    if depth is not None:
+        invZ1, invZ2, invZ3 = 1/depth[0], 1/depth[1], 1/depth[2]
+    if area < 0:
+        # Make the interior the positive side of every edge
+        x2, y2, x3, y3 = x3, y3, x2, y2
+        if depth is not None:
+            invZ2, invZ3 = invZ3, invZ2
+        if colors is not None:
+            r2, g2, b2, r3, g3, b3 = r3, g3, b3, r2, g2, b2
+        area = -area
 
+    # Bounding box clamped to the screen once
+    xmin = max(ceil(min(x1, x2, x3)), 0)
+    xmax = min(floor(max(x1, x2, x3)), width-1)
+    ymin = max(ceil(min(y1, y2, y3)), 0)
+    ymax = min(floor(max(y1, y2, y3)), height-1)
+    if xmin > xmax or ymin > ymax:
+        return 0
 
-def clip(triangle,camPos,planeNormal):
-    def inZ(planeNormal, planePoint,tri):
-        out = [] 
-        in_ = []
-        vert1 = dot(planePoint-tri.v1,planeNormal)
-        vert2 = dot(planePoint-tri.v2,planeNormal)
-        vert3 = dot(planePoint-tri.v3,planeNormal)
+    # Edge a->b: E = dx*(y-ay) - dy*(x-ax), stepped by -dy per pixel and dx per row
+    a12, b12 = y1-y2, x2-x1
+    a23, b23 = y2-y3, x3-x2
+    a31, b31 = y3-y1, x1-x3
+    e12 = a12*(xmin-x1)+b12*(ymin-y1)
+    e23 = a23*(xmin-x2)+b23*(ymin-y2)
+    e31 = a31*(xmin-x3)+b31*(ymin-y3)
+    # Top-left rule: pixels exactly on an edge belong to left and top edges only
+    edges = ((a12, b12 > 0), (a23, b23 > 0), (a31, b31 > 0))
 
-        out.append(tri.v1) if vert1 > 0 else in_.append(tri.v1)
-        out.append(tri.v2) if vert2 > 0 else in_.append(tri.v2)
-        out.append(tri.v3) if vert3 > 0 else in_.append(tri.v3)
+    if depth is not None:
+        dInvZ = (a23*invZ1+a31*invZ2+a12*invZ3)/area
+    if colors is not None:
+        dR = (a23*r1+a31*r2+a12*r3)/area
+        dG = (a23*g1+a31*g2+a12*g3)/area
+        dB = (a23*b1+a31*b2+a12*b3)/area
+        shade = shadeString
 
-        return out,in_, vert1*vert3>0
+    if rasterRows is not None:
+        # Restricted to a band: step over the rows above it so the edge values
+        # are exactly those of a full-screen render
+        first = max(ymin, rasterRows[0])
+        ymax = min(ymax, rasterRows[1]-1)
+        if first > ymax:
+            return 0
+        for _ in range(first-ymin):
+            e12 += b12
+            e23 += b23
+            e31 += b31
+        ymin = first
 
+    written = 0
+    spanEnd = xmax+1
+    for y in range(ymin, ymax+1):
+        lo, hi = 0, spanEnd-xmin
+        for (a, topLeft), e in zip(edges, (e12, e23, e31)):
+            if a > 0:
+                lo = max(lo, ceil(-e/a))
+            elif a < 0:
+                hi = min(hi, ceil(e/-a))
+            elif e < 0 or (e == 0 and not topLeft):
+                hi = lo
+                break
+        if lo < hi:
+            row = y*width+xmin
+            if colors is not None:
+                # Barycentric weights of the first pixel of the span are e23, e31, e12 over area
+                r = (e23*r1+e31*r2+e12*r3)/area+dR*lo
+                g = (e23*g1+e31*g2+e12*g3)/area+dG*lo
+                b = (e23*b1+e31*b2+e12*b3)/area+dB*lo
+                if depth is None:
+                    for i in range(row+lo, row+hi):
+                        pixelBuffer[i] = shade(round(r), round(g), round(b))
+                        r += dR
+                        g += dG
+                        b += dB
+                    written += hi-lo
+                else:
+                    invZ = (e23*invZ1+e31*invZ2+e12*invZ3)/area+dInvZ*lo
+                    for i in range(row+lo, row+hi):
+                        if invZ > depthBuffer[i]:
+                            depthBuffer[i] = invZ
+                            pixelBuffer[i] = shade(round(r), round(g), round(b))
+                            written += 1
+                        invZ += dInvZ
+                        r += dR
+                        g += dG
+                        b += dB
+            elif depth is None:
+                pixelBuffer[row+lo:row+hi] = [char]*(hi-lo)
+                written += hi-lo
+            else:
+                invZ = (e23*invZ1+e31*invZ2+e12*invZ3)/area+dInvZ*lo
+                for i in range(row+lo, row+hi):
+                    # Early depth test before touching the pixel
+                    if invZ > depthBuffer[i]:
+                        depthBuffer[i] = invZ
+                        pixelBuffer[i] = char
+                        written += 1
+                    invZ += dInvZ
+        e12 += b12
+        e23 += b23
+        e31 += b31
+    return written
+
+
+
+def clip(triangle,camPos,planeNormal):
+    """Cut ``triangle`` by the near plane, 0.1 in front of ``camPos`` along ``planeNormal``.
+
+    Returns ``[triangle]`` itself when it lies entirely in front of the
+    plane, ``[]`` when it lies entirely behind, and otherwise the one or two
+    triangles of its part in front. ``clipTriangles()`` does the same for a
+    whole array of triangles.
+    """
     zNear = camPos+0.1*planeNormal
-    out, in_, isInverted = inZ(planeNormal,zNear,triangle)
-    
-    if len(out) == 0:
+    nx, ny, nz = planeNormal.x, planeNormal.y, planeNormal.z
+    px, py, pz = zNear.x, zNear.y, zNear.z
+    v1, v2, v3 = triangle.v1, triangle.v2, triangle.v3
+    # Distances in front of the plane, as dot(zNear-v, planeNormal)
+    vert1 = (px-v1.x)*nx + (py-v1.y)*ny + (pz-v1.z)*nz
+    vert2 = (px-v2.x)*nx + (py-v2.y)*ny + (pz-v2.z)*nz
+    vert3 = (px-v3.x)*nx + (py-v3.y)*ny + (pz-v3.z)*nz
+    if vert1 <= 0 and vert2 <= 0 and vert3 <= 0:
         return [triangle]
-    elif len(out) == 3:
+    if vert1 > 0 and vert2 > 0 and vert3 > 0:
         return []
-    elif len(out) == 1:
+
+    out = []
+    in_ = []
+    out.append(v1) if vert1 > 0 else in_.append(v1)
+    out.append(v2) if vert2 > 0 else in_.append(v2)
+    out.append(v3) if vert3 > 0 else in_.append(v3)
+    isInverted = vert1*vert3>0
+
+    if len(out) == 1:
         collision0 = LinePlaneCollision(planeNormal,zNear,out[0],in_[0])
         collision1 = LinePlaneCollision(planeNormal,zNear,out[0],in_[1])
         if isInverted:
@@ -101,7 +589,7 @@ def clip(triangle,camPos,planeNormal):
                 Triangle3D(collision0,in_[0],collision1),
                 Triangle3D(collision1,in_[0],in_[1])
                 ]
-    elif len(out) == 2:
+    else:
         if isInverted: 
             return [
                 Triangle3D(LinePlaneCollision(planeNormal,zNear,out[0],in_[0]),
@@ -115,29 +603,385 @@ def clip(triangle,camPos,planeNormal):
                            LinePlaneCollision(planeNormal,zNear,out[1],in_[0]),
                            in_[0])
                 ]
-            
-def loadObj(filePath):
-    with open("object/" + filePath, "r") as  file:
-        lines = [line.rstrip('\n').split(' ') for line in file.readlines() if line.rstrip('\n')]
-        
+
+def _collideRows(normal, point, v1, v2):
+    """Row-wise LinePlaneCollision(), in the same operation order."""
+    u = v2-v1
+    dotp = normal[0]*u[:, 0]+normal[1]*u[:, 1]+normal[2]*u[:, 2]
+    w = v1-point
+    parallel = np.abs(dotp) < 1e-5
+    with np.errstate(divide='ignore', invalid='ignore'):
+        si = -(normal[0]*w[:, 0]+normal[1]*w[:, 1]+normal[2]*w[:, 2])/dotp
+    return np.where(parallel[:, None], v2, v1+u*si[:, None])
+
+def clipTriangles(tris, camPos, planeNormal):
+    """Batched ``clip()`` of an ``(n, 3, 3)`` array of triangles (requires NumPy).
+
+    All the triangles are classified against the near plane at once; the
+    pieces of the ones crossing it are built together, one vectorized step
+    per case of ``clip()``, with the same coordinates and vertex order.
+
+    Args:
+        tris (np.ndarray): ``(n, 3, 3)`` world-space triangles.
+        camPos, planeNormal (np.ndarray): Camera position and look-at direction.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray, np.ndarray]: ``inside``, the indices of
+        the triangles entirely in front of the plane (to use as they are);
+        ``pieces``, an ``(m, 3, 3)`` array of the triangles cut from the
+        crossing ones; ``source``, the index in ``tris`` of the triangle each
+        piece comes from, in increasing order, the pieces of one triangle
+        following each other in ``clip()`` order.
+    """
+    zNear = camPos+planeNormal*0.1
+    side = zNear-tris
+    side = side[..., 0]*planeNormal[0]+side[..., 1]*planeNormal[1]+side[..., 2]*planeNormal[2]
+    out = side > 0
+    outCount = np.count_nonzero(out, axis=1)
+    inside = np.flatnonzero(outCount == 0)
+    crossing = np.flatnonzero((outCount == 1) | (outCount == 2))
+    if not len(crossing):
+        return inside, np.empty((0, 3, 3)), np.empty(0, dtype=np.intp)
+
+    # Corners of each crossing triangle: those behind the plane, then those in
+    # front, each in triangle order (the out and in_ lists of clip())
+    order = np.argsort(~out[crossing], axis=1, kind='stable')
+    corners = tris[crossing[:, None], order]
+    inverted = side[crossing, 0]*side[crossing, 2] > 0
+    pieces = []
+    sources = []
+    one = outCount[crossing] == 1
+    if one.any():
+        o, i0, i1 = corners[one, 0], corners[one, 1], corners[one, 2]
+        c0 = _collideRows(planeNormal, zNear, o, i0)
+        c1 = _collideRows(planeNormal, zNear, o, i1)
+        flip = inverted[one][:, None]
+        first = np.where(flip[..., None], np.stack((c1, i1, c0), axis=1), np.stack((c0, i0, c1), axis=1))
+        second = np.where(flip[..., None], np.stack((c0, i1, i0), axis=1), np.stack((c1, i0, i1), axis=1))
+        # Both pieces of a triangle in a row
+        pieces.append(np.stack((first, second), axis=1).reshape(-1, 3, 3))
+        sources.append(np.repeat(crossing[one], 2))
+    two = ~one
+    if two.any():
+        o0, o1, i0 = corners[two, 0], corners[two, 1], corners[two, 2]
+        c0 = _collideRows(planeNormal, zNear, o0, i0)
+        c1 = _collideRows(planeNormal, zNear, o1, i0)
+        flip = inverted[two][:, None, None]
+        pieces.append(np.where(flip, np.stack((c0, i0, c1), axis=1), np.stack((c0, c1, i0), axis=1)))
+        sources.append(crossing[two])
+    source = np.concatenate(sources)
+    byTriangle = np.argsort(source, kind='stable')
+    return inside, np.concatenate(pieces)[byTriangle], source[byTriangle]
+
+def _parseObj(path):
+    """Parse an .obj file line by line into flat vertex coordinates and triangle indices.
+
+    Faces may use the ``v``, ``v/vt``, ``v//vn`` or ``v/vt/vn`` forms and
+    negative (relative) indices. Polygons are fan-triangulated and faces that
+    reference a vertex missing from the file are skipped. Other statements
+    (``vt``, ``vn``, ``s``, ``o``, ``g``, ``usemtl``...) are ignored.
+    """
+    vertices = []
+    indices = []
+    vertexCount = 0
+    with open(path, "r") as file:
+        for line in file:
+            parts = line.split()
+            if not parts:
+                continue
+            if parts[0] == 'v':
+                vertices.extend((float(parts[1]), float(parts[2]), float(parts[3])))
+                vertexCount += 1
+            elif parts[0] == 'f':
+                face = []
+                for part in parts[1:]:
+                    index = int(part.split('/', 1)[0])
+                    face.append(index-1 if index > 0 else vertexCount+index)
+                # Fan around the first vertex: (0, 1, 2), (2, 3, 0), (3, 4, 0)...
+                if len(face) >= 3:
+                    indices.extend(face[:3])
+                for i in range(2, len(face)-1):
+                    indices.extend((face[i], face[i+1], face[0]))
+
+    # Drop triangles pointing outside the vertex list (broken exports)
+    if any(i < 0 or i >= vertexCount for i in indices):
+        it = iter(indices)
+        indices = [i for triangle in zip(it, it, it)
+                   if all(0 <= j < vertexCount for j in triangle) for i in triangle]
+    return vertices, indices
+
+def _loadObjData(filePath):
+    """Return flat vertices, indices and vertex accessibility of an .obj file.
+
+    They come from its binary cache when fresh; otherwise the file is parsed,
+    its ambient occlusion baked (see ``occlusion.py``) and the cache written.
+    """
+    path = os.path.join("object", filePath)
+    cached = mesh_cache.readCache(path)
+    if cached is not None:
+        return cached
+    vertices, indices = _parseObj(path)
+    occlusion = ao.bakeOcclusion(vertices, indices)
+    mesh_cache.writeCache(path, vertices, indices, occlusion)
+    return vertices, indices, occlusion
+
+# Faces meeting at a vertex at more than this angle (degrees) keep a hard edge
+CREASE_ANGLE = 45
+
+class VertexNormals:
+    """Smoothed normals of a mesh, for Gouraud shading.
+
+    Each face corner is lit at a shading point: a mesh vertex with the sum of
+    the normals of the faces around it that meet the corner's face at less
+    than ``CREASE_ANGLE``. Face normals are twice the face area long, so the
+    sum is area-weighted. Corners of a vertex with the same faces share one
+    shading point, so it is lit once per frame for all of them.
+
+    Attributes:
+        corners (list[tuple[int, int, int]]): Shading point of each face corner.
+        vertices (list[int]): Mesh vertex of each shading point.
+        normals (list[vec3]): Unnormalized normal of each shading point.
+    """
+    def __init__(self, corners, vertices, normals) -> None:
+        self.corners = corners
+        self.vertices = vertices
+        self.normals = normals
+
+def vertexNormals(faces, faceNormals, creaseAngle=CREASE_ANGLE) -> VertexNormals:
+    """Compute the VertexNormals of triangles ``faces`` with unnormalized ``faceNormals`` (vec3)."""
+    units = []
+    for n in faceNormals:
+        length = n.length()
+        units.append(n/length if length > 0 else None)
+    around = {}
+    for f, face in enumerate(faces):
+        for v in face:
+            around.setdefault(v, []).append(f)
+    limit = cos(creaseAngle*pi/180)
+    vertices = []
+    normals = []
+    # Shading point of each (vertex, face) pair
+    points = {}
+    for v, group in around.items():
+        # Faces around the vertex linked by edges softer than the crease angle
+        # share a shading point (connected groups, so a smooth fan stays whole)
+        cluster = {f: f for f in group}
+
+        def find(f):
+            while cluster[f] != f:
+                cluster[f] = cluster[cluster[f]]
+                f = cluster[f]
+            return f
+        for k, f in enumerate(group):
+            if units[f] is None:
+                continue
+            for g in group[k+1:]:
+                if units[g] is not None and dot(units[f], units[g]) >= limit:
+                    cluster[find(g)] = find(f)
+        pointOf = {}
+        for f in group:
+            root = find(f)
+            point = pointOf.get(root)
+            if point is None:
+                point = pointOf[root] = len(vertices)
+                vertices.append(v)
+                normals.append(vec3(0.0, 0.0, 0.0))
+            normals[point] = normals[point]+faceNormals[f]
+            points[(v, f)] = point
+    corners = [tuple(points[(v, f)] for v in face) for f, face in enumerate(faces)]
+    return VertexNormals(corners, vertices, normals)
+
+def _faceOcclusion(occlusion, faces):
+    """Accessibility of each face, the mean of its corners, or None without baked occlusion."""
+    if occlusion is None:
+        return None
+    return [(occlusion[a]+occlusion[b]+occlusion[c])/3 for a, b, c in faces]
+
+def _pointOcclusion(occlusion, smooth):
+    """Accessibility of each shading point of ``smooth``, or None without baked occlusion."""
+    if occlusion is None:
+        return None
+    return [occlusion[v] for v in smooth.vertices]
+
+class IndexedMesh:
+    """Mesh made of unique vertices shared by index between triangles.
+
+    Attributes:
+        vertices (list[vec3]): Unique vertex positions.
+        faces (list[tuple[int, int, int]]): Vertex indices of each triangle.
+        normals (list[vec3]): Unnormalized face normals, computed once.
+        smooth (VertexNormals): Shading points of the face corners for
+            smooth shading, computed once.
+        occlusion (list[float] | None): Baked accessibility of each vertex
+            (see ``occlusion.py``); the ``AO_DIRECTION`` term is used
+            instead when None.
+        shading (ShadingCache): Lighting memoized per face between frames.
+        vertexShading (ShadingCache): Lighting memoized per shading point.
+        bvh (culling.BVHNode): Bounding-sphere hierarchy used for frustum culling.
+        facing (culling.FacingCache): Back-face culling reused between frames.
+        lods (list[tuple[float, IndexedMesh]]): Simplified levels, finest
+            first, with their geometric error (see ``lod.py``).
+
+    ``normals``, ``bvh`` and ``smooth`` may be given when already known (e.g.
+    a moved copy of another mesh, see ``scene.py``); they are computed
+    otherwise.
+    """
+    def __init__(self, vertices, faces, normals=None, bvh=None, smooth=None, occlusion=None) -> None:
+        self.vertices = vertices
+        self.faces = faces
+        if normals is None:
+            normals = [crossProd(vertices[b]-vertices[a], vertices[c]-vertices[a]) for a, b, c in faces]
+        self.normals = normals
+        self.smooth = smooth if smooth is not None else vertexNormals(faces, normals)
+        self.occlusion = occlusion
+        self.faceOcclusion = _faceOcclusion(occlusion, faces)
+        self.shading = ShadingCache(self.faceOcclusion)
+        self.vertexShading = ShadingCache(_pointOcclusion(occlusion, self.smooth))
+        self.bvh = bvh if bvh is not None else culling.buildBVH(vertices, faces)
+        self.facing = culling.FacingCache()
+        self.lods = []
+
+    def triangles(self) -> list[Triangle3D]:
+        """Return the mesh as a list of Triangle3D sharing the vertex objects."""
+        vertices = self.vertices
+        return [Triangle3D(vertices[a], vertices[b], vertices[c]) for a, b, c in self.faces]
+
+    def __len__(self) -> int:
+        return len(self.faces)
+
+def indexedMesh(coords, indices, levels=True, occlusion=None) -> IndexedMesh:
+    """Build an IndexedMesh from flat coordinates and triangle indices.
+
+    With ``levels``, its simplified levels of detail are built as well.
+    ``occlusion`` is the baked accessibility of each vertex, if any.
+    """
+    vertices = [vec3(coords[i], coords[i+1], coords[i+2]) for i in range(0, len(coords), 3)]
+    it = iter(indices)
+    mesh = IndexedMesh(vertices, list(zip(it, it, it)), occlusion=occlusion)
+    if levels:
+        mesh.lods = [(error, indexedMesh(levelCoords, levelIndices, False, levelOcclusion))
+                     for error, levelCoords, levelIndices, levelOcclusion
+                     in lod.buildLevels(coords, indices, occlusion)]
+    return mesh
+
+def loadObj(filePath, levels=True) -> IndexedMesh:
+    """Load an .obj file from the ``object`` directory as an IndexedMesh.
+
+    The parsed mesh and its baked ambient occlusion are cached next to the
+    file (see ``mesh_cache``), so later loads map the packed arrays instead
+    of parsing the text again. With
+    ``levels``, simplified levels of detail are built (see ``lod.py``).
+    """
+    flatVertices, flatIndices, occlusion = _loadObjData(filePath)
+    if isinstance(flatVertices, memoryview):
+        flatVertices, flatIndices, occlusion = flatVertices.tolist(), flatIndices.tolist(), occlusion.tolist()
+    return indexedMesh(flatVertices, flatIndices, levels, occlusion)
+
+def _crossRows(line1, line2):
+    """Row-wise cross product, in the same operation order as crossProd()."""
+    return np.stack((line1[:, 1]*line2[:, 2]-line1[:, 2]*line2[:, 1],
+                     line1[:, 2]*line2[:, 0]-line1[:, 0]*line2[:, 2],
+                     line1[:, 0]*line2[:, 1]-line1[:, 1]*line2[:, 0]), axis=1)
+
+class ArrayMesh:
+    """Mesh stored as a vertex array and a triangle index array (requires NumPy).
+
+    Attributes:
+        vertices (np.ndarray): ``(n, 3)`` float array of unique vertex positions.
+        indices (np.ndarray): ``(m, 3)`` int array of vertex indices per triangle.
+        normals (np.ndarray): ``(m, 3)`` unnormalized face normals, computed once.
+        smooth (VertexNormals): Shading points of the face corners for
+            smooth shading, computed once.
+        occlusion (list[float] | None): Baked accessibility of each vertex
+            (see ``occlusion.py``); the ``AO_DIRECTION`` term is used
+            instead when None.
+        shading (ShadingCache): Lighting memoized per face between frames.
+        pointPositions (list[vec3]): Position of each shading point.
+        vertexShading (ShadingCache): Lighting memoized per shading point.
+        bounds (culling.BVHNode): Bounding sphere of the whole mesh.
+        drawOrder (np.ndarray | None): Painter's order of the faces in the
+            last frame drawn without the depth buffer, the starting point of
+            the next sort.
+        lods (list[tuple[float, ArrayMesh]]): Simplified levels, finest
+            first, with their geometric error (see ``lod.py``).
+
+    ``normals``, ``bounds`` and ``smooth`` may be given when already known;
+    they are computed otherwise.
+    """
+    def __init__(self, vertices, indices, normals=None, bounds=None, smooth=None, occlusion=None) -> None:
+        if np is None:
+            raise ImportError("ArrayMesh requires NumPy")
+        self.vertices = np.asarray(vertices, dtype=np.float64).reshape(-1, 3)
+        self.indices = np.asarray(indices, dtype=np.intp).reshape(-1, 3)
+        if normals is None:
+            tris = self.vertices[self.indices]
+            normals = _crossRows(tris[:, 1]-tris[:, 0], tris[:, 2]-tris[:, 0])
+        self.normals = normals
+        if smooth is None:
+            smooth = vertexNormals(list(map(tuple, self.indices.tolist())), [vec3(*n) for n in normals.tolist()])
+        self.smooth = smooth
+        # World positions of the shading points, for lighting them
+        self.pointPositions = [vec3(*v) for v in self.vertices[smooth.vertices].tolist()] if smooth.vertices else []
+        self.occlusion = occlusion
+        self.faceOcclusion = _faceOcclusion(occlusion, self.indices.tolist() if occlusion is not None else None)
+        self.shading = ShadingCache(self.faceOcclusion)
+        self.vertexShading = ShadingCache(_pointOcclusion(occlusion, smooth))
+        if bounds is None:
+            if len(self.vertices):
+                low, high = self.vertices.min(axis=0), self.vertices.max(axis=0)
+                center = (low+high)/2
+                radius = float(np.sqrt(((self.vertices-center)**2).sum(axis=1)).max())
+            else:
+                center, radius = (0.0, 0.0, 0.0), 0.0
+            bounds = culling.BVHNode(vec3(*map(float, center)), radius)
+        self.bounds = bounds
+        self.drawOrder = None
+        self.lods = []
+
+    @classmethod
+    def fromTriangles(cls, triangles):
+        """Build an array mesh from a list of Triangle3D, sharing identical vertex objects."""
         vertices = []
-        faces  = []
-        for line in lines:
-            if line[0] == 'v':
-                vertex = list(map(float,line[1:]))
-                vertices.append(vec3(vertex[0], vertex[1], vertex[2]))
-            if line[0] == 'f':
-                faces.append(list(map(int, line[1:])))
-                        
-        triangles = []
-        for f in faces:
-            if len(f) == 3:
-                triangles.append(Triangle3D(vertices[f[0]-1], vertices[f[1]-1], vertices[f[2]-1]))
-            if len(f) == 4:
-                triangles.append(Triangle3D(vertices[f[0]-1], vertices[f[1]-1], vertices[f[2]-1]))
-                triangles.append(Triangle3D(vertices[f[2]-1], vertices[f[3]-1], vertices[f[0]-1]))
-        return triangles
-            
+        indices = []
+        seen = {}
+        for triangle in triangles:
+            face = []
+            for v in (triangle.v1, triangle.v2, triangle.v3):
+                index = seen.get(id(v))
+                if index is None:
+                    index = seen[id(v)] = len(vertices)
+                    vertices.append((v.x, v.y, v.z))
+                face.append(index)
+            indices.append(face)
+        return cls(vertices, indices)
+
+    def triangles(self) -> list[Triangle3D]:
+        """Return the mesh as a list of Triangle3D for the object path."""
+        vertices = [vec3(*v) for v in self.vertices.tolist()]
+        return [Triangle3D(vertices[a], vertices[b], vertices[c]) for a, b, c in self.indices.tolist()]
+
+    def __len__(self) -> int:
+        return len(self.indices)
+
+def loadArrayMesh(filePath, levels=True) -> ArrayMesh:
+    """Load an .obj file from the ``object`` directory as an ArrayMesh.
+
+    On a warm cache the arrays are views of the memory-mapped cache file.
+    With ``levels``, simplified levels of detail are built (see ``lod.py``).
+    """
+    vertices, indices, occlusion = _loadObjData(filePath)
+    if isinstance(vertices, memoryview):
+        occlusion = occlusion.tolist()
+        mesh = ArrayMesh(np.frombuffer(vertices, dtype=np.float64), np.frombuffer(indices, dtype=np.int64),
+                         occlusion=occlusion)
+    else:
+        mesh = ArrayMesh(vertices, indices, occlusion=occlusion)
+    if levels:
+        mesh.lods = [(error, ArrayMesh(levelCoords, levelIndices, occlusion=levelOcclusion))
+                     for error, levelCoords, levelIndices, levelOcclusion
+                     in lod.buildLevels(list(vertices), list(indices), occlusion)]
+    return mesh
+
 def color(r, g, b, background=False):
     # Code ANSI pour changer la couleur (avant-plan ou arrière-plan)
     return '\033[{};2;{};{};{}m'.format(48 if background else 38, r, g, b)
@@ -148,13 +992,26 @@ lightGradient = "█"
 AMBIENT_COLOR = (15, 15, 15)
 SPECULAR_SHININESS = 16
 
-# Parameters for simple ambient occlusion
+# Ambient occlusion: meshes loaded from .obj files carry the accessibility
+# baked per vertex (see ``occlusion.py``); the others fall back to a simple
+# term where faces turned away from AO_DIRECTION get darker
 AO_DIRECTION = vec3(0, 1, 0)  # Upward direction receives less occlusion
 AO_STRENGTH = 0.4
 
 # Feature toggles
 AMBIENT_OCCLUSION_ENABLED = True
 SPECULAR_ENABLED = True
+DEPTH_BUFFER_ENABLED = False
+LOD_ENABLED = True
+# Light each vertex with its smoothed normal and interpolate the colours
+# across faces (IndexedMesh and ArrayMesh); flat shading per face when off
+SMOOTH_SHADING_ENABLED = True
+# Darken what the shadow maps of ``shadowMaps`` hide from each light
+SHADOWS_ENABLED = True
+
+# shadows.ShadowMaps of the lights, None for no shadows; its update() must
+# have been given the lights passed to putMesh()
+shadowMaps = None
 
 def toggle_ambient_occlusion() -> bool:
     """Enable or disable ambient occlusion."""
@@ -168,11 +1025,50 @@ def toggle_specular() -> bool:
     SPECULAR_ENABLED = not SPECULAR_ENABLED
     return SPECULAR_ENABLED
 
-def diffuseLight(lights, normal, vertex, view_pos) -> str:
-    """Compute diffuse, specular and ambient occlusion lighting for a vertex."""
+def toggle_depth_buffer() -> bool:
+    """Switch between the painter's sort and depth-buffered rasterization."""
+    global DEPTH_BUFFER_ENABLED
+    DEPTH_BUFFER_ENABLED = not DEPTH_BUFFER_ENABLED
+    return DEPTH_BUFFER_ENABLED
+
+def toggle_lod() -> bool:
+    """Enable or disable the simplified levels of detail."""
+    global LOD_ENABLED
+    LOD_ENABLED = not LOD_ENABLED
+    return LOD_ENABLED
+
+def toggle_smooth_shading() -> bool:
+    """Enable or disable smooth (Gouraud) shading."""
+    global SMOOTH_SHADING_ENABLED
+    SMOOTH_SHADING_ENABLED = not SMOOTH_SHADING_ENABLED
+    return SMOOTH_SHADING_ENABLED
+
+def toggle_shadows() -> bool:
+    """Enable or disable the shadows of ``shadowMaps``."""
+    global SHADOWS_ENABLED
+    SHADOWS_ENABLED = not SHADOWS_ENABLED
+    return SHADOWS_ENABLED
+
+def shadowMap(index, light):
+    """Shadow map of ``light``, the ``index``-th light, or None when it casts no shadow."""
+    if not SHADOWS_ENABLED or shadowMaps is None:
+        return None
+    return shadowMaps.get(index, light)
+
+def diffuseLight(lights, normal, vertex, view_pos, occlusion=None) -> str:
+    """Compute diffuse, specular and ambient occlusion lighting for a vertex.
+
+    Diffuse and specular terms of a light are scaled by the fraction of the
+    light its shadow map lets through (see ``shadowMap()``). ``occlusion``
+    is the baked accessibility of the surface, the ``AO_DIRECTION`` term
+    being used when it is None.
+    """
+    if profiler is not None:
+        profiler.add('lightEvals', 1)
     norm = normal.normalize()
     if AMBIENT_OCCLUSION_ENABLED:
-        occlusion = max(dot(norm, AO_DIRECTION.normalize()), 0)
+        if occlusion is None:
+            occlusion = max(dot(norm, AO_DIRECTION.normalize()), 0)
         ao_factor = 1 - AO_STRENGTH * (1 - occlusion)
     else:
         ao_factor = 1
@@ -180,12 +1076,18 @@ def diffuseLight(lights, normal, vertex, view_pos) -> str:
     # Start with ambient contribution
     total_r, total_g, total_b = AMBIENT_COLOR
 
-    for light in lights:
+    for i, light in enumerate(lights):
         light_dir = light.position - vertex
         lnorm = light_dir.normalize()
 
         # Diffuse component
         diffuse = dot(lnorm, norm) * light.intensity
+        visible = 1
+        if diffuse > 0:
+            shadow = shadowMap(i, light)
+            if shadow is not None:
+                visible = shadow.visibility(vertex, norm)
+                diffuse *= visible
         if diffuse > 0:
             total_r += diffuse * light.color[0]
             total_g += diffuse * light.color[1]
@@ -195,48 +1097,584 @@ def diffuseLight(lights, normal, vertex, view_pos) -> str:
             view_dir = (view_pos - vertex).normalize()
             reflect_dir = 2 * dot(norm, lnorm) * norm - lnorm
             if SPECULAR_ENABLED:
-                spec = max(dot(view_dir, reflect_dir), 0) ** SPECULAR_SHININESS
-                total_r += spec * 255 * light.intensity
-                total_g += spec * 255 * light.intensity
-                total_b += spec * 255 * light.intensity
+                spec = max(dot(view_dir, reflect_dir), 0) ** SPECULAR_SHININESS * 255 * light.intensity * visible
+                total_r += spec
+                total_g += spec
+                total_b += spec
 
     brightness_r = round(min(total_r * ao_factor, 255))
     brightness_g = round(min(total_g * ao_factor, 255))
     brightness_b = round(min(total_b * ao_factor, 255))
-    return color(brightness_r, brightness_g, brightness_b) + lightGradient
+    return shadeString(brightness_r, brightness_g, brightness_b)
+
+# Interned cell strings (colour escape + glyph) by quantized RGB
+_shadeTable = {}
+SHADE_TABLE_SIZE = 1 << 16
+
+def shadeString(r, g, b) -> str:
+    """Return the interned cell string for an integer RGB colour."""
+    key = (r, g, b)
+    cell = _shadeTable.get(key)
+    if cell is None:
+        if len(_shadeTable) >= SHADE_TABLE_SIZE:
+            _shadeTable.clear()
+        cell = _shadeTable[key] = color(r, g, b) + lightGradient
+    return cell
+
+# Marks a cached light term for a face the light does not reach
+_UNLIT = ()
+
+class ShadingCache:
+    """Memoized lighting of the faces (or shading points) of one mesh, keyed by index.
+
+    Each light keeps its own diffuse terms, valid while its position, colour,
+    intensity and shadow map are unchanged. Specular terms are also dropped when the
+    camera moves. Final cell strings (``shade()``) and colours (``color()``)
+    are reused as long as nothing changed at all. Every table holds at most
+    ``maxEntries`` items and evicts the oldest ones first. ``occlusion``
+    holds the baked accessibility of each key, if any. Results are identical
+    to ``diffuseLight()``.
+    """
+    def __init__(self, occlusion=None, maxEntries=1 << 16) -> None:
+        self.occlusion = occlusion
+        self.maxEntries = maxEntries
+        self.lights = []
+        self.viewPos = None
+        self.lightStates = []
+        self.shadows = []
+        self.viewState = None
+        self.toggleState = None
+        self.diffuse = []
+        self.specular = []
+        self.normals = {}
+        self.results = {}
+        self.colors = {}
+
+    def update(self, lights, view_pos):
+        """Drop the terms invalidated since the previous frame; call once per frame."""
+        changed = False
+        toggles = (AMBIENT_OCCLUSION_ENABLED, SPECULAR_ENABLED)
+        if toggles != self.toggleState:
+            self.toggleState = toggles
+            changed = True
+        if len(lights) != len(self.lightStates):
+            self.lightStates = [None]*len(lights)
+            self.shadows = [None]*len(lights)
+            self.diffuse = [{} for _ in lights]
+            self.specular = [{} for _ in lights]
+        viewState = view_pos.printco()
+        if viewState != self.viewState:
+            self.viewState = viewState
+            # Cleared even with specular off, so no stale highlight is
+            # served once it is turned back on
+            for table in self.specular:
+                table.clear()
+            if SPECULAR_ENABLED:
+                changed = True
+        for i, light in enumerate(lights):
+            shadow = self.shadows[i] = shadowMap(i, light)
+            state = (light.position.printco(), tuple(light.color), light.intensity,
+                     shadow.version if shadow is not None else None)
+            if state != self.lightStates[i]:
+                self.lightStates[i] = state
+                self.diffuse[i].clear()
+                self.specular[i].clear()
+                changed = True
+        if changed:
+            self.results.clear()
+            self.colors.clear()
+        self.lights = lights
+        self.viewPos = view_pos
+
+    def _store(self, table, key, value):
+        if len(table) >= self.maxEntries:
+            del table[next(iter(table))]
+        table[key] = value
+
+    def shade(self, key, normal, vertex) -> str:
+        """Return the cell string of face ``key`` as ``diffuseLight()`` would."""
+        result = self.results.get(key)
+        if result is not None:
+            return result
+        r, g, b = self._color(key, normal, vertex)
+        result = shadeString(round(r), round(g), round(b))
+        self._store(self.results, key, result)
+        return result
+
+    def color(self, key, normal, vertex) -> tuple[float, float, float]:
+        """Return the RGB of ``key``, clamped to 255 but not rounded, for Gouraud shading."""
+        result = self.colors.get(key)
+        if result is None:
+            result = self._color(key, normal, vertex)
+            self._store(self.colors, key, result)
+        return result
+
+    def _color(self, key, normal, vertex):
+        if profiler is not None:
+            profiler.add('lightEvals', 1)
+        geometry = self.normals.get(key)
+        if geometry is None:
+            norm = normal.normalize()
+            if self.occlusion is not None:
+                geometry = (norm, self.occlusion[key])
+            else:
+                geometry = (norm, max(dot(norm, AO_DIRECTION.normalize()), 0))
+            self._store(self.normals, key, geometry)
+        norm, occlusion = geometry
+        ao_factor = 1 - AO_STRENGTH * (1 - occlusion) if AMBIENT_OCCLUSION_ENABLED else 1
+
+        total_r, total_g, total_b = AMBIENT_COLOR
+        for i, light in enumerate(self.lights):
+            term = self.diffuse[i].get(key)
+            if term is None:
+                lnorm = (light.position - vertex).normalize()
+                diffuse = dot(lnorm, norm) * light.intensity
+                visible = 1
+                if diffuse > 0 and self.shadows[i] is not None:
+                    visible = self.shadows[i].visibility(vertex, norm)
+                    diffuse *= visible
+                if diffuse > 0:
+                    term = (diffuse * light.color[0], diffuse * light.color[1], diffuse * light.color[2], lnorm,
+                            visible)
+                else:
+                    term = _UNLIT
+                self._store(self.diffuse[i], key, term)
+            if term is _UNLIT:
+                continue
+            total_r += term[0]
+            total_g += term[1]
+            total_b += term[2]
+
+            if SPECULAR_ENABLED:
+                spec = self.specular[i].get(key)
+                if spec is None:
+                    lnorm = term[3]
+                    view_dir = (self.viewPos - vertex).normalize()
+                    reflect_dir = 2 * dot(norm, lnorm) * norm - lnorm
+                    spec = max(dot(view_dir, reflect_dir), 0) ** SPECULAR_SHININESS * 255 * light.intensity * term[4]
+                    self._store(self.specular[i], key, spec)
+                total_r += spec
+                total_g += spec
+                total_b += spec
+
+        return min(total_r * ao_factor, 255), min(total_g * ao_factor, 255), min(total_b * ao_factor, 255)
 
 
 
 def putMesh(mesh: list[Triangle3D], cam: Camera, lights: list[LightSource]):
     """Render a mesh using the camera and lighting setup.
 
+    Triangles are drawn back to front (painter's algorithm) unless
+    ``DEPTH_BUFFER_ENABLED`` is set, in which case no sort is done and
+    visibility is resolved per pixel against ``depthBuffer``.
+
+    An IndexedMesh or ArrayMesh with levels of detail is drawn at the level
+    chosen by ``selectLod()`` while ``LOD_ENABLED`` is set. A list of
+    Triangle3D has no baked ambient occlusion and uses the ``AO_DIRECTION``
+    term.
+
     Args:
-        mesh (list[Triangle3D]): Mesh to draw.
+        mesh (IndexedMesh | list[Triangle3D] | ArrayMesh): Mesh to draw. An
+            IndexedMesh transforms each shared vertex once per frame and an
+            ArrayMesh is rendered by the batched NumPy path; all three give
+            the same frame.
         cam (Camera): Active camera.
         lights (list[LightSource]): Light sources used for shading.
     """
+    if isinstance(mesh, ArrayMesh):
+        return _putArrayMesh(selectLod(mesh, cam)[1], cam, lights)
+    if isinstance(mesh, IndexedMesh):
+        return _putIndexedMesh(selectLod(mesh, cam)[1], cam, lights)
+
     def distanceTriangle(triangle):
         position = (1/3)*(triangle.v1+triangle.v2+triangle.v3)-cam.position
         return position.length()
-    
-    mesh.sort(key=distanceTriangle, reverse=True )
+
+    prof = profiler
+    if prof is not None:
+        start = perf_counter()
+    trianglesIn = len(mesh)
+    if not DEPTH_BUFFER_ENABLED:
+        mesh = sorted(mesh, key=distanceTriangle, reverse=True)
+    if prof is not None:
+        prof.add('sort', perf_counter()-start)
 
     lookAt = cam.getLookAtDirection()
+    transform = ViewTransform(cam, viewport)
 
+    clipped = drawn = pixels = 0
     for triangle in mesh:
-        clippedTriangleList = clip(triangle,cam.position,lookAt)
-
-        for clippedTriangle in clippedTriangleList:
-            line1 = clippedTriangle.v2-clippedTriangle.v1
-            line2 = clippedTriangle.v3-clippedTriangle.v1
-            surfaceNorm = crossProd(line1,line2)
-
-            if dot(surfaceNorm,clippedTriangle.v1-cam.position) < 0:
-                lightStr = diffuseLight(lights, surfaceNorm, clippedTriangle.v1, cam.position)
-                putTriangle(clippedTriangle
-                            .translate(-1*cam.position)
-                            .rotationY(cam.yaw)
-                            .rotationX(cam.pitch)
-                            .projection(cam.focalLenth)
-                            .toScreen(),lightStr)
+        for clippedTriangle in clip(triangle,cam.position,lookAt):
+            clipped += 1
+            written = _putWorldTriangle(clippedTriangle, cam, lights, transform)
+            if written is not None:
+                drawn += 1
+                pixels += written
+    if prof is not None:
+        _countFrame(prof, trianglesIn, clipped, drawn, pixels)
+
+def selectLod(mesh, cam: Camera, bounds=None):
+    """Return ``(level, mesh)``: the level of detail of ``mesh`` to draw from ``cam``.
+
+    Level 0 is the full mesh. ``bounds`` is the bounding sphere of the mesh
+    (a culling.BVHNode), its own one by default. The level and the triangles
+    saved are reported to the profiler (``lodLevel``, ``trianglesSaved``).
+    """
+    if not (LOD_ENABLED and mesh.lods):
+        return 0, mesh
+    if bounds is None:
+        bounds = mesh.bounds if isinstance(mesh, ArrayMesh) else mesh.bvh
+    level = lod.selectLevel([error for error, _ in mesh.lods], bounds.center, bounds.radius, cam, height, aspect)
+    chosen = mesh if level == 0 else mesh.lods[level-1][1]
+    if profiler is not None:
+        profiler.peak('lodLevel', level)
+        profiler.add('trianglesSaved', len(mesh)-len(chosen))
+    return level, chosen
+
+def _countFrame(prof, trianglesIn, clipped, drawn, pixels):
+    prof.add('trianglesIn', trianglesIn)
+    prof.add('trianglesClipped', clipped)
+    prof.add('trianglesCulled', clipped-drawn)
+    prof.add('pixels', pixels)
+
+def _putWorldTriangle(triangle: Triangle3D, cam: Camera, lights: list[LightSource], transform=None, colors=None,
+                      occlusion=None):
+    """Cull, shade, project and rasterize one world-space triangle in front of the camera.
+
+    Args:
+        transform (ViewTransform, optional): View transform of the frame,
+            built from ``cam`` when not given.
+        colors (tuple, optional): RGB of the three vertices for smooth
+            shading; the face is lit as a whole when not given.
+        occlusion (float, optional): Baked accessibility of the face.
+
+    Returns:
+        int | None: Pixels written, or None if the triangle faces away.
+    """
+    line1 = triangle.v2-triangle.v1
+    line2 = triangle.v3-triangle.v1
+    surfaceNorm = crossProd(line1,line2)
+
+    if dot(surfaceNorm,triangle.v1-cam.position) < 0:
+        lightStr = diffuseLight(lights, surfaceNorm, triangle.v1, cam.position, occlusion) if colors is None else None
+        if transform is None:
+            transform = ViewTransform(cam, viewport)
+        view1, view2, view3 = transform.view(triangle.v1), transform.view(triangle.v2), transform.view(triangle.v3)
+        if DEPTH_BUFFER_ENABLED:
+            depth = (view1.z, view2.z, view3.z)
+        else:
+            depth = None
+        screen = transform.screen
+        return putTriangle(Triangle2D(screen(view1), screen(view2), screen(view3)), lightStr, depth, colors)
+    return None
+
+def _clippedColors(triangle: Triangle3D, colors, piece: Triangle3D):
+    """Colours at the corners of a ``piece`` of ``triangle`` cut by ``clip()``.
+
+    They are interpolated from the corner ``colors`` of the whole triangle
+    with the barycentric coordinates of each corner of the piece.
+    """
+    a, b, c = triangle.v1, triangle.v2, triangle.v3
+    normal = crossProd(b-a, c-a)
+    scale = dot(normal, normal)
+    (r1, g1, b1), (r2, g2, b2), (r3, g3, b3) = colors
+    result = []
+    for p in (piece.v1, piece.v2, piece.v3):
+        w1 = dot(crossProd(c-b, p-b), normal)/scale
+        w2 = dot(crossProd(a-c, p-c), normal)/scale
+        w3 = 1-w1-w2
+        result.append((w1*r1+w2*r2+w3*r3, w1*g1+w2*g2+w3*g3, w1*b1+w2*b2+w3*b3))
+    return tuple(result)
+
+def _putIndexedMesh(mesh: IndexedMesh, cam: Camera, lights: list[LightSource]):
+    """putMesh for an IndexedMesh: every shared vertex is transformed once per frame.
+
+    Groups of faces outside the view frustum are rejected through the mesh
+    BVH, and single faces through per-vertex outcodes, before anything else
+    is done with them. Faces entirely in front of the near plane use the
+    per-vertex screen positions and the load-time normals; faces crossing it
+    go through ``clip()`` like the list path, so both produce the same frame.
+    """
+    prof = profiler
+    if prof is not None:
+        start = perf_counter()
+    vertices = mesh.vertices
+    faces = mesh.faces
+    camPos = cam.position
+    lookAt = cam.getLookAtDirection()
+    zNear = camPos+0.1*lookAt
+    transform = ViewTransform(cam, viewport)
+    toView, toScreen = transform.view, transform.screen
+
+    planes = culling.sidePlanes(cam, width, height, aspect)
+    leaves = culling.visibleLeaves(mesh.bvh, cam, planes)
+
+    # Near-plane side, view depth and screen position of the vertices of the
+    # visible leaves, each computed once
+    outside = [None]*len(vertices)
+    views = [None]*len(vertices)
+    screen = [None]*len(vertices)
+    depth = [None]*len(vertices)
+    codes = [None]*len(vertices)
+    order = []
+    for leaf, inside in leaves:
+        for i in leaf.vertices:
+            if outside[i] is None:
+                v = vertices[i]
+                outside[i] = dot(zNear-v,lookAt) > 0
+                if not outside[i]:
+                    view = views[i] = toView(v)
+                    depth[i] = view.z
+                    screen[i] = toScreen(view)
+        if inside:
+            order.extend(leaf.faces)
+            continue
+        # Leaf crossing a side plane: drop faces entirely beyond one of them
+        for i in leaf.vertices:
+            if codes[i] is None:
+                view = views[i]
+                if view is None:
+                    view = views[i] = toView(vertices[i])
+                codes[i] = culling.outcode(view, planes)
+        for f in leaf.faces:
+            a, b, c = faces[f]
+            if not (codes[a] & codes[b] & codes[c]):
+                order.append(f)
+    # Back to mesh order so ties resolve as without culling
+    order.sort()
+    visible = len(order)
+    # Back faces in front of the near plane are dropped before sorting and
+    # shading, with the answers of the previous frames where the camera
+    # cannot have crossed their plane
+    order = mesh.facing.frontFaces(mesh, order, camPos, outside)
+    if prof is not None:
+        prof.add('transform', perf_counter()-start)
+        prof.add('trianglesOffscreen', len(faces)-visible)
+        start = perf_counter()
+
+    if not DEPTH_BUFFER_ENABLED:
+        # Same key as distanceTriangle() in putMesh, without the vec3 temporaries
+        cx, cy, cz = camPos.x, camPos.y, camPos.z
+        def distanceFace(i):
+            a, b, c = faces[i]
+            va, vb, vc = vertices[a], vertices[b], vertices[c]
+            x = (va.x+vb.x+vc.x)*(1/3)-cx
+            y = (va.y+vb.y+vc.y)*(1/3)-cy
+            z = (va.z+vb.z+vc.z)*(1/3)-cz
+            return sqrt(x*x+y*y+z*z)
+        order.sort(key=distanceFace, reverse=True)
+    if prof is not None:
+        prof.add('sort', perf_counter()-start)
+
+    normals = mesh.normals
+    faceOcclusion = mesh.faceOcclusion
+    shading = mesh.shading
+    shading.update(lights, camPos)
+    smooth = SMOOTH_SHADING_ENABLED
+    if smooth:
+        corners, pointVertices, pointNormals = mesh.smooth.corners, mesh.smooth.vertices, mesh.smooth.normals
+        pointColor = mesh.vertexShading.color
+        mesh.vertexShading.update(lights, camPos)
+    rows = rasterRows
+    # Back faces dropped above count as clipped, like in the loop below
+    clipped = visible-len(order)
+    drawn = pixels = 0
+    for i in order:
+        a, b, c = faces[i]
+        if rows is not None and not (outside[a] or outside[b] or outside[c]):
+            # Skip shading faces that cannot reach the rows being rendered
+            ya, yb, yc = screen[a].y, screen[b].y, screen[c].y
+            if max(ya, yb, yc) < rows[0]-1 or min(ya, yb, yc) > rows[1]:
+                continue
+        if outside[a] or outside[b] or outside[c]:
+            if not (outside[a] and outside[b] and outside[c]):
+                triangle = Triangle3D(vertices[a], vertices[b], vertices[c])
+                colors = None
+                if smooth and dot(normals[i], vertices[a]-camPos) < 0:
+                    # Pieces of a back face are not drawn: no colours to compute
+                    colors = tuple(pointColor(p, pointNormals[p], vertices[pointVertices[p]]) for p in corners[i])
+                for clippedTriangle in clip(triangle, camPos, lookAt):
+                    clipped += 1
+                    written = _putWorldTriangle(clippedTriangle, cam, lights, transform,
+                                                colors and _clippedColors(triangle, colors, clippedTriangle),
+                                                None if faceOcclusion is None else faceOcclusion[i])
+                    if written is not None:
+                        drawn += 1
+                        pixels += written
+            continue
+        clipped += 1
+        drawn += 1
+        if smooth:
+            colors = tuple(pointColor(p, pointNormals[p], vertices[pointVertices[p]]) for p in corners[i])
+            pixels += putTriangle(Triangle2D(screen[a], screen[b], screen[c]), None,
+                                  (depth[a], depth[b], depth[c]) if DEPTH_BUFFER_ENABLED else None, colors)
+            continue
+        lightStr = shading.shade(i, normals[i], vertices[a])
+        pixels += putTriangle(Triangle2D(screen[a], screen[b], screen[c]), lightStr,
+                              (depth[a], depth[b], depth[c]) if DEPTH_BUFFER_ENABLED else None)
+    if prof is not None:
+        _countFrame(prof, len(faces), clipped, drawn, pixels)
+
+
+def _putArrayMesh(mesh: ArrayMesh, cam: Camera, lights: list[LightSource]):
+    """Batched NumPy version of putMesh for an ArrayMesh.
+
+    Every step mirrors the object path operation for operation so both paths
+    produce the same frame; near-plane clipping is done for all triangles at
+    once by ``clipTriangles()``.
+    """
+    # Whole mesh behind the camera or off screen
+    if not culling.visibleLeaves(mesh.bounds, cam, culling.sidePlanes(cam, width, height, aspect)):
+        return
+
+    prof = profiler
+    if prof is not None:
+        start = perf_counter()
+    camPos = np.array([cam.position.x, cam.position.y, cam.position.z])
+    tris = mesh.vertices[mesh.indices]
+    faceIds = np.arange(len(tris))
+
+    if not DEPTH_BUFFER_ENABLED:
+        # Painter's order, same key and tie order as the sorted() in putMesh
+        centre = (1/3)*(tris[:, 0]+tris[:, 1]+tris[:, 2])-camPos
+        distance = np.sqrt(centre[:, 0]*centre[:, 0]+centre[:, 1]*centre[:, 1]+centre[:, 2]*centre[:, 2])
+        previous = mesh.drawOrder
+        if previous is not None:
+            # Refine the previous frame's order, nearly sorted when the camera
+            # moved a little: the stable sort is adaptive
+            key = -distance[previous]
+            ranks = np.argsort(key, kind='stable')
+            faceIds = previous[ranks]
+            key = key[ranks]
+            tie = key[1:] == key[:-1]
+            if tie.any():
+                # Equal keys kept the previous order: put them back in mesh order
+                group = np.zeros(len(key), dtype=bool)
+                group[1:] |= tie
+                group[:-1] |= tie
+                at = np.flatnonzero(group)
+                faceIds[at] = faceIds[at][np.lexsort((faceIds[at], key[at]))]
+        else:
+            faceIds = np.argsort(-distance, kind='stable')
+        mesh.drawOrder = faceIds
+        tris = tris[faceIds]
+    if prof is not None:
+        prof.add('sort', perf_counter()-start)
+        start = perf_counter()
 
+    lookAt = cam.getLookAtDirection()
+    inside, pieces, source = clipTriangles(tris, camPos, np.array([lookAt.x, lookAt.y, lookAt.z]))
+    if len(pieces):
+        # Pieces take the place of their triangle in the draw order; split
+        # triangles are not memoized: -1-id keeps the face they come from
+        sub = np.arange(len(source))-np.searchsorted(source, source)
+        drawOrder = np.argsort(np.concatenate((2*inside, 2*source+sub)), kind='stable')
+        tris = np.concatenate((tris[inside], pieces))[drawOrder]
+        faceIds = np.concatenate((faceIds[inside], -1-faceIds[source]))[drawOrder]
+    elif len(inside) < len(tris):
+        tris, faceIds = tris[inside], faceIds[inside]
+    clipped = len(tris)
+    if prof is not None:
+        prof.add('clip', perf_counter()-start)
+        start = perf_counter()
+
+    # Back-face test, with load-time normals for the triangles left whole
+    surfaceNorm = mesh.normals[faceIds]
+    split = faceIds < 0
+    if split.any():
+        splitTris = tris[split]
+        surfaceNorm[split] = _crossRows(splitTris[:, 1]-splitTris[:, 0], splitTris[:, 2]-splitTris[:, 0])
+    toCam = tris[:, 0]-camPos
+    facing = (surfaceNorm[:, 0]*toCam[:, 0]+surfaceNorm[:, 1]*toCam[:, 1]+surfaceNorm[:, 2]*toCam[:, 2]) < 0
+    tris = tris[facing]
+    surfaceNorm = surfaceNorm[facing]
+    faceIds = faceIds[facing]
+
+    # Camera transform, projection and screen mapping for all vertices at once
+    p = tris+(-1*camPos)
+    x, y, z = p[..., 0], p[..., 1], p[..., 2]
+    x, z = cos(cam.yaw)*x+sin(cam.yaw)*z, -sin(cam.yaw)*x+cos(cam.yaw)*z
+    y, z = cos(cam.pitch)*y-sin(cam.pitch)*z, sin(cam.pitch)*y+cos(cam.pitch)*z
+    depth = z.tolist() if DEPTH_BUFFER_ENABLED else [None]*len(z)
+    x = x*cam.focalLenth/z
+    y = y*cam.focalLenth/z
+    scaleX, offsetX, scaleY, offsetY = viewport
+    sx = scaleX*x+offsetX
+    sy = offsetY-scaleY*y
+
+    # Drop triangles lying entirely beyond one screen edge
+    onScreen = ~(np.all(sx < -0.5, axis=1) | np.all(sx > width-0.5, axis=1)
+                 | np.all(sy < -0.5, axis=1) | np.all(sy > height-0.5, axis=1))
+    if not onScreen.all():
+        sx, sy, tris = sx[onScreen], sy[onScreen], tris[onScreen]
+        surfaceNorm, faceIds = surfaceNorm[onScreen], faceIds[onScreen]
+        depth = [d for d, keep in zip(depth, onScreen.tolist()) if keep]
+    if prof is not None:
+        prof.add('transform', perf_counter()-start)
+
+    faceOcclusion = mesh.faceOcclusion
+    shading = mesh.shading
+    shading.update(lights, cam.position)
+    smooth = SMOOTH_SHADING_ENABLED
+    if smooth:
+        corners, pointPositions, pointNormals = mesh.smooth.corners, mesh.pointPositions, mesh.smooth.normals
+        pointColor = mesh.vertexShading.color
+        mesh.vertexShading.update(lights, cam.position)
+        meshVertices = mesh.vertices
+        meshIndices = mesh.indices
+    pixels = 0
+    for faceId, norm, worldTriangle, xs, ys, zs in zip(faceIds.tolist(), surfaceNorm.tolist(), tris.tolist(),
+                                                       sx.tolist(), sy.tolist(), depth):
+        vertex = worldTriangle[0]
+        screenTriangle = Triangle2D(vec2(xs[0], ys[0]), vec2(xs[1], ys[1]), vec2(xs[2], ys[2]))
+        if smooth:
+            face = faceId if faceId >= 0 else -1-faceId
+            whole = None
+            if faceId < 0:
+                # Piece of a split triangle: colours interpolated from the whole
+                # face, which is shaded only if it faces the camera itself
+                whole = Triangle3D(*(vec3(*v) for v in meshVertices[meshIndices[face]].tolist()))
+                if dot(vec3(*mesh.normals[face].tolist()), whole.v1-cam.position) >= 0:
+                    whole = False
+            if whole is not False:
+                colors = tuple(pointColor(p, pointNormals[p], pointPositions[p]) for p in corners[face])
+                if whole is not None:
+                    colors = _clippedColors(whole, colors, Triangle3D(*(vec3(*v) for v in worldTriangle)))
+                pixels += putTriangle(screenTriangle, None, zs, colors)
+                continue
+        if faceId < 0:
+            lightStr = diffuseLight(lights, vec3(*norm), vec3(*vertex), cam.position,
+                                    None if faceOcclusion is None else faceOcclusion[-1-faceId])
+        else:
+            lightStr = shading.shade(faceId, vec3(*norm), vec3(*vertex))
+        pixels += putTriangle(screenTriangle, lightStr, zs)
+    if prof is not None:
+        _countFrame(prof, len(mesh), clipped, int(facing.sum()), pixels)
+        prof.add('trianglesOffscreen', int(facing.sum())-len(tris))
+
+
+_untimed = (clip, diffuseLight, putTriangle)
+
+_untimedShade = ShadingCache.shade
+_untimedColor = ShadingCache.color
+
+def setProfiler(newProfiler):
+    """Install a profiler.FrameProfiler, or None to turn profiling off.
+
+    While a profiler is installed, ``clip``, ``diffuseLight``,
+    ``ShadingCache.shade``, ``ShadingCache.color`` and ``putTriangle`` are
+    swapped for timed wrappers
+    (stages ``clip``, ``lighting`` and ``raster``), so the render loop pays
+    nothing when profiling is off.
+    """
+    global profiler, clip, diffuseLight, putTriangle
+    clip, diffuseLight, putTriangle = _untimed
+    ShadingCache.shade = _untimedShade
+    ShadingCache.color = _untimedColor
+    profiler = newProfiler
+    if newProfiler is not None:
+        clip = newProfiler.timed('clip', clip)
+        diffuseLight = newProfiler.timed('lighting', diffuseLight)
+        ShadingCache.shade = newProfiler.timed('lighting', ShadingCache.shade)
+        ShadingCache.color = newProfiler.timed('lighting', ShadingCache.color)
+        putTriangle = newProfiler.timed('raster', putTriangle)
@@ -0,0 +1,152 @@
+"""Ambient occlusion baked per vertex at load time.
+
+Every vertex stands for a small disc of the surface: its area is a third of
+the faces around it and its normal their area-weighted normal. For each
+vertex, the hemisphere above it is sampled in direction bins (the cells of
+a cube map, ``BIN_GRID`` x ``BIN_GRID`` per face): the discs of the vertices within ``AO_RADIUS`` (a
+fraction of the mesh size) cover the bins they lie in by their solid angle,
+and the occlusion is the cosine-weighted part of the hemisphere covered.
+Nearby vertices are found through a uniform grid of cells of that radius.
+Flat and convex parts see no disc above their tangent plane and stay open;
+creases, folds and cavities get darker.
+
+The result is stored in the mesh cache (``mesh_cache.py``) with the
+positions, so it is computed once per model, and carried to the levels of
+detail by ``lod.decimate``.
+"""
+from math import atan2, pi, sqrt
+
+# Reach of the occluders, as a fraction of the size of the mesh
+AO_RADIUS = 0.15
+# Direction bins across each face of the cube map
+BIN_GRID = 3
+# The mesh size ignores this fraction of the vertices at each end of every
+# axis, so a few stray vertices far away do not stretch it
+SIZE_QUANTILE = 0.02
+
+
+def _bins(grid):
+    """Unit centre direction and solid angle of each cube-map bin."""
+    def corner(x, y):
+        return atan2(x*y, sqrt(x*x+y*y+1))
+    edges = [-1+2*k/grid for k in range(grid+1)]
+    centres = []
+    solidAngles = []
+    for axis in range(3):
+        for sign in (1.0, -1.0):
+            for i in range(grid):
+                for j in range(grid):
+                    u0, u1, v0, v1 = edges[i], edges[i+1], edges[j], edges[j+1]
+                    u, v = (u0+u1)/2, (v0+v1)/2
+                    direction = [0.0, 0.0, 0.0]
+                    direction[axis] = sign
+                    direction[(axis+1) % 3] = u
+                    direction[(axis+2) % 3] = v
+                    length = sqrt(1+u*u+v*v)
+                    centres.append(tuple(c/length for c in direction))
+                    solidAngles.append(corner(u0, v0)-corner(u0, v1)-corner(u1, v0)+corner(u1, v1))
+    return centres, solidAngles
+
+
+def _binOf(x, y, z, grid):
+    """Index of the cube-map bin of the direction ``(x, y, z)`` (see ``_bins``)."""
+    ax, ay, az = abs(x), abs(y), abs(z)
+    if ax >= ay and ax >= az:
+        axis, major, u, v = 0, x, y, z
+    elif ay >= az:
+        axis, major, u, v = 1, y, z, x
+    else:
+        axis, major, u, v = 2, z, x, y
+    scale = abs(major)
+    i = min(int((u/scale+1)/2*grid), grid-1)
+    j = min(int((v/scale+1)/2*grid), grid-1)
+    return ((axis*2+(major < 0))*grid+i)*grid+j
+
+
+def _size(values):
+    """Spread of ``values`` between the ``SIZE_QUANTILE`` quantiles."""
+    ordered = sorted(values)
+    skip = int(len(ordered)*SIZE_QUANTILE)
+    return ordered[-1-skip]-ordered[skip]
+
+
+def bakeOcclusion(coords, indices, radius=AO_RADIUS, grid=BIN_GRID) -> list[float]:
+    """Return the accessibility of each vertex, from 0 (fully occluded) to 1 (open).
+
+    Args:
+        coords (list[float]): Flat x, y, z vertex coordinates.
+        indices (list[int]): Flat triangle vertex indices.
+        radius (float): Reach of the occluders relative to the mesh size.
+        grid (int): Direction bins across each cube-map face.
+    """
+    count = len(coords)//3
+    if count == 0:
+        return []
+    xs, ys, zs = coords[0::3], coords[1::3], coords[2::3]
+    # Area-weighted vertex normals (sums of face cross products) and disc areas
+    nx, ny, nz = [0.0]*count, [0.0]*count, [0.0]*count
+    areas = [0.0]*count
+    for i in range(0, len(indices), 3):
+        a, b, c = indices[i], indices[i+1], indices[i+2]
+        ux, uy, uz = xs[b]-xs[a], ys[b]-ys[a], zs[b]-zs[a]
+        vx, vy, vz = xs[c]-xs[a], ys[c]-ys[a], zs[c]-zs[a]
+        cx, cy, cz = uy*vz-uz*vy, uz*vx-ux*vz, ux*vy-uy*vx
+        third = sqrt(cx*cx+cy*cy+cz*cz)/6
+        for v in (a, b, c):
+            nx[v] += cx
+            ny[v] += cy
+            nz[v] += cz
+            areas[v] += third
+    for v in range(count):
+        length = sqrt(nx[v]*nx[v]+ny[v]*ny[v]+nz[v]*nz[v])
+        if length > 0:
+            nx[v], ny[v], nz[v] = nx[v]/length, ny[v]/length, nz[v]/length
+
+    reach = radius*max(_size(xs), _size(ys), _size(zs))/2
+    if reach <= 0:
+        return [1.0]*count
+    reach2 = reach*reach
+    cells = {}
+    keys = []
+    for v in range(count):
+        key = (int(xs[v]//reach), int(ys[v]//reach), int(zs[v]//reach))
+        keys.append(key)
+        cells.setdefault(key, []).append(v)
+    centres, solidAngles = _bins(grid)
+
+    access = [1.0]*count
+    for v in range(count):
+        rx, ry, rz = nx[v], ny[v], nz[v]
+        if rx == 0 and ry == 0 and rz == 0:
+            continue
+        px, py, pz = xs[v], ys[v], zs[v]
+        kx, ky, kz = keys[v]
+        # Solid angle of the discs seen in each bin
+        cover = {}
+        for i in (kx-1, kx, kx+1):
+            for j in (ky-1, ky, ky+1):
+                for k in (kz-1, kz, kz+1):
+                    for e in cells.get((i, j, k), ()):
+                        dx, dy, dz = xs[e]-px, ys[e]-py, zs[e]-pz
+                        d2 = dx*dx+dy*dy+dz*dz
+                        if d2 >= reach2 or d2 == 0:
+                            continue
+                        # Only discs above the tangent plane hide part of the hemisphere
+                        if rx*dx+ry*dy+rz*dz <= 0:
+                            continue
+                        d = sqrt(d2)
+                        # Disc of the foreshortened area seen on its axis at distance d
+                        seen = areas[e]*abs(nx[e]*dx+ny[e]*dy+nz[e]*dz)/(d*pi)
+                        b = _binOf(dx, dy, dz, grid)
+                        cover[b] = cover.get(b, 0.0)+2*pi*(1-d/sqrt(d2+seen))
+        if not cover:
+            continue
+        hidden = total = 0.0
+        for b, (cx, cy, cz) in enumerate(centres):
+            weight = (rx*cx+ry*cy+rz*cz)*solidAngles[b]
+            if weight > 0:
+                total += weight
+                if b in cover:
+                    hidden += weight*min(cover[b]/solidAngles[b], 1.0)
+        access[v] = 1-hidden/total
+    return access
@@ -0,0 +1,179 @@
+"""Frame pacing for the render loop.
+
+A FrameScheduler runs the loop at a target frame rate. It sleeps only for
+what is left of the frame budget, drops the frame slots it has already
+missed instead of rushing to catch up, and only asks for a new frame when
+the scene state (camera, lights, render settings) changed, so an idle
+scene costs almost nothing. When rendering stays over budget it applies the
+``DEGRADE_STEPS`` one after the other, and undoes them once frames are
+cheap again or the scene is idle.
+
+Usage:
+    scheduler = FrameScheduler(30, state=lambda: (cam.position.printco(), cam.pitch, cam.yaw))
+    while running:
+        dt = scheduler.tick()
+        ...  # input and animation, moving by speed * dt
+        if scheduler.needsFrame():
+            ...  # clear, putMesh, draw
+            scheduler.frameDone()
+        scheduler.wait()
+"""
+import time
+from time import perf_counter
+
+import lod
+import moteur_graphique as mg
+
+# Frames over budget (by moving average) before degrading one more step
+DEGRADE_FRAMES = 3
+# Frames under RESTORE_FRACTION of the budget before undoing one step
+RESTORE_FRAMES = 30
+RESTORE_FRACTION = 0.5
+# Weight of the newest frame in the moving average of the frame cost
+COST_SMOOTHING = 0.3
+
+
+def coarserLod():
+    """Allow four times the LOD error; return the function undoing it."""
+    previous = lod.LOD_ERROR
+    lod.LOD_ERROR = previous * 4
+
+    def restore():
+        lod.LOD_ERROR = previous
+    return restore
+
+
+def noSpecular():
+    """Turn specular highlights off; return the function undoing it."""
+    previous = mg.SPECULAR_ENABLED
+    mg.SPECULAR_ENABLED = False
+
+    def restore():
+        # Leave it alone if it was switched back on in the meantime
+        if not mg.SPECULAR_ENABLED:
+            mg.SPECULAR_ENABLED = previous
+    return restore
+
+
+def flatShading():
+    """Turn smooth shading off; return the function undoing it."""
+    previous = mg.SMOOTH_SHADING_ENABLED
+    mg.SMOOTH_SHADING_ENABLED = False
+
+    def restore():
+        if not mg.SMOOTH_SHADING_ENABLED:
+            mg.SMOOTH_SHADING_ENABLED = previous
+    return restore
+
+
+def noShadows():
+    """Turn shadows off; return the function undoing it."""
+    previous = mg.SHADOWS_ENABLED
+    mg.SHADOWS_ENABLED = False
+
+    def restore():
+        if not mg.SHADOWS_ENABLED:
+            mg.SHADOWS_ENABLED = previous
+    return restore
+
+
+# Applied in order while frames are over budget, undone in reverse order
+DEGRADE_STEPS = (coarserLod, noSpecular, flatShading, noShadows)
+
+
+class FrameScheduler:
+    """Paces the render loop at ``targetFps`` and adapts quality to the frame cost.
+
+    Args:
+        targetFps (float): Frames per second aimed at.
+        state (Callable[[], object], optional): Returns a comparable snapshot
+            of everything that affects the picture; a frame is rendered only
+            when it changed. Without it every loop renders.
+        maxDt (float): Largest time step returned by ``tick()``, in seconds.
+        steps (Sequence[Callable[[], Callable[[], None]]]): Degrade steps.
+    """
+
+    def __init__(self, targetFps=30, state=None, maxDt=0.1, steps=DEGRADE_STEPS) -> None:
+        if targetFps <= 0:
+            raise ValueError("targetFps must be positive")
+        self.budget = 1 / targetFps
+        self.state = state
+        self.maxDt = maxDt
+        self.steps = steps
+        self.cost = 0.0
+        self.skipped = 0
+        self._restores = []
+        self._over = self._under = 0
+        self._last = None
+        self._lastState = self._noState = object()
+        self._frameStart = None
+        self._deadline = None
+
+    @property
+    def level(self) -> int:
+        """Number of degrade steps currently applied."""
+        return len(self._restores)
+
+    def tick(self) -> float:
+        """Start a loop iteration and return the time step since the previous one, in seconds."""
+        now = perf_counter()
+        dt = 0.0 if self._last is None else min(now - self._last, self.maxDt)
+        self._last = self._frameStart = now
+        return dt
+
+    def needsFrame(self) -> bool:
+        """Return True when the scene changed since the last rendered frame."""
+        if self.state is None:
+            return True
+        state = self.state()
+        if state == self._lastState:
+            if not self._restores:
+                return False
+            # Idle while degraded: draw it once more at full quality
+            self.restoreAll()
+            state = self.state()
+        self._lastState = state
+        return True
+
+    def invalidate(self):
+        """Render the next frame even if the scene did not change."""
+        self._lastState = self._noState
+
+    def frameDone(self):
+        """Record the cost of the frame rendered since ``tick()`` and adapt the quality."""
+        cost = perf_counter() - self._frameStart
+        self.cost += COST_SMOOTHING * (cost - self.cost) if self.cost else cost
+        if self.cost > self.budget:
+            self._over += 1
+            self._under = 0
+            if self._over >= DEGRADE_FRAMES and len(self._restores) < len(self.steps):
+                self._restores.append(self.steps[len(self._restores)]())
+                self._over = 0
+        elif self.cost < self.budget * RESTORE_FRACTION:
+            self._under += 1
+            self._over = 0
+            if self._under >= RESTORE_FRAMES and self._restores:
+                self._restores.pop()()
+                self._under = 0
+        else:
+            self._over = self._under = 0
+
+    def restoreAll(self):
+        """Undo every degrade step."""
+        while self._restores:
+            self._restores.pop()()
+        self._over = self._under = 0
+
+    def wait(self):
+        """Sleep until the next frame slot, skipping the slots already missed."""
+        now = perf_counter()
+        if self._deadline is None:
+            self._deadline = now
+        self._deadline += self.budget
+        if now >= self._deadline:
+            # Late: drop the whole slots missed and start again from now
+            # rather than piling up latency
+            self.skipped += int((now - self._deadline) / self.budget)
+            self._deadline = now
+            return
+        time.sleep(self._deadline - now)
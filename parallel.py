@@ -0,0 +1,161 @@
+"""Multi-process rendering of an IndexedMesh in horizontal screen tiles.
+
+The mesh (with its baked ambient occlusion, if any) is copied once into
+shared memory. Every worker of the process pool
+rebuilds its own IndexedMesh from it (keeping its ShadingCache across
+frames), so only the camera, the lights and the render toggles are sent each
+frame. With ``castShadows=True`` every worker also keeps shadow maps of the
+lights with its mesh as the caster, rebuilt in the worker when a light
+moves. Each tile is a band of rows: the worker runs the usual pipeline with
+``moteur_graphique.rasterRows`` set to that band and sends the band back,
+and the bands are merged into ``pixelBuffer`` before ``draw()``. Rendering is
+exactly the single-process one, pixel for pixel.
+
+Usage:
+    with ParallelRenderer(mg.loadObj("Car.obj"), workers=8) as renderer:
+        mg.clear(' ')
+        renderer.putMesh(cam, lights)
+        mg.draw()
+"""
+import os
+from array import array
+from multiprocessing import Pool, shared_memory
+
+import lod
+import moteur_graphique as mg
+import shadows
+from lib_math import vec3
+
+# Mesh rebuilt by each worker process from shared memory
+_workerMesh = None
+# shadows.ShadowMaps of each worker process, None without shadows
+_workerShadows = None
+
+
+def _initWorker(shmName, vertexCount, faceCount, levels, castShadows=False, baked=False):
+    global _workerMesh, _workerShadows
+    if castShadows:
+        _workerShadows = shadows.ShadowMaps()
+    shm = shared_memory.SharedMemory(name=shmName)
+    try:
+        view = shm.buf
+        indexEnd = vertexCount * 24 + faceCount * 24
+        coords = view[:vertexCount * 24].cast('d').tolist()
+        indices = view[vertexCount * 24:indexEnd].cast('q').tolist()
+        occlusion = view[indexEnd:indexEnd + vertexCount * 8].cast('d').tolist() if baked else None
+        view.release()
+    finally:
+        shm.close()
+    _workerMesh = mg.indexedMesh(coords, indices, levels, occlusion)
+
+
+def _renderTile(job):
+    """Render rows [first, end) of the frame described by ``job`` and return their cells."""
+    size, camState, lightStates, toggles, shadowSizes, first, end = job
+    columns, rows, mode = size
+    if mode != mg.outputMode:
+        mg.setOutputMode(mode)
+    if (mg.columns, mg.rows) != (columns, rows):
+        mg.resize(columns, rows)
+    (mg.AMBIENT_OCCLUSION_ENABLED, mg.SPECULAR_ENABLED, mg.DEPTH_BUFFER_ENABLED, mg.LOD_ENABLED,
+     mg.SMOOTH_SHADING_ENABLED, mg.SHADOWS_ENABLED, lod.LOD_ERROR) = toggles
+    position, pitch, yaw, focalLenth = camState
+    cam = mg.Camera(vec3(*position), pitch, yaw, focalLenth)
+    lights = [mg.LightSource(vec3(*p), color, intensity) for p, color, intensity in lightStates]
+    mg.shadowMaps = None
+    if _workerShadows is not None and mg.SHADOWS_ENABLED:
+        # Map sizes planned by the main process: every tile of a frame uses the same maps
+        _workerShadows.update(lights, [_workerMesh], shadowSizes)
+        mg.shadowMaps = _workerShadows
+
+    width = mg.width
+    mg.pixelBuffer[first * width:end * width] = [' '] * ((end - first) * width)
+    mg.depthBuffer[first * width:end * width] = [0.0] * ((end - first) * width)
+    mg.rasterRows = (first, end)
+    try:
+        mg.putMesh(_workerMesh, cam, lights)
+    finally:
+        mg.rasterRows = None
+    return mg.pixelBuffer[first * width:end * width]
+
+
+class ParallelRenderer:
+    """Render one mesh with a pool of worker processes, one screen band per task.
+
+    Args:
+        mesh (IndexedMesh | ArrayMesh | list[Triangle3D]): Mesh to render.
+        workers (int, optional): Number of processes, ``os.cpu_count()`` by default.
+        tiles (int, optional): Number of bands per frame, ``workers`` by default.
+        castShadows (bool): Shade with shadow maps of the lights (see ``shadows.py``).
+    """
+
+    def __init__(self, mesh, workers=None, tiles=None, castShadows=False) -> None:
+        coords, indices, occlusion = _flatten(mesh)
+        self.workers = workers or os.cpu_count() or 1
+        self.tiles = tiles or self.workers
+        data = array('d', coords).tobytes() + array('q', indices).tobytes()
+        if occlusion is not None:
+            data += array('d', occlusion).tobytes()
+        self._shm = shared_memory.SharedMemory(create=True, size=max(len(data), 1))
+        self._shm.buf[:len(data)] = data
+        levels = bool(getattr(mesh, 'lods', None))
+        # Tracks the motion of the lights to choose the map sizes of the workers
+        self.shadowMaps = shadows.ShadowMaps() if castShadows else None
+        self._pool = Pool(self.workers, _initWorker, (self._shm.name, len(coords) // 3, len(indices) // 3, levels,
+                                                      castShadows, occlusion is not None))
+
+    def putMesh(self, cam, lights):
+        """Render the mesh into ``moteur_graphique.pixelBuffer`` like ``putMesh()``."""
+        width, height = mg.width, mg.height
+        frame = ((mg.columns, mg.rows, mg.outputMode),
+                 (cam.position.printco(), cam.pitch, cam.yaw, cam.focalLenth),
+                 [(light.position.printco(), tuple(light.color), light.intensity) for light in lights],
+                 (mg.AMBIENT_OCCLUSION_ENABLED, mg.SPECULAR_ENABLED, mg.DEPTH_BUFFER_ENABLED, mg.LOD_ENABLED,
+                  mg.SMOOTH_SHADING_ENABLED, mg.SHADOWS_ENABLED, lod.LOD_ERROR),
+                 self.shadowMaps.plan(lights, ()) if self.shadowMaps is not None and mg.SHADOWS_ENABLED else None)
+        tiles = min(self.tiles, height) or 1
+        bounds = [height * k // tiles for k in range(tiles + 1)]
+        jobs = [frame + (bounds[k], bounds[k + 1]) for k in range(tiles)]
+        for (first, end), cells in zip(zip(bounds, bounds[1:]), self._pool.map(_renderTile, jobs)):
+            mg.pixelBuffer[first * width:end * width] = cells
+
+    def close(self):
+        """Stop the workers and release the shared mesh."""
+        self._pool.close()
+        self._pool.join()
+        self._shm.close()
+        self._shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _flatten(mesh):
+    """Return flat coordinates, indices and baked accessibility (or None) of any supported mesh."""
+    if isinstance(mesh, mg.ArrayMesh):
+        return mesh.vertices.ravel().tolist(), mesh.indices.ravel().tolist(), mesh.occlusion
+    if not isinstance(mesh, mg.IndexedMesh):
+        mesh = _indexTriangles(mesh)
+    coords = [c for v in mesh.vertices for c in (v.x, v.y, v.z)]
+    indices = [i for face in mesh.faces for i in face]
+    return coords, indices, mesh.occlusion
+
+
+def _indexTriangles(triangles):
+    """Build an IndexedMesh from Triangle3D objects, sharing identical vertex objects."""
+    vertices = []
+    faces = []
+    seen = {}
+    for triangle in triangles:
+        face = []
+        for v in (triangle.v1, triangle.v2, triangle.v3):
+            index = seen.get(id(v))
+            if index is None:
+                index = seen[id(v)] = len(vertices)
+                vertices.append(v)
+            face.append(index)
+        faces.append(tuple(face))
+    return mg.IndexedMesh(vertices, faces)
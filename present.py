@@ -0,0 +1,171 @@
+"""Pipelined presentation of frames to the terminal.
+
+``draw()`` encodes the frame and writes it before the next one can start, so
+a slow terminal or SSH link stalls rendering. A Presenter renders into one
+of ``buffers`` back Framebuffers (two or three) while an output thread
+encodes (``encodeFrame()``) and writes the previous finished frame. The
+thread always takes the newest finished frame: a frame still waiting when a
+newer one is ready is dropped, not queued, so a terminal that cannot keep
+up shows fewer frames instead of falling behind.
+
+The module-level framebuffer of ``moteur_graphique`` stays the one
+``resize()`` and ``setOutputMode()`` act on; the back buffers follow its
+size, mode and position. Only the output thread writes to the stream while
+frames are presented: text meant for the screen (the status line) goes with
+the frame to ``submit()``.
+
+Writes release the GIL, so rendering goes on while the thread waits for the
+terminal; encoding still shares the interpreter with rendering.
+
+Usage:
+    with Presenter(buffers=2) as presenter:
+        while running:
+            with presenter.frame() as back:
+                mg.clear(' ')
+                mg.putMesh(mesh, cam, lights)
+            presenter.submit(back, status="...")
+"""
+import sys
+import threading
+from contextlib import contextmanager
+from time import perf_counter
+
+import moteur_graphique as mg
+
+
+class Presenter:
+    """Present frames from a background thread, dropping the ones it cannot keep up with.
+
+    Args:
+        buffers (int): Back framebuffers, 2 or 3. With two, the finished
+            frame still waiting for the thread is reused (and dropped) when
+            the next frame starts; with three, the next frame renders into
+            a free buffer and the waiting one is only dropped if it is still
+            waiting when the next one is submitted.
+        stream (TextIO, optional): Output stream, ``sys.stdout`` by default.
+
+    Attributes:
+        presented (int): Frames written so far.
+        dropped (int): Frames rendered but never written.
+        presentTime (float): Seconds spent encoding and writing the last
+            frame written.
+        bytes (int): Size in bytes of the output of the last frame written.
+    """
+
+    def __init__(self, buffers=2, stream=None) -> None:
+        if buffers not in (2, 3):
+            raise ValueError(f"a Presenter needs 2 or 3 buffers, not {buffers}")
+        self.stream = stream or sys.stdout
+        self.presented = 0
+        self.dropped = 0
+        self.presentTime = 0.0
+        self.bytes = 0
+        self._free = [mg.Framebuffer(mg.columns, mg.rows, mg.outputMode) for _ in range(buffers)]
+        # Finished frame waiting for the thread, as (framebuffer, status)
+        self._pending = None
+        # Cells shown by the terminal, owned by the thread
+        self._front = []
+        self._repaint = False
+        self._running = True
+        self._error = None
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _acquire(self):
+        """Take a back buffer for the next frame, shaped like the active framebuffer."""
+        with self._condition:
+            if self._free:
+                fb = self._free.pop()
+            else:
+                # Every other buffer is being written or waiting: drop the waiting frame
+                fb = self._pending[0]
+                self._pending = None
+                self.dropped += 1
+        shape = mg.framebuffer
+        if (fb.columns, fb.rows, fb.mode) != (shape.columns, shape.rows, shape.mode):
+            fb.resize(shape.columns, shape.rows, shape.mode)
+        fb.left, fb.top = shape.left, shape.top
+        return fb
+
+    @contextmanager
+    def frame(self):
+        """Context in which the module-level functions render into a back buffer, given as value.
+
+        The buffer is handed back with ``submit()`` once the frame is
+        finished; it returns to the free buffers if rendering raises.
+        """
+        fb = self._acquire()
+        previous = mg.useFramebuffer(fb)
+        try:
+            yield fb
+        except BaseException:
+            with self._condition:
+                self._free.append(fb)
+            raise
+        finally:
+            mg.useFramebuffer(previous)
+
+    def submit(self, fb, status=None):
+        """Queue the finished frame of ``fb`` for the thread, replacing a frame still waiting.
+
+        ``status`` is text written after the frame, on the line below it.
+        An I/O error of the thread is raised here.
+        """
+        if self._error is not None:
+            raise self._error
+        with self._condition:
+            if self._pending is not None:
+                self._free.append(self._pending[0])
+                self.dropped += 1
+            self._pending = (fb, status)
+            self._condition.notify()
+
+    def invalidate(self):
+        """Clear the terminal and repaint every cell with the next frame written."""
+        with self._condition:
+            self._repaint = True
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while self._pending is None and self._running:
+                    self._condition.wait()
+                if self._pending is None:
+                    return
+                (fb, status), self._pending = self._pending, None
+                repaint, self._repaint = self._repaint, False
+            start = perf_counter()
+            out = ''
+            if repaint or len(self._front) != fb.columns * fb.rows:
+                self._front = [None] * (fb.columns * fb.rows)
+                out = '\033[2J'
+            out += mg.encodeFrame(fb, self._front)
+            if status is not None:
+                out += status
+            if self._error is None:
+                try:
+                    self.stream.write(out)
+                    self.stream.flush()
+                except OSError as error:
+                    self._error = error
+            with self._condition:
+                self.presentTime = perf_counter() - start
+                self.bytes = len(out.encode('utf-8'))
+                self.presented += 1
+                self._free.append(fb)
+
+    def close(self):
+        """Write the frame still waiting, if any, and stop the thread."""
+        with self._condition:
+            self._running = False
+            self._condition.notify()
+        self._thread.join()
+        if self._error is not None:
+            raise self._error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,116 @@
+"""Per-frame profiling of the render loop.
+
+A FrameProfiler collects, for every frame, the time spent in each stage
+(``input``, ``clear``, ``putMesh`` and its ``transform``, ``sort``, ``clip``,
+``lighting`` and ``raster`` parts, ``draw``; ``present``, the time the
+output thread of ``present.py`` took to write the last frame) and counters
+such as ``trianglesIn``, ``trianglesClipped``, ``trianglesCulled``,
+``pixels``, ``bytes``, ``dropped``, ``lodLevel`` and ``trianglesSaved``. Install it with ``moteur_graphique.setProfiler``; while no profiler
+is installed the engine does not time anything.
+"""
+import csv
+import json
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from functools import wraps
+from time import perf_counter
+
+
+class FrameProfiler:
+    """Records stage timings (seconds) and counters for each frame.
+
+    Args:
+        window (int): Number of recent frames used for FPS and percentiles.
+        keepTrace (bool): Keep every frame record for ``dump()``.
+    """
+
+    def __init__(self, window=240, keepTrace=False) -> None:
+        self.recent = deque(maxlen=window)
+        self.trace = [] if keepTrace else None
+        self.current = None
+        self._frameStart = 0.0
+
+    def beginFrame(self):
+        """Start recording a new frame."""
+        self.current = defaultdict(int)
+        self._frameStart = perf_counter()
+
+    def endFrame(self):
+        """Close the current frame and store its record."""
+        if self.current is None:
+            return
+        record = dict(self.current)
+        record['frame'] = perf_counter() - self._frameStart
+        self.recent.append(record)
+        if self.trace is not None:
+            self.trace.append(record)
+        self.current = None
+
+    def discardFrame(self):
+        """Drop the current frame without storing it (nothing was rendered)."""
+        self.current = None
+
+    @contextmanager
+    def stage(self, name):
+        """Time the enclosed block and add it to stage ``name``."""
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, perf_counter() - start)
+
+    def add(self, name, value):
+        """Add ``value`` to the stage time or counter ``name`` of the current frame."""
+        if self.current is not None:
+            self.current[name] += value
+
+    def peak(self, name, value):
+        """Keep the largest ``value`` given for counter ``name`` in the current frame."""
+        if self.current is not None and value > self.current[name]:
+            self.current[name] = value
+
+    def timed(self, name, function):
+        """Wrap ``function`` so each call is added to stage ``name``."""
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            start = perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.add(name, perf_counter() - start)
+        return wrapper
+
+    def fps(self) -> float:
+        """Frames per second over the recent window."""
+        total = sum(record['frame'] for record in self.recent)
+        return len(self.recent) / total if total else 0.0
+
+    def percentile(self, p, name='frame') -> float:
+        """Return the ``p``-th percentile (0-100) of ``name`` over the recent window."""
+        values = sorted(record.get(name, 0.0) for record in self.recent)
+        if not values:
+            return 0.0
+        index = min(len(values) - 1, max(0, round(p / 100 * (len(values) - 1))))
+        return values[index]
+
+    def statusLine(self) -> str:
+        """Short summary for the status line."""
+        last = self.recent[-1] if self.recent else {}
+        return "fps %.1f p50 %.1f ms p99 %.1f ms tris %d/%d culled %d lod %d saved %d px %d out %d B" % (
+            self.fps(), self.percentile(50) * 1000, self.percentile(99) * 1000,
+            last.get('trianglesClipped', 0), last.get('trianglesIn', 0),
+            last.get('trianglesCulled', 0), last.get('lodLevel', 0), last.get('trianglesSaved', 0),
+            last.get('pixels', 0), last.get('bytes', 0))
+
+    def dump(self, path):
+        """Write the frame trace to ``path`` as JSON (``.json``) or CSV (anything else)."""
+        records = self.trace if self.trace is not None else list(self.recent)
+        if path.endswith('.json'):
+            with open(path, 'w') as file:
+                json.dump(records, file, indent=1)
+            return
+        columns = ['frame'] + sorted({key for record in records for key in record} - {'frame'})
+        with open(path, 'w', newline='') as file:
+            writer = csv.DictWriter(file, fieldnames=columns, restval=0)
+            writer.writeheader()
+            writer.writerows(records)
@@ -0,0 +1,257 @@
+"""Scene graph: several meshes, each drawn at its own position, rotation and scale.
+
+A SceneNode references a mesh loaded once (IndexedMesh or ArrayMesh) and any
+number of nodes may reference the same one: instances share its vertex,
+face, normal and BVH data. The world transform of a node is composed with
+its parent's once per node per frame. From it the node gets a world-space
+copy of the vertex positions and normals. A static node keeps that copy
+(and the lighting memoized on it) until its world transform changes. A
+dynamic node rebuilds it each frame without keeping it. Nodes whose bounding
+sphere is outside the view frustum are skipped before any vertex is moved,
+and the level of detail of the others is chosen from their world bounding
+sphere before their copy is made.
+
+A Scene given a ``shadows.ShadowMaps`` updates it each frame with every node
+as a caster, visible or not, and lights the nodes with it. The caster copy
+of a static node is kept like its world copy, so the maps of still lights
+are only rebuilt when a node moves.
+
+Without the depth buffer, nodes are drawn back to front by the distance of
+their bounding sphere and the faces of each node are sorted as usual, so
+objects that interpenetrate need ``DEPTH_BUFFER_ENABLED``.
+
+Usage:
+    car = mg.loadObj("Car.obj")
+    scene = Scene()
+    for i in range(3):
+        scene.add(SceneNode(car, position=vec3(6 * i, 0, 0), rotation=(0, 0.5 * i, 0)))
+    mg.clear(' ')
+    scene.putMesh(cam, lights)
+    mg.draw()
+"""
+from math import cos, sin
+
+import culling
+import moteur_graphique as mg
+from lib_math import vec3
+
+# Rotation part (row-major 3x3) and translation of the identity transform
+IDENTITY = ((1.0, 0.0, 0.0, 0.0, 1.0, 0.0, 0.0, 0.0, 1.0), (0.0, 0.0, 0.0), 1.0)
+
+
+def localTransform(position, rotation, scale):
+    """Return ``(matrix, translation, scale)`` for a node.
+
+    ``rotation`` is ``(pitch, yaw, roll)`` in radians, applied roll first,
+    then pitch (``vec3.rotationX``), then yaw (``vec3.rotationY``).
+    """
+    pitch, yaw, roll = rotation
+    cp, sp = cos(pitch), sin(pitch)
+    cy, sy = cos(yaw), sin(yaw)
+    cr, sr = cos(roll), sin(roll)
+    # Ry(yaw) . Rx(pitch) . Rz(roll), times the uniform scale
+    matrix = (scale*(cy*cr+sy*sp*sr), scale*(-cy*sr+sy*sp*cr), scale*sy*cp,
+              scale*cp*sr, scale*cp*cr, scale*-sp,
+              scale*(-sy*cr+cy*sp*sr), scale*(sy*sr+cy*sp*cr), scale*cy*cp)
+    return matrix, (position.x, position.y, position.z), scale
+
+
+def compose(parent, local):
+    """Return the transform applying ``local`` first, then ``parent``."""
+    (a0, a1, a2, a3, a4, a5, a6, a7, a8), (px, py, pz), parentScale = parent
+    (b0, b1, b2, b3, b4, b5, b6, b7, b8), (lx, ly, lz), localScale = local
+    matrix = (a0*b0+a1*b3+a2*b6, a0*b1+a1*b4+a2*b7, a0*b2+a1*b5+a2*b8,
+              a3*b0+a4*b3+a5*b6, a3*b1+a4*b4+a5*b7, a3*b2+a4*b5+a5*b8,
+              a6*b0+a7*b3+a8*b6, a6*b1+a7*b4+a8*b7, a6*b2+a7*b5+a8*b8)
+    translation = (a0*lx+a1*ly+a2*lz+px, a3*lx+a4*ly+a5*lz+py, a6*lx+a7*ly+a8*lz+pz)
+    return matrix, translation, parentScale*localScale
+
+
+def applyTransform(transform, v) -> vec3:
+    """Move the point ``v`` by ``transform``."""
+    (m0, m1, m2, m3, m4, m5, m6, m7, m8), (tx, ty, tz), _ = transform
+    x, y, z = v.x, v.y, v.z
+    return vec3(m0*x+m1*y+m2*z+tx, m3*x+m4*y+m5*z+ty, m6*x+m7*y+m8*z+tz)
+
+
+def localBounds(mesh):
+    """Bounding sphere (culling.BVHNode) of a mesh in its own coordinates."""
+    if isinstance(mesh, mg.ArrayMesh):
+        return mesh.bounds
+    if isinstance(mesh, mg.IndexedMesh):
+        return mesh.bvh
+    raise TypeError(f"scene nodes need an IndexedMesh or an ArrayMesh, not {type(mesh).__name__}")
+
+
+def worldMesh(mesh, transform):
+    """Return a copy of ``mesh`` moved by ``transform``.
+
+    Only vertex positions, normals and bounding spheres are transformed; the
+    face indices, the BVH leaf lists, the shading points of the face corners
+    and the baked ambient occlusion are shared with ``mesh``.
+    """
+    matrix, translation, scale = transform
+    # Normals turn by matrix*scale: rotation times scale**2, which keeps them
+    # on the outer side of the faces when the scale is negative (mirroring)
+    normalMatrix = tuple(m*scale for m in matrix)
+    if isinstance(mesh, mg.ArrayMesh):
+        np = mg.np
+        rotation = np.array(matrix).reshape(3, 3)
+        vertices = mesh.vertices @ rotation.T + np.array(translation)
+        # Cross products of moved edges: normals turn with the mesh and grow by scale**2
+        normals = mesh.normals @ (rotation.T*scale)
+        bounds = mesh.bounds
+        bounds = culling.BVHNode(applyTransform(transform, bounds.center), bounds.radius*abs(scale))
+        return mg.ArrayMesh(vertices, mesh.indices, normals, bounds, smoothNormals(mesh.smooth, normalMatrix),
+                            mesh.occlusion)
+    (m0, m1, m2, m3, m4, m5, m6, m7, m8), (tx, ty, tz), _ = transform
+    vertices = [vec3(m0*v.x+m1*v.y+m2*v.z+tx, m3*v.x+m4*v.y+m5*v.z+ty, m6*v.x+m7*v.y+m8*v.z+tz)
+                for v in mesh.vertices]
+    m0, m1, m2, m3, m4, m5, m6, m7, m8 = normalMatrix
+    normals = [vec3(m0*n.x+m1*n.y+m2*n.z, m3*n.x+m4*n.y+m5*n.z, m6*n.x+m7*n.y+m8*n.z)
+               for n in mesh.normals]
+    bvh = culling.transformBVH(mesh.bvh, lambda v: applyTransform(transform, v), scale)
+    return mg.IndexedMesh(vertices, mesh.faces, normals, bvh, smoothNormals(mesh.smooth, normalMatrix),
+                          mesh.occlusion)
+
+
+def smoothNormals(smooth, matrix):
+    """Copy of the mg.VertexNormals ``smooth`` with its normals turned by ``matrix``."""
+    m0, m1, m2, m3, m4, m5, m6, m7, m8 = matrix
+    normals = [vec3(m0*n.x+m1*n.y+m2*n.z, m3*n.x+m4*n.y+m5*n.z, m6*n.x+m7*n.y+m8*n.z)
+               for n in smooth.normals]
+    return mg.VertexNormals(smooth.corners, smooth.vertices, normals)
+
+
+class SceneNode:
+    """Node of the scene graph.
+
+    Args:
+        mesh (IndexedMesh | ArrayMesh, optional): Mesh drawn at this node;
+            None for a pure grouping node.
+        position (vec3, optional): Translation relative to the parent.
+        rotation (tuple[float, float, float]): ``(pitch, yaw, roll)`` in
+            radians relative to the parent.
+        scale (float): Uniform scale factor relative to the parent.
+        static (bool): Keep the world-space copy of the mesh between frames.
+    """
+
+    def __init__(self, mesh=None, position=None, rotation=(0.0, 0.0, 0.0), scale=1.0, static=True) -> None:
+        if scale == 0:
+            raise ValueError("scale must not be zero")
+        if mesh is not None:
+            localBounds(mesh)
+        self.mesh = mesh
+        self.position = position if position is not None else vec3(0, 0, 0)
+        self.rotation = rotation
+        self.scale = scale
+        self.static = static
+        self.children = []
+        self._state = None
+        self._local = None
+        self._world = None
+        self._transform = None
+        self._caster = None
+        self._casterTransform = None
+
+    def add(self, child):
+        """Attach ``child`` to this node and return it."""
+        self.children.append(child)
+        return child
+
+    def localTransform(self):
+        """Transform of this node relative to its parent, rebuilt only when it changed."""
+        state = (self.position.printco(), tuple(self.rotation), self.scale)
+        if state != self._state:
+            self._state = state
+            self._local = localTransform(self.position, self.rotation, self.scale)
+        return self._local
+
+    def worldMesh(self, transform, level=0):
+        """World-space copy of level ``level`` of the mesh for the world ``transform`` of this node."""
+        if self._world is not None and (transform, level) == self._transform:
+            return self._world
+        world = worldMesh(self.mesh if level == 0 else self.mesh.lods[level-1][1], transform)
+        if self.static:
+            self._world, self._transform = world, (transform, level)
+        else:
+            self._world = self._transform = None
+        return world
+
+    def casterMesh(self, transform):
+        """World-space copy of the full mesh casting the shadows of this node.
+
+        Kept between frames like ``worldMesh()`` for a static node; the mesh
+        itself (with its levels of detail) for the identity transform.
+        """
+        if transform == IDENTITY:
+            return self.mesh
+        if self._caster is not None and transform == self._casterTransform:
+            return self._caster
+        caster = worldMesh(self.mesh, transform)
+        if self.static:
+            self._caster, self._casterTransform = caster, transform
+        return caster
+
+
+class Scene:
+    """Root of a scene graph, rendered with ``putMesh(cam, lights)``.
+
+    Args:
+        shadowMaps (shadows.ShadowMaps, optional): Shadow maps of the lights,
+            updated with the nodes as casters by ``putMesh()``.
+    """
+
+    def __init__(self, shadowMaps=None) -> None:
+        self.root = SceneNode()
+        self.shadowMaps = shadowMaps
+
+    def add(self, node):
+        """Attach ``node`` at the root of the scene and return it."""
+        return self.root.add(node)
+
+    def nodes(self):
+        """Yield ``(node, world transform)`` for every node, parents first."""
+        stack = [(self.root, IDENTITY)]
+        while stack:
+            node, parent = stack.pop()
+            transform = compose(parent, node.localTransform())
+            yield node, transform
+            stack.extend((child, transform) for child in reversed(node.children))
+
+    def putMesh(self, cam, lights):
+        """Render every node into ``moteur_graphique.pixelBuffer`` like ``putMesh()``."""
+        planes = culling.sidePlanes(cam, mg.width, mg.height, mg.aspect)
+        visible = []
+        casters = []
+        culled = 0
+        for node, transform in self.nodes():
+            if node.mesh is None:
+                continue
+            if self.shadowMaps is not None and mg.SHADOWS_ENABLED:
+                casters.append(node.casterMesh(transform))
+            bounds = localBounds(node.mesh)
+            sphere = culling.BVHNode(applyTransform(transform, bounds.center), bounds.radius*abs(transform[2]))
+            if not culling.visibleLeaves(sphere, cam, planes):
+                culled += 1
+                continue
+            visible.append((sphere, node, transform))
+        if not mg.DEPTH_BUFFER_ENABLED:
+            visible.sort(key=lambda item: (item[0].center-cam.position).length(), reverse=True)
+        if mg.profiler is not None:
+            mg.profiler.add('nodesCulled', culled)
+        previous = mg.shadowMaps
+        if self.shadowMaps is not None and mg.SHADOWS_ENABLED:
+            self.shadowMaps.update(lights, casters)
+            mg.shadowMaps = self.shadowMaps
+        try:
+            for sphere, node, transform in visible:
+                if transform == IDENTITY:
+                    # Already in world space; putMesh() picks the level of detail
+                    mesh = node.mesh
+                else:
+                    level, _ = mg.selectLod(node.mesh, cam, sphere)
+                    mesh = node.worldMesh(transform, level)
+                mg.putMesh(mesh, cam, lights)
+        finally:
+            mg.shadowMaps = previous
@@ -0,0 +1,334 @@
+"""Shadow maps for the point lights of the scene.
+
+A ShadowMap is the depth of the shadow casters seen from one light,
+rendered with the usual pipeline: ``ViewTransform`` per vertex, ``clip()``
+at the near plane and ``putTriangle()`` with its depth buffer, into a square
+Framebuffer of its own. A light outside the bounding sphere of the casters
+gets one perspective map fitted to that sphere; a light inside it gets a
+cube of six 90-degree maps. The lighting then asks ``visibility()`` how much
+of a 3x3 block of texels around a point sees the light.
+
+``ShadowMaps`` keeps one map per light and rebuilds it only when the light
+or the casters moved. A light that moved at two frames in a row is treated
+as animated and rebuilt at ``DYNAMIC_MAP_SIZE`` instead of
+``SHADOW_MAP_SIZE``, and the casters are drawn at the coarsest level of
+detail that stays within ``SHADOW_LOD_ERROR`` texels, so the cost per frame
+of animated lights stays bounded. Once such a light stops, its map is built
+again once at full size.
+
+Usage:
+    shadows = ShadowMaps()
+    mg.shadowMaps = shadows
+    shadows.update(lights, [mesh])  # once per frame, before putMesh()
+    mg.putMesh(mesh, cam, lights)
+"""
+from math import asin, atan2, pi, tan
+from time import perf_counter
+
+import culling
+import lod
+import moteur_graphique as mg
+from lib_math import Triangle2D, Triangle3D, ViewTransform, dot, vec3
+
+# Texels across a map of a still light (each face of a cube map)
+SHADOW_MAP_SIZE = 96
+# Texels across a map of a light that keeps moving
+DYNAMIC_MAP_SIZE = 32
+# Largest projected error of the caster levels of detail, in texels
+SHADOW_LOD_ERROR = 1.0
+# Offsets of the point looked up, in texels at its distance: along the
+# surface normal, and toward the light in depth, against self-shadowing
+NORMAL_OFFSET = 1.5
+DEPTH_BIAS = 1.0
+# Distance of the near plane of the light cameras (as ``clip()``)
+NEAR = 0.1
+
+# (pitch, yaw) of the cube faces looking along +x, -x, +y, -y, +z, -z
+# (see Camera.getLookAtDirection)
+CUBE_FACES = ((0.0, -pi/2), (0.0, pi/2), (pi/2, 0.0), (-pi/2, 0.0), (0.0, 0.0), (0.0, pi))
+
+# Incremented by every map built; ShadingCache compares it per light
+_builds = 0
+
+
+def casterBounds(casters) -> culling.BVHNode:
+    """Bounding sphere of all the caster meshes."""
+    spheres = []
+    for mesh in casters:
+        if isinstance(mesh, mg.ArrayMesh):
+            spheres.append(mesh.bounds)
+        elif isinstance(mesh, mg.IndexedMesh):
+            spheres.append(mesh.bvh)
+        elif mesh:
+            points = [v for triangle in mesh for v in (triangle.v1, triangle.v2, triangle.v3)]
+            center = (1/len(points))*sum(points[1:], points[0])
+            spheres.append(culling.BVHNode(center, max((v-center).length() for v in points)))
+    if not spheres:
+        return culling.BVHNode(vec3(0, 0, 0), 0.0)
+    # Grow a sphere around each of them in turn
+    center, radius = spheres[0].center, spheres[0].radius
+    for sphere in spheres[1:]:
+        offset = sphere.center-center
+        distance = offset.length()
+        if distance+sphere.radius <= radius:
+            continue
+        if distance+radius <= sphere.radius:
+            center, radius = sphere.center, sphere.radius
+            continue
+        newRadius = (distance+radius+sphere.radius)/2
+        center = center+((newRadius-radius)/distance)*offset
+        radius = newRadius
+    return culling.BVHNode(center, radius)
+
+
+def _changed(casters, previous) -> bool:
+    """True unless ``casters`` are the very mesh objects of ``previous``."""
+    return len(casters) != len(previous) or any(a is not b for a, b in zip(casters, previous))
+
+
+def _geometry(mesh):
+    """Return ``(vertices, faces)`` of any supported mesh: vec3 positions and index triples."""
+    if isinstance(mesh, mg.ArrayMesh):
+        return [vec3(*v) for v in mesh.vertices.tolist()], [tuple(face) for face in mesh.indices.tolist()]
+    if isinstance(mesh, mg.IndexedMesh):
+        return mesh.vertices, mesh.faces
+    vertices = [v for triangle in mesh for v in (triangle.v1, triangle.v2, triangle.v3)]
+    return vertices, [(i, i+1, i+2) for i in range(0, len(vertices), 3)]
+
+
+class ShadowMap:
+    """Depth of the casters seen from one light.
+
+    Attributes:
+        state (tuple[float, float, float]): Position of the light when the
+            map was built.
+        position (vec3): The same as a vector.
+        size (int): Texels across each face.
+        faces (list[tuple[ViewTransform, vec3, list[float]]]): View transform,
+            look-at direction and per-texel 1/z (0 where nothing was drawn)
+            of each face, one for a perspective map and six for a cube map.
+        version (int): Unique number of this build.
+    """
+
+    def __init__(self, state, size, faces) -> None:
+        global _builds
+        _builds += 1
+        self.state = state
+        self.position = vec3(*state)
+        self.size = size
+        self.faces = faces
+        self.version = _builds
+
+    def visibility(self, point, normal) -> float:
+        """Fraction of the light reaching ``point``, from 0 (shadowed) to 1.
+
+        Args:
+            point (vec3): World position lit.
+            normal (vec3): Unit normal of the surface at ``point``.
+        """
+        size = self.size
+        direction = point-self.position
+        faces = self.faces
+        if len(faces) == 1:
+            transform, lookAt, depth = faces[0]
+        else:
+            # Cube face of the dominant axis of the direction to the point
+            x, y, z = direction.x, direction.y, direction.z
+            ax, ay, az = abs(x), abs(y), abs(z)
+            if ax >= ay and ax >= az:
+                face = 0 if x > 0 else 1
+            elif ay >= az:
+                face = 2 if y > 0 else 3
+            else:
+                face = 4 if z > 0 else 5
+            transform, lookAt, depth = faces[face]
+        distance = dot(direction, lookAt)
+        if distance <= NEAR:
+            return 1.0
+        # World size of a texel at that distance
+        texel = 2*distance/(transform.focalLenth*(size-1))
+        view = transform.view(point+(NORMAL_OFFSET*texel)*normal)
+        z = view.z
+        if z <= NEAR:
+            return 1.0
+        screen = transform.screen(view)
+        column, row = round(screen.x), round(screen.y)
+        limit = z-DEPTH_BIAS*texel
+        lit = 0
+        for j in (row-1, row, row+1):
+            if not 0 <= j < size:
+                lit += 3
+                continue
+            base = j*size
+            for i in (column-1, column, column+1):
+                if not 0 <= i < size:
+                    lit += 1
+                    continue
+                stored = depth[base+i]
+                # Lit unless something is closer to the light than the point
+                if stored == 0 or 1/stored >= limit:
+                    lit += 1
+        return lit/9
+
+
+class ShadowMaps:
+    """Shadow maps of a list of lights, rebuilt only when a light or the casters move.
+
+    Args:
+        size (int): Texels across the maps of still lights.
+        dynamicSize (int): Texels across the maps of moving lights.
+    """
+
+    def __init__(self, size=SHADOW_MAP_SIZE, dynamicSize=DYNAMIC_MAP_SIZE) -> None:
+        self.size = size
+        self.dynamicSize = dynamicSize
+        self.maps = []
+        self.lights = []
+        self.builds = 0
+        self._states = []
+        self._moved = []
+        self._planCasters = []
+        self._casters = []
+        self._bounds = None
+        self._geometry = {}
+        self._framebuffers = {}
+
+    @property
+    def moving(self) -> bool:
+        """True when a light or the casters moved at the last ``plan()``.
+
+        Some maps may then be at the lower resolution: one more update once
+        everything is still builds them at full size.
+        """
+        return any(self._moved)
+
+    def get(self, index, light):
+        """Map of ``light``, the ``index``-th light given to the last ``update()``, or None."""
+        if index < len(self.lights) and self.lights[index] is light:
+            return self.maps[index]
+        return None
+
+    def plan(self, lights, casters) -> list[int]:
+        """Record the motion of the lights and casters and return the map size of each light.
+
+        A light that moved (or whose casters moved) at this call and the
+        previous one gets ``dynamicSize``, any other ``size``. ``update()``
+        calls it once per frame unless it is given the sizes.
+        """
+        castersMoved = bool(self._planCasters) and _changed(casters, self._planCasters)
+        self._planCasters = list(casters)
+        if len(lights) != len(self._states):
+            self._states = [None]*len(lights)
+            self._moved = [False]*len(lights)
+        sizes = []
+        for i, light in enumerate(lights):
+            state = light.position.printco()
+            moved = castersMoved or (self._states[i] is not None and state != self._states[i])
+            # Moving two frames in a row: animated, built at the lower resolution
+            sizes.append(self.dynamicSize if moved and self._moved[i] else self.size)
+            self._states[i] = state
+            self._moved[i] = moved
+        return sizes
+
+    def update(self, lights, casters, sizes=None):
+        """Rebuild the maps of the lights that moved, or all of them for new casters.
+
+        Calling it again for the same frame changes nothing.
+
+        Args:
+            lights (list[LightSource]): Lights of the frame, in the order
+                given to the lighting.
+            casters (list[IndexedMesh | ArrayMesh | list[Triangle3D]]): World
+                space meshes that cast shadows. The same mesh objects from
+                one frame to the next mean the geometry did not move.
+            sizes (list[int], optional): Map size of each light, from a
+                ``plan()`` made elsewhere (``parallel.py``); planned here by
+                default.
+        """
+        start = perf_counter()
+        if sizes is None:
+            sizes = self.plan(lights, casters)
+        if _changed(casters, self._casters):
+            self._casters = list(casters)
+            self._bounds = casterBounds(casters)
+            self._geometry = {}
+            self.maps = []
+        if len(lights) != len(self.maps):
+            self.maps = [None]*len(lights)
+        self.lights = list(lights)
+        for i, light in enumerate(lights):
+            state = light.position.printco()
+            shadowMap = self.maps[i]
+            if shadowMap is None or shadowMap.state != state or shadowMap.size != sizes[i]:
+                self.maps[i] = self._build(state, sizes[i])
+                self.builds += 1
+        if mg.profiler is not None:
+            mg.profiler.add('shadows', perf_counter()-start)
+
+    def _build(self, state, size) -> ShadowMap:
+        position = vec3(*state)
+        bounds = self._bounds
+        offset = bounds.center-position
+        distance = offset.length()
+        if distance > bounds.radius*1.01 and bounds.radius > 0:
+            # Outside the casters: one perspective map fitted to their sphere
+            direction = (1/distance)*offset
+            pitch = asin(max(-1.0, min(1.0, direction.y)))
+            yaw = atan2(-direction.x, direction.z)
+            focal = 1/tan(asin(bounds.radius/distance))
+            cameras = [mg.Camera(position, pitch, yaw, focal)]
+        else:
+            cameras = [mg.Camera(position, pitch, yaw, 1.0) for pitch, yaw in CUBE_FACES]
+        # Coarsest levels of detail whose error stays under a texel or so
+        geometry = []
+        for mesh in self._casters:
+            level = 0
+            if mg.LOD_ENABLED and getattr(mesh, 'lods', None):
+                meshBounds = mesh.bounds if isinstance(mesh, mg.ArrayMesh) else mesh.bvh
+                level = lod.selectLevel([error for error, _ in mesh.lods], meshBounds.center, meshBounds.radius,
+                                        cameras[0], size, 1.0, SHADOW_LOD_ERROR)
+            key = (id(mesh), level)
+            if key not in self._geometry:
+                self._geometry[key] = _geometry(mesh if level == 0 else mesh.lods[level-1][1])
+            geometry.append(self._geometry[key])
+        half = (size-1)/2
+        viewport = (half, half, half, half)
+        faces = [(ViewTransform(cam, viewport), cam.getLookAtDirection(), self._render(cam, viewport, geometry, size))
+                 for cam in cameras]
+        return ShadowMap(state, size, faces)
+
+    def _render(self, cam, viewport, geometry, size) -> list[float]:
+        """Rasterize ``geometry`` from ``cam`` and return the depth buffer (1/z per texel)."""
+        framebuffer = self._framebuffers.get(size)
+        if framebuffer is None:
+            framebuffer = self._framebuffers[size] = mg.Framebuffer(size, size)
+        framebuffer.clear()
+        transform = ViewTransform(cam, viewport)
+        toView, toScreen = transform.view, transform.screen
+        position = cam.position
+        lookAt = cam.getLookAtDirection()
+        zNear = position+NEAR*lookAt
+        previous = mg.useFramebuffer(framebuffer)
+        rows, mg.rasterRows = mg.rasterRows, None
+        try:
+            putTriangle, clip = mg.putTriangle, mg.clip
+            for vertices, faces in geometry:
+                outside = [dot(zNear-v, lookAt) > 0 for v in vertices]
+                views = [None if out else toView(v) for v, out in zip(vertices, outside)]
+                screen = [None if view is None else toScreen(view) for view in views]
+                for a, b, c in faces:
+                    if outside[a] or outside[b] or outside[c]:
+                        if outside[a] and outside[b] and outside[c]:
+                            continue
+                        for piece in clip(Triangle3D(vertices[a], vertices[b], vertices[c]), position, lookAt):
+                            v1, v2, v3 = toView(piece.v1), toView(piece.v2), toView(piece.v3)
+                            putTriangle(Triangle2D(toScreen(v1), toScreen(v2), toScreen(v3)), mg.lightGradient,
+                                        (v1.z, v2.z, v3.z))
+                        continue
+                    # Both sides are drawn: the casters need not be closed
+                    putTriangle(Triangle2D(screen[a], screen[b], screen[c]), mg.lightGradient,
+                                (views[a].z, views[b].z, views[c].z))
+        finally:
+            mg.rasterRows = rows
+            mg.useFramebuffer(previous)
+        return list(framebuffer.depth)
@@ -0,0 +1,45 @@
+"""Cursor moves written by ``moteur_graphique.encodeFrame()`` for viewports.
+
+Run with ``python -m unittest test_encode_frame`` (or pytest).
+"""
+import unittest
+
+import moteur_graphique as mg
+
+RED = mg.color(200, 0, 0) + '█'
+RED_BG = '\033[48;2;200;0;0m'
+
+
+def filled(columns, rows, left=0, top=0):
+    fb = mg.Framebuffer(columns, rows, left=left, top=top)
+    fb.pixels[:] = [RED] * (columns * rows)
+    return fb
+
+
+class EncodeFrameTest(unittest.TestCase):
+
+    def test_offset_viewport_moves_to_each_row(self):
+        out = mg.encodeFrame(filled(4, 3, left=10, top=2))
+        self.assertEqual(out, '\033[3;11H' + RED_BG + '    '
+                              '\033[4;11H    '
+                              '\033[5;11H    '
+                              '\033[49m\033[6;1H')
+
+    def test_narrow_viewport_does_not_rely_on_wrapping(self):
+        out = mg.encodeFrame(filled(4, 2))
+        self.assertEqual(out, '\033[1;1H' + RED_BG + '    \033[2;1H    \033[49m\033[3;1H')
+
+    def test_full_width_viewport_wraps_to_the_next_row(self):
+        columns = mg.terminalSize()[0]
+        out = mg.encodeFrame(filled(columns, 2))
+        self.assertEqual(out, '\033[1;1H' + RED_BG + ' ' * (2 * columns) + '\033[49m\033[3;1H')
+
+    def test_gap_in_a_row_is_a_relative_move(self):
+        fb = filled(6, 2, left=3)
+        mg.encodeFrame(fb)
+        fb.pixels[1] = fb.pixels[4] = ' '
+        self.assertEqual(mg.encodeFrame(fb), '\033[1;5H \033[2C \033[3;1H')
+
+
+if __name__ == '__main__':
+    unittest.main()